@@ -2,12 +2,16 @@ import logging
 import os
 import sys
 
-import hocort.execute as exe
+import hocort.catalog as catalog
 from hocort.parse.parser import ArgParser
 from hocort.parse.parser import validate_args
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
+# Options which make BBMap keep the first of equally good sites and report no secondary ones, see align(decision_only=True).
+DECISION_OPTIONS = ['ambiguous=first', 'secondary=f']
+
 
 class BBMap():
     """
@@ -51,10 +55,15 @@ class BBMap():
         if not path_out:
             raise ValueError(f'No output path was given.')
         cmd = ['bbmap.sh', f'threads={str(threads)}', f'ref={fasta_in}', f'path={path_out}']
+        # bbmap.sh sizes the Java heap from the memory of the machine, which ignores container limits
+        heap = resources.java_heap()
+        if heap and not any('-Xmx' in option for option in options):
+            cmd += [f'-Xmx{heap // 2**20}m']
+        cmd += options
 
         return [cmd]
 
-    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[]):
+    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[], unaligned=None, aligned=None, decision_only=False):
         """
         Aligns FastQ sequences to reference genome and outputs a SAM file.
 
@@ -73,6 +82,16 @@ class BBMap():
             Number of threads to use.
         options : list
             An options list where additional arguments may be specified.
+        unaligned : list
+            Paths where the reads which fail to align are written by BBMap itself (outu=, outu2=),
+            one for unpaired reads, two for paired reads. The format follows the extension (e.g. .fastq.gz).
+            Without an output, BBMap then writes no SAM at all.
+        aligned : list
+            Paths where the reads which align are written by BBMap itself (outm=, outm2=), like unaligned.
+            A pair is written here if either of its reads aligns.
+        decision_only : bool
+            Whether to only decide whether reads align, rather than search for their best alignment:
+            BBMap keeps the first of equally good sites and reports no secondary ones (ambiguous=first secondary=f).
 
         Returns
         -------
@@ -87,7 +106,7 @@ class BBMap():
 
         """
         # validate input
-        valid, arg, chars = validate_args([index, seq1, output, seq2] + options)
+        valid, arg, chars = validate_args([index, seq1, output, seq2] + options + (unaligned or []) + (aligned or []))
         if not valid:
             raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
 
@@ -95,12 +114,22 @@ class BBMap():
             raise ValueError(f'No index path was given.')
         if not seq1:
             raise ValueError(f'No input FastQ was given.')
+        index = catalog.lookup(index, 'bbmap')
         cmd = ['bbmap.sh', f'threads={str(threads)}', f'path={index}']
+        # bbmap.sh sizes the Java heap from the memory of the machine, which ignores container limits
+        heap = resources.java_heap()
+        if heap and not any('-Xmx' in option for option in options):
+            cmd += [f'-Xmx{heap // 2**20}m']
         if output:
             cmd += [f'out={output}']
+        for key, paths in [('outu', unaligned), ('outm', aligned)]:
+            for mate, path in zip(['', '2'], paths or []):
+                cmd += [f'{key}{mate}={path}']
         if seq2:
             cmd += [f'in={seq1}', f'in2={seq2}']
         else: cmd += [f'in={seq1}']
+        if decision_only:
+            cmd += DECISION_OPTIONS
         cmd += options
 
         return [cmd]
@@ -121,7 +150,7 @@ class BBMap():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} aligner',
-            usage=f'hocort index {self.__class__.__name__} [-h] [--threads <int>] -i <fasta> -o <index>'
+            usage=f'hocort index {self.__class__.__name__} [-h] [--name <str>] [--force <bool>] [--threads <int>] -i <fasta> -o <index>'
         )
         parser.add_argument(
             '-i',
@@ -145,8 +174,23 @@ class BBMap():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register the index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the index even if it was already built from the same FASTA file with the same tool version and parameters (default: false)'
         )
         parsed = parser.parse_args(args=args)
 
@@ -165,6 +209,4 @@ class BBMap():
             sys.exit(1)
 
         cmd = self.build_index(out, ref, threads=threads)
-        logger.info(f'Generating index for: {self.__class__.__name__}')
-        returncode = exe.execute(cmd, pipe=False, merge_stdout_stderr=True)
-        return returncode[0]
+        return catalog.build('bbmap', out, ref, cmd, {}, name=parsed.name, force=parsed.force == 'true')
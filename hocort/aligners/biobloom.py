@@ -2,9 +2,10 @@ import logging
 import os
 import sys
 
-import hocort.execute as exe
+import hocort.catalog as catalog
 from hocort.parse.parser import ArgParser
 from hocort.parse.parser import validate_args
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
@@ -95,6 +96,7 @@ class BioBloom():
             raise ValueError(f'No index path was given.')
         if not seq1:
             raise ValueError(f'No input FastQ was given.')
+        index = catalog.lookup(index, 'biobloom')
         cmd = ['biobloomcategorizer', '-t', str(threads), '-f', index, '--fq', '-p', out]
         if seq2:
             cmd += ['--paired_mode', seq1, seq2]
@@ -119,7 +121,7 @@ class BioBloom():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} aligner',
-            usage=f'hocort index {self.__class__.__name__} [-h] [--threads <int>] -i <fasta> -o <index>'
+            usage=f'hocort index {self.__class__.__name__} [-h] [--name <str>] [--force <bool>] [--threads <int>] -i <fasta> -o <index>'
         )
         parser.add_argument(
             '-i',
@@ -143,8 +145,23 @@ class BioBloom():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register the index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the index even if it was already built from the same FASTA file with the same tool version and parameters (default: false)'
         )
         parsed = parser.parse_args(args=args)
 
@@ -160,6 +177,4 @@ class BioBloom():
             sys.exit(1)
 
         cmd = self.build_index(out, ref, threads=threads)
-        logger.info(f'Generating index for: {self.__class__.__name__}')
-        returncode = exe.execute(cmd, pipe=False, merge_stdout_stderr=True)
-        return returncode[0]
+        return catalog.build('biobloom', os.path.join(out, 'reference.bf'), ref, cmd, {}, name=parsed.name, force=parsed.force == 'true')
@@ -2,19 +2,24 @@ import logging
 import os
 import sys
 
-import hocort.execute as exe
+import hocort.catalog as catalog
 from hocort.parse.parser import ArgParser
 from hocort.parse.parser import validate_args
+from hocort.parse.fastq import FastQ
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
+# Options which make Bowtie2 stop at the first valid alignment of a read, see align(decision_only=True).
+DECISION_OPTIONS = ['-k', '1']
+
 
 class Bowtie2():
     """
     Bowtie2 implementation of the Aligner abstract base class.
 
     """
-    def build_index(self, path_out, fasta_in, options=[], **kwargs):
+    def build_index(self, path_out, fasta_in, threads=1, options=[], **kwargs):
         """
         Builds an index.
 
@@ -50,11 +55,11 @@ class Bowtie2():
             raise ValueError(f'No input FASTA file was given.')
         if not path_out:
             raise ValueError(f'No output path was given.')
-        cmd = ['bowtie2-build'] + options + [fasta_in, path_out]
+        cmd = ['bowtie2-build', '--threads', str(threads)] + options + [fasta_in, path_out]
 
         return [cmd]
 
-    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[]):
+    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[], mmap=False, unaligned=None, aligned=None, decision_only=False):
         """
         Aligns FastQ sequences to reference genome and outputs a SAM file.
 
@@ -73,6 +78,18 @@ class Bowtie2():
             Number of threads to use.
         options : list
             An options list where additional arguments may be specified.
+        mmap : bool
+            Whether to memory-map the index (--mm), so concurrent processes share one copy of it in memory.
+        unaligned : list
+            Paths where the reads which fail to align are written as FastQ by Bowtie2 itself (--un, --un-conc),
+            one for unpaired reads, two for paired reads. For paired reads these are the pairs which fail to align
+            concordantly, and the paths must only differ in the mate number. Compressed with gzip if the paths end with '.gz'.
+        aligned : list
+            Paths where the reads which align are written as FastQ by Bowtie2 itself (--al, --al-conc),
+            like unaligned. For paired reads these are the pairs which align concordantly.
+        decision_only : bool
+            Whether to only decide whether reads align, rather than search for their best alignment:
+            Bowtie2 stops searching at the first valid alignment of a read (-k 1).
 
         Returns
         -------
@@ -84,10 +101,11 @@ class Bowtie2():
         ValueError
             Raised if no input index path is given, or no input FastQ file is given.
             If disallowed characters are found in input.
+            If the paired unaligned or aligned paths differ in anything but the mate number.
 
         """
         # validate input
-        valid, arg, chars = validate_args([index, seq1, output, seq2] + options)
+        valid, arg, chars = validate_args([index, seq1, output, seq2] + options + (unaligned or []) + (aligned or []))
         if not valid:
             raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
 
@@ -95,9 +113,25 @@ class Bowtie2():
             raise ValueError(f'No index path was given.')
         if not seq1:
             raise ValueError(f'No input FastQ was given.')
+        index = catalog.lookup(index, 'bowtie2')
         cmd = ['bowtie2', '-p', str(threads), '-x', index, '-q']
         if output:
             cmd += ['-S', output]
+        if mmap:
+            cmd += ['--mm']
+        for flag, paths in [('--un', unaligned), ('--al', aligned)]:
+            if not paths:
+                continue
+            gz = '-gz' if paths[0].endswith('.gz') else ''
+            if seq2:
+                pattern = FastQ.mate_pattern(paths[0], paths[1])
+                if not pattern:
+                    raise ValueError(f'Paired output FastQ files must only differ in the mate number: {paths[0]} {paths[1]}')
+                cmd += [f'{flag}-conc{gz}', pattern]
+            else:
+                cmd += [f'{flag}{gz}', paths[0]]
+        if decision_only:
+            cmd += DECISION_OPTIONS
         cmd += options
         if seq2:
             cmd += ['-1', seq1, '-2', seq2]
@@ -121,7 +155,7 @@ class Bowtie2():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} aligner',
-            usage=f'hocort index {self.__class__.__name__} [-h] -i <fasta> -o <index>'
+            usage=f'hocort index {self.__class__.__name__} [-h] [--name <str>] [--force <bool>] [--threads <int>] -i <fasta> -o <index>'
         )
         parser.add_argument(
             '-i',
@@ -139,10 +173,35 @@ class Bowtie2():
             metavar=('<index>'),
             help='str: path to output index (dir/basename) (required)'
         )
+        parser.add_argument(
+            '-t',
+            '--threads',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register the index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the index even if it was already built from the same FASTA file with the same tool version and parameters (default: false)'
+        )
         parsed = parser.parse_args(args=args)
 
         ref = parsed.input
         out = parsed.output
+        threads = parsed.threads
 
         s = os.path.split(out)
         out_dir = s[0]
@@ -154,7 +213,5 @@ class Bowtie2():
             logger.error(f'Output path does not exist: {out}')
             sys.exit(1)
 
-        cmd = self.build_index(out, ref)
-        logger.info(f'Generating index for: {self.__class__.__name__}')
-        returncode = exe.execute(cmd, pipe=False, merge_stdout_stderr=True)
-        return returncode[0]
+        cmd = self.build_index(out, ref, threads=threads)
+        return catalog.build('bowtie2', out, ref, cmd, {}, name=parsed.name, force=parsed.force == 'true')
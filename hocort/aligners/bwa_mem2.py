@@ -2,12 +2,15 @@ import logging
 import os
 import sys
 
-import hocort.execute as exe
+import hocort.catalog as catalog
 from hocort.parse.parser import ArgParser
 from hocort.parse.parser import validate_args
 
 logger = logging.getLogger(__file__)
 
+# Options which keep BWA-MEM2 from listing alternative hits (XA tag), see align(decision_only=True).
+DECISION_OPTIONS = ['-h', '0']
+
 
 class BWA_MEM2():
     """
@@ -52,7 +55,7 @@ class BWA_MEM2():
 
         return [cmd]
 
-    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[]):
+    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[], decision_only=False):
         """
         Aligns FastQ sequences to reference genome and outputs a SAM file.
 
@@ -71,6 +74,9 @@ class BWA_MEM2():
             Number of threads to use.
         options : list
             An options list where additional arguments may be specified.
+        decision_only : bool
+            Whether to only decide whether reads align, rather than search for their best alignment:
+            BWA-MEM2 lists no alternative hits in the XA tag (-h 0); it reports no secondary alignments by default.
 
         Returns
         -------
@@ -93,12 +99,15 @@ class BWA_MEM2():
             raise ValueError(f'No index path was given.')
         if not seq1:
             raise ValueError(f'No input FastQ was given.')
+        index = catalog.lookup(index, 'bwamem2')
         cmd = ['bwa-mem2', 'mem', '-t', str(threads)]
         if output:
             cmd += ['-o', output]
         cmd += [index, seq1]
         if seq2:
             cmd += [seq2]
+        if decision_only:
+            cmd += DECISION_OPTIONS
         cmd += options
 
         return [cmd]
@@ -119,7 +128,7 @@ class BWA_MEM2():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} aligner',
-            usage=f'hocort index {self.__class__.__name__} [-h] -i <fasta> -o <index>'
+            usage=f'hocort index {self.__class__.__name__} [-h] [--name <str>] [--force <bool>] -i <fasta> -o <index>'
         )
         parser.add_argument(
             '-i',
@@ -137,6 +146,21 @@ class BWA_MEM2():
             metavar=('<index>'),
             help='str: path to output index (dir/basename) (required)'
         )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register the index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the index even if it was already built from the same FASTA file with the same tool version and parameters (default: false)'
+        )
         parsed = parser.parse_args(args=args)
 
         ref = parsed.input
@@ -153,6 +177,4 @@ class BWA_MEM2():
             sys.exit(1)
 
         cmd = self.build_index(out, ref)
-        logger.info(f'Generating index for: {self.__class__.__name__}')
-        returncode = exe.execute(cmd, pipe=False, merge_stdout_stderr=True)
-        return returncode[0]
+        return catalog.build('bwamem2', out, ref, cmd, {}, name=parsed.name, force=parsed.force == 'true')
@@ -1,20 +1,106 @@
+import glob
 import logging
 import os
 import sys
 
 import hocort.execute as exe
+import hocort.indexes as indexes
+import hocort.catalog as catalog
 from hocort.parse.parser import ArgParser
 from hocort.parse.parser import validate_args
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
+# Directory where the NCBI taxonomy is cached and shared by the index builds, None to download it for every index.
+# Can be set with the environment variable HOCORT_TAXONOMY_DIR.
+TAXONOMY_DIR = os.environ.get('HOCORT_TAXONOMY_DIR') or None
+
+# Files of the taxonomy which are linked into a new database: the taxonomy tree and the accession to taxid maps.
+TAXONOMY_FILES = ['nodes.dmp', 'names.dmp', '*.accession2taxid']
+
 
 class Kraken2():
     """
     Kraken2 implementation of the Classifier abstract base class.
 
     """
-    def build_index(self, path_out, fasta_in, threads=1, options=[], **kwargs):
+    def taxonomy_files(self, taxonomy):
+        """
+        Lists the files of a cached taxonomy.
+
+        Parameters
+        ----------
+        taxonomy : string
+            Taxonomy directory, or a directory containing it as taxonomy/ (as downloaded by download_taxonomy()).
+
+        Returns
+        -------
+        files : list
+            Paths of the files which are linked into a new database, sorted.
+            Empty if the taxonomy tree (nodes.dmp and names.dmp) is missing.
+
+        """
+        if not os.path.isfile(os.path.join(taxonomy, 'nodes.dmp')):
+            taxonomy = os.path.join(taxonomy, 'taxonomy')
+        if not all(os.path.isfile(os.path.join(taxonomy, name)) for name in TAXONOMY_FILES[:2]):
+            return []
+        files = set()
+        for pattern in TAXONOMY_FILES:
+            files.update(path for path in glob.glob(os.path.join(glob.escape(taxonomy), pattern)) if os.path.isfile(path))
+        return sorted(os.path.abspath(path) for path in files)
+
+    def download_taxonomy(self, taxonomy, threads=1):
+        """
+        Downloads the taxonomy into a cache directory (as <taxonomy>/taxonomy), unless it is already there.
+        Concurrent builds wait for the download instead of repeating it.
+
+        Parameters
+        ----------
+        taxonomy : string
+            Taxonomy cache directory.
+        threads : int
+            Number of threads to use.
+
+        Returns
+        -------
+        returncode : int
+            0 if the taxonomy is in the cache, the returncode of kraken2-build otherwise.
+
+        """
+        os.makedirs(taxonomy, exist_ok=True)
+        with indexes.locked(os.path.join(taxonomy, '.download.lock')):
+            if self.taxonomy_files(taxonomy):
+                logger.info(f'Using the cached taxonomy in: {taxonomy}')
+                return 0
+            logger.info(f'Downloading taxonomy into {taxonomy}, this may take a while...')
+            cmd = ['kraken2-build', '--threads', str(threads), '--download-taxonomy', '--db', taxonomy]
+            returncode = exe.execute([cmd], pipe=False, merge_stdout_stderr=True)[0]
+            if returncode == 0 and not self.taxonomy_files(taxonomy):
+                logger.error(f'No taxonomy was downloaded into: {taxonomy}')
+                return 1
+            return returncode
+
+    def taxonomy_parameters(self, taxonomy):
+        """
+        Describes a cached taxonomy as parameters of an index build (see catalog.build()),
+        so that an index is built again when the taxonomy is updated.
+
+        Parameters
+        ----------
+        taxonomy : string
+            Directory of the cached taxonomy, None if the taxonomy is downloaded.
+
+        Returns
+        -------
+        parameters : dict
+            Size and modification time of every file of the taxonomy, empty if it is downloaded.
+
+        """
+        files = self.taxonomy_files(taxonomy) if taxonomy else []
+        return {'taxonomy': indexes.describe(files, os.path.dirname(files[0]))} if files else {}
+
+    def build_index(self, path_out, fasta_in, threads=1, taxonomy=None, options=[], **kwargs):
         """
         Builds an index.
 
@@ -26,23 +112,27 @@ class Kraken2():
             Path where the input FASTA file is located.
         threads : int
             Number of threads to use.
+        taxonomy : string
+            Directory of a cached taxonomy (see taxonomy_files()), whose files are linked into the database
+            instead of downloading the taxonomy. None to download it.
         options : list
             An options list where additional arguments may be specified.
 
         Returns
         -------
         [cmd1, cmd2, cmd3, cmd4] : list
-            List of commands to be executed.
+            List of commands to be executed. If the taxonomy is cached, cmd1 is replaced by two commands
+            which link it, run after cmd2.
 
         Raises
         ------
         ValueError
             Raised if no input FASTA file is given, or no output path is given.
-            If disallowed characters are found in input.
+            If disallowed characters are found in input, or the taxonomy directory holds no taxonomy.
 
         """
         # validate input
-        valid, arg, chars = validate_args([path_out, fasta_in] + options)
+        valid, arg, chars = validate_args([path_out, fasta_in, taxonomy] + options)
         if not valid:
             raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
 
@@ -66,9 +156,18 @@ class Kraken2():
             # kraken2-build --threads n --clean --db database 
         cmd4 = ['kraken2-build', '--threads', str(threads), '--clean', '--db', path_out]
 
+        if taxonomy:
+            # 1. link the files of the cached taxonomy instead, after the library is added so that it creates the database
+                # the taxonomy directory of the database is not linked itself, as the build writes prelim_map.txt into it
+            files = self.taxonomy_files(taxonomy)
+            if not files:
+                raise ValueError(f'No taxonomy (nodes.dmp and names.dmp) found in: {taxonomy}')
+            taxonomy_dir = os.path.join(path_out, 'taxonomy')
+            return [cmd2, ['mkdir', '-p', taxonomy_dir], ['ln', '-sf'] + files + [taxonomy_dir], cmd3, cmd4]
+
         return [cmd1, cmd2, cmd3, cmd4]
 
-    def classify(self, index, seq1, classified_out=None, unclassified_out=None, seq2=None, threads=1, options=[]):
+    def classify(self, index, seq1, classified_out=None, unclassified_out=None, seq2=None, threads=1, report=None, options=[], mmap=False):
         """
         Matches sequences to a reference database and classifies them.
 
@@ -86,8 +185,13 @@ class Kraken2():
             Path where the second input FastQ file is located.
         threads : int
             Number of threads to use.
+        report : string
+            Path where the Kraken2 report (per-taxon summary of the classifications) is written.
         options : list
             An options list where additional arguments may be specified.
+        mmap : bool
+            Whether to memory-map the database (--memory-mapping) instead of loading it,
+            so concurrent processes share one copy of it in the page cache.
 
         Returns
         -------
@@ -102,7 +206,7 @@ class Kraken2():
 
         """
         # validate input
-        valid, arg, chars = validate_args([index, seq1, classified_out, unclassified_out, seq2] + options)
+        valid, arg, chars = validate_args([index, seq1, classified_out, unclassified_out, seq2, report] + options)
         if not valid:
             raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
 
@@ -110,11 +214,16 @@ class Kraken2():
             raise ValueError(f'No index path was given.')
         if not seq1:
             raise ValueError(f'No input FastQ was given.')
+        index = catalog.lookup(index, 'kraken2')
         cmd = ['kraken2', '--threads', str(threads), '--db', index]
         if classified_out:
             cmd += ['--classified-out', classified_out]
         if unclassified_out:
             cmd += ['--unclassified-out', unclassified_out]
+        if report:
+            cmd += ['--report', report]
+        if mmap:
+            cmd += ['--memory-mapping']
         if seq2:
             cmd += ['--paired', seq1, seq2]
         else: cmd += [seq1]
@@ -138,7 +247,7 @@ class Kraken2():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} aligner',
-            usage=f'hocort index {self.__class__.__name__} [-h] [--threads <int>] -i <fasta> -o <index>'
+            usage=f'hocort index {self.__class__.__name__} [-h] [--name <str>] [--force <bool>] [--threads <int>] [--taxonomy <dir>] -i <fasta> -o <index>'
         )
         parser.add_argument(
             '-i',
@@ -162,8 +271,32 @@ class Kraken2():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '--taxonomy',
+            required=False,
+            type=str,
+            metavar=('<dir>'),
+            default=TAXONOMY_DIR,
+            help='str: taxonomy cache directory, the taxonomy is downloaded into it once and linked into every index built with it; '
+                 'a directory with nodes.dmp and names.dmp is used as is, without network access (default: $HOCORT_TAXONOMY_DIR, or download the taxonomy into the index)'
+        )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register the index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the index even if it was already built from the same FASTA file with the same tool version and parameters (default: false)'
         )
         parsed = parser.parse_args(args=args)
 
@@ -181,14 +314,22 @@ class Kraken2():
             logger.error(f'Output path does not exist: {out}')
             sys.exit(1)
 
-        cmds = self.build_index(out, ref, threads=threads)
-        logger.info(f'Generating index for: {self.__class__.__name__}')
-        logger.info('Downloading taxonomy, this may take a while...')
-        returncode = exe.execute([cmds[0]], pipe=False, merge_stdout_stderr=True)
-        logger.info('Adding reference fasta to library...')
-        returncode = exe.execute([cmds[1]], pipe=False, merge_stdout_stderr=True)
-        logger.info('Building database...')
-        returncode = exe.execute([cmds[2]], pipe=False, merge_stdout_stderr=True)
-        logger.info('Cleaning up...')
-        returncode = exe.execute([cmds[3]], pipe=False, merge_stdout_stderr=True)
-        return returncode[0]
+        taxonomy = parsed.taxonomy
+        if taxonomy:
+            returncode = self.download_taxonomy(taxonomy, threads=threads)
+            if returncode != 0:
+                return returncode
+        cmds = self.build_index(out, ref, threads=threads, taxonomy=taxonomy)
+        if taxonomy:
+            messages = ['Adding reference fasta to library...',
+                        'Creating taxonomy directory...',
+                        f'Linking taxonomy from: {taxonomy}',
+                        'Building database...',
+                        'Cleaning up...']
+        else:
+            messages = ['Downloading taxonomy, this may take a while...',
+                        'Adding reference fasta to library...',
+                        'Building database...',
+                        'Cleaning up...']
+        parameters = self.taxonomy_parameters(taxonomy)
+        return catalog.build('kraken2', out, ref, cmds, parameters, name=parsed.name, force=parsed.force == 'true', messages=messages)
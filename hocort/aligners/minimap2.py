@@ -2,12 +2,16 @@ import logging
 import os
 import sys
 
-import hocort.execute as exe
+import hocort.catalog as catalog
 from hocort.parse.parser import ArgParser
 from hocort.parse.parser import validate_args
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
+# Options which keep minimap2 from reporting secondary alignments, see align(decision_only=True).
+DECISION_OPTIONS = ['--secondary=no']
+
 
 class Minimap2():
     """
@@ -63,7 +67,7 @@ class Minimap2():
 
         return [cmd]
 
-    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[]):
+    def align(self, index, seq1, output=None, seq2=None, threads=1, options=[], decision_only=False):
         """
         Aligns FastQ sequences to reference genome and outputs a SAM file.
 
@@ -82,6 +86,9 @@ class Minimap2():
             Number of threads to use.
         options : list
             An options list where additional arguments may be specified.
+        decision_only : bool
+            Whether to only decide whether reads align, rather than search for their best alignment:
+            minimap2 reports no secondary alignments (--secondary=no).
 
         Returns
         -------
@@ -104,9 +111,12 @@ class Minimap2():
             raise ValueError(f'No index path was given.')
         if not seq1:
             raise ValueError(f'No input FastQ was given.')
+        index = catalog.lookup(index, 'minimap2')
         cmd = ['minimap2', '-t', str(threads), '-a']
         if output:
             cmd += ['-o', output]
+        if decision_only:
+            cmd += DECISION_OPTIONS
         cmd += options
         cmd += [index, seq1]
         if seq2:
@@ -130,7 +140,7 @@ class Minimap2():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} aligner',
-            usage=f'hocort index {self.__class__.__name__} [-h] [--threads <int>] [--preset <type>] -i <fasta> -o <index>'
+            usage=f'hocort index {self.__class__.__name__} [-h] [--name <str>] [--force <bool>] [--threads <int>] [--preset <type>] -i <fasta> -o <index>'
         )
         parser.add_argument(
             '-i',
@@ -154,8 +164,8 @@ class Minimap2():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
         )
         parser.add_argument(
             '-p',
@@ -164,6 +174,21 @@ class Minimap2():
             default='illumina',
             help='str: type of reads (default: illumina)'
         )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register the index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the index even if it was already built from the same FASTA file with the same tool version and parameters (default: false)'
+        )
         parsed = parser.parse_args(args=args)
 
         ref = parsed.input
@@ -182,6 +207,4 @@ class Minimap2():
             sys.exit(1)
 
         cmd = self.build_index(out, ref, threads=threads, preset=preset)
-        logger.info(f'Generating index for: {self.__class__.__name__}')
-        returncode = exe.execute(cmd, pipe=False, merge_stdout_stderr=True)
-        return returncode[0]
+        return catalog.build('minimap2', out, ref, cmd, {'preset': preset}, name=parsed.name, force=parsed.force == 'true')
@@ -0,0 +1,621 @@
+"""
+Runs a pipeline on many samples listed in a sample sheet ("hocort batch"), as many at a time
+as the limits on concurrent jobs, threads and memory allow.
+
+Every sample runs as its own "hocort map" process, which writes its output files and its log
+to <output>/<sample>/. Pipelines which can memory-map their index (--mmap) do so, so that
+concurrent jobs share one copy of the index in memory instead of loading one each.
+
+Many small samples can instead be multiplexed: their reads are tagged with the sample and streamed
+through FIFOs into a single "hocort map" process, whose output is split back into the samples,
+so that the index is loaded once for all of them.
+
+"""
+import asyncio
+import concurrent.futures
+import csv
+import inspect
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import hocort.execute as exe
+import hocort.budget as budget
+import hocort.resources as resources
+from hocort.distributed import pipeline_class
+from hocort.parse.fastq import FastQ
+from hocort.pipelines.utils import unblock
+from hocort.parse.parser import ArgParser
+from hocort.parse.parser import validate_args
+
+logger = logging.getLogger(__file__)
+
+# Columns of the sample sheet. Only sample and fastq_1 are required,
+# threads and memory (GiB) override the resources of a single job.
+SHEET_COLUMNS = ['sample', 'fastq_1', 'fastq_2', 'threads', 'memory']
+
+# Columns of the results table.
+RESULT_COLUMNS = ['sample', 'returncode', 'run_time', 'threads', 'input_reads', 'output_reads', 'outputs', 'log']
+
+# Name of the log file of a sample, in its output directory.
+SAMPLE_LOG = 'hocort.log'
+
+# Pipelines which do not write one output file per mate, and therefore cannot be multiplexed.
+NOT_MULTIPLEXABLE = ['kraken2', 'biobloom']
+
+
+def read_sheet(path):
+    """
+    Reads a sample sheet: a TSV or CSV file with a header, one sample per line.
+    CSV is assumed if the file name ends with '.csv'. Lines starting with '#' are ignored.
+
+    Parameters
+    ----------
+    path : string
+        Path of the sample sheet.
+
+    Returns
+    -------
+    samples : list
+        One dict per sample, with the keys of SHEET_COLUMNS. Missing values are None.
+
+    Raises
+    ------
+    ValueError
+        If a required column is missing, a sample is listed twice,
+        or a value contains disallowed characters.
+
+    """
+    delimiter = ',' if path.endswith('.csv') else '\t'
+    with open(path, newline='') as f:
+        lines = [line for line in f if line.strip() and not line.startswith('#')]
+    reader = csv.DictReader(lines, delimiter=delimiter)
+    header = [column.strip() for column in reader.fieldnames or []]
+    for column in ['sample', 'fastq_1']:
+        if column not in header:
+            raise ValueError(f'Sample sheet {path} has no "{column}" column')
+
+    samples = []
+    names = set()
+    for row in reader:
+        row = {column.strip(): (value or '').strip() for column, value in row.items() if column}
+        sample = {column: row.get(column) or None for column in SHEET_COLUMNS}
+        if not sample['sample'] or not sample['fastq_1']:
+            raise ValueError(f'Sample sheet {path} has a line without sample or fastq_1: {row}')
+        if sample['sample'] in names:
+            raise ValueError(f'Sample {sample["sample"]} is listed twice in {path}')
+        if '/' in sample['sample'] or sample['sample'] in ['.', '..']:
+            raise ValueError(f'Invalid sample name: {sample["sample"]}')
+        valid, arg, chars = validate_args([sample['sample'], sample['fastq_1'], sample['fastq_2']])
+        if not valid:
+            raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
+        sample['threads'] = int(sample['threads']) if sample['threads'] else None
+        sample['memory'] = float(sample['memory']) if sample['memory'] else None
+        names.add(sample['sample'])
+        samples.append(sample)
+    return samples
+
+def output_arguments(pipeline, prefix, paired):
+    """
+    Builds the output arguments (-o) of a pipeline for a sample.
+
+    Parameters
+    ----------
+    pipeline : string
+        Name of the pipeline.
+    prefix : string
+        Path prefix of the output files of the sample.
+    paired : bool
+        Whether the sample has paired reads.
+
+    Returns
+    -------
+    outputs : list
+        The values of the -o argument.
+
+    """
+    if pipeline == 'kraken2':
+        # kraken2 replaces '#' by the mate number
+        return [f'{prefix}#.fastq'] if paired else [f'{prefix}.fastq']
+    if pipeline == 'biobloom':
+        return [prefix]
+    return [f'{prefix}_1.fastq', f'{prefix}_2.fastq'] if paired else [f'{prefix}.fastq']
+
+def write_results(path, results):
+    """
+    Writes the results table, a TSV file with the columns of RESULT_COLUMNS.
+
+    Parameters
+    ----------
+    path : string
+        Path of the results table.
+    results : list
+        One dict per sample.
+
+    Returns
+    -------
+    None
+
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, delimiter='\t', extrasaction='ignore')
+        writer.writeheader()
+        for result in results:
+            writer.writerow({column: '' if result.get(column) is None else result.get(column) for column in RESULT_COLUMNS})
+
+class Scheduler():
+    """
+    Admits jobs in order, as long as the limits on concurrent jobs, threads and memory allow.
+    A job which needs more than a limit is clamped to it, so it runs alone rather than never.
+
+    """
+    def __init__(self, jobs, threads, memory=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        jobs : int
+            Maximum number of concurrent jobs.
+        threads : int
+            Maximum number of threads of the concurrent jobs.
+        memory : float
+            Maximum memory of the concurrent jobs, in any unit. None if unlimited.
+
+        Returns
+        -------
+        None
+
+        """
+        self.jobs = max(jobs, 1)
+        self.threads = max(threads, 1)
+        self.memory = memory
+        self.running = []
+        self.queue = []
+        self.condition = None
+
+    def fits(self, threads, memory):
+        if len(self.running) >= self.jobs:
+            return False
+        if sum(t for t, m in self.running) + threads > self.threads:
+            return False
+        if self.memory is not None and sum(m for t, m in self.running) + memory > self.memory:
+            return False
+        return True
+
+    async def run(self, coroutine_function, threads, memory=0):
+        """
+        Waits until the job is admitted, then runs it.
+
+        Parameters
+        ----------
+        coroutine_function : function
+            Called without arguments once the job is admitted, returns the coroutine of the job.
+        threads : int
+            Number of threads of the job.
+        memory : float
+            Memory of the job.
+
+        Returns
+        -------
+        result : object
+            Result of the coroutine.
+
+        """
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        job = (min(threads, self.threads), min(memory, self.memory) if self.memory is not None else memory)
+        ticket = object()
+        async with self.condition:
+            self.queue.append(ticket)
+            try:
+                await self.condition.wait_for(lambda: self.queue[0] is ticket and self.fits(*job))
+            finally:
+                self.queue.remove(ticket)
+                self.condition.notify_all()
+            self.running.append(job)
+        try:
+            return await coroutine_function()
+        finally:
+            async with self.condition:
+                self.running.remove(job)
+                self.condition.notify_all()
+
+class Batch():
+    """
+    Batch runner which runs a pipeline on every sample of a sample sheet.
+
+    """
+    def command(self, pipeline, inputs, outputs, log, threads, arguments):
+        """
+        Builds a "hocort map" command.
+
+        Parameters
+        ----------
+        pipeline : string
+            Name of the pipeline.
+        inputs : list
+            Input FastQ file paths.
+        outputs : list
+            Output arguments, see output_arguments().
+        log : string
+            Path of the log file.
+        threads : int
+            Number of threads of the job.
+        arguments : list
+            Arguments passed on to the pipeline, e.g. the index.
+
+        Returns
+        -------
+        cmd : list
+            The command.
+
+        """
+        cmd = [sys.executable, '-m', 'hocort', 'map', pipeline, '-l', log]
+        cmd += ['-i'] + inputs + ['-o'] + outputs + ['-t', str(threads)]
+        commands = getattr(pipeline_class(pipeline), 'commands', None)
+        if commands and 'mmap' in inspect.signature(commands).parameters and '--mmap' not in arguments:
+            cmd += ['--mmap', 'true']
+        return cmd + arguments
+
+    async def run_sample(self, pipeline, sample, output, threads, arguments, count=True):
+        """
+        Runs the pipeline on a sample.
+
+        Parameters
+        ----------
+        pipeline : string
+            Name of the pipeline.
+        sample : dict
+            The sample, as returned by read_sheet().
+        output : string
+            Path of the output directory of the batch.
+        threads : int
+            Number of threads of the job.
+        arguments : list
+            Arguments passed on to the pipeline.
+        count : bool
+            Whether to count the input and output reads.
+
+        Returns
+        -------
+        result : dict
+            The result of the sample, with the keys of RESULT_COLUMNS.
+
+        """
+        sample_dir = os.path.join(output, sample['sample'])
+        os.makedirs(sample_dir, exist_ok=True)
+        log = os.path.join(sample_dir, SAMPLE_LOG)
+        cmd = self.command(pipeline,
+                           [sample['fastq_1']] + ([sample['fastq_2']] if sample['fastq_2'] else []),
+                           output_arguments(pipeline, os.path.join(sample_dir, sample['sample']), bool(sample['fastq_2'])),
+                           log,
+                           threads,
+                           arguments)
+
+        logger.info(f'Starting sample {sample["sample"]} with {threads} threads')
+        start_time = time.time()
+        returncode = (await exe.execute_async([cmd]))[0]
+        run_time = time.time() - start_time
+        if returncode == 0:
+            logger.info(f'Sample {sample["sample"]} finished in {run_time:.1f} seconds')
+        else:
+            logger.error(f'Sample {sample["sample"]} failed with returncode {returncode}, see {log}')
+
+        outputs = sorted(f for f in os.listdir(sample_dir) if f != SAMPLE_LOG)
+        result = {
+            'sample': sample['sample'],
+            'returncode': returncode,
+            'run_time': f'{run_time:.2f}',
+            'threads': threads,
+            'outputs': ','.join(os.path.join(sample_dir, f) for f in outputs),
+            'log': log
+        }
+        if count and returncode == 0 and outputs:
+            loop = asyncio.get_event_loop()
+            result['input_reads'], result['output_reads'] = await asyncio.gather(
+                loop.run_in_executor(None, FastQ.count, sample['fastq_1']),
+                loop.run_in_executor(None, FastQ.count, os.path.join(sample_dir, outputs[0])))
+        return result
+
+    async def run_multiplexed(self, pipeline, samples, output, threads, arguments, name):
+        """
+        Runs the pipeline once on the reads of many samples, see multiplex() and demultiplex() of FastQ.
+        The reads are streamed through FIFOs, so they are neither copied to disk nor held in memory.
+
+        Parameters
+        ----------
+        pipeline : string
+            Name of the pipeline.
+        samples : list
+            The samples, as returned by read_sheet(). Either all or none of them are paired.
+        output : string
+            Path of the output directory of the batch.
+        threads : int
+            Number of threads of the pipeline.
+        arguments : list
+            Arguments passed on to the pipeline.
+        name : string
+            Name of the multiplexed run, used for its log file.
+
+        Returns
+        -------
+        results : list
+            The result of every sample, with the keys of RESULT_COLUMNS.
+
+        Raises
+        ------
+        ValueError
+            If the pipeline cannot be multiplexed.
+
+        """
+        if pipeline in NOT_MULTIPLEXABLE:
+            raise ValueError(f'Pipeline {pipeline} cannot be multiplexed')
+        paired = bool(samples[0]['fastq_2'])
+        mates = [1, 2] if paired else [1]
+        log = os.path.join(output, f'{name}.log')
+        outputs = {}
+        for sample in samples:
+            sample_dir = os.path.join(output, sample['sample'])
+            os.makedirs(sample_dir, exist_ok=True)
+            outputs[sample['sample']] = output_arguments(pipeline, os.path.join(sample_dir, sample['sample']), paired)
+
+        logger.info(f'Starting {len(samples)} multiplexed samples ({name}) with {threads} threads')
+        start_time = time.time()
+        loop = asyncio.get_event_loop()
+        with tempfile.TemporaryDirectory(dir=output) as fifo_dir, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=2 * len(mates)) as executor:
+            fifos = {}
+            for mate in mates:
+                fifos[mate] = (f'{fifo_dir}/in_{mate}.fastq', f'{fifo_dir}/out_{mate}.fastq')
+                for fifo in fifos[mate]:
+                    os.mkfifo(fifo)
+            tag = [loop.run_in_executor(executor,
+                                        FastQ.multiplex,
+                                        [(sample['sample'], sample[f'fastq_{mate}']) for sample in samples],
+                                        fifos[mate][0])
+                   for mate in mates]
+            split = [loop.run_in_executor(executor,
+                                          FastQ.demultiplex,
+                                          fifos[mate][1],
+                                          {sample: paths[mate - 1] for sample, paths in outputs.items()})
+                     for mate in mates]
+            cmd = self.command(pipeline,
+                               [fifos[mate][0] for mate in mates],
+                               [fifos[mate][1] for mate in mates],
+                               log,
+                               threads,
+                               arguments)
+            try:
+                returncode = (await exe.execute_async([cmd]))[0]
+            finally:
+                # the threads block opening their FIFOs if the pipeline never opened the other end
+                pending = tag + split
+                while pending:
+                    for mate in mates:
+                        unblock(fifos[mate][1], fifos[mate][0])
+                    done, pending = await asyncio.wait(pending, timeout=0.1)
+            run_time = time.time() - start_time
+            reads = []
+            for future in tag + split:
+                if future.exception():
+                    logger.error(f'Multiplexing {name} failed: {future.exception()}')
+                    returncode = returncode or 1
+                else:
+                    reads.append(future.result())
+        if returncode == 0:
+            logger.info(f'Multiplexed samples ({name}) finished in {run_time:.1f} seconds')
+        else:
+            logger.error(f'Multiplexed samples ({name}) failed with returncode {returncode}, see {log}')
+
+        results = []
+        for sample in samples:
+            result = {
+                'sample': sample['sample'],
+                'returncode': returncode,
+                'run_time': f'{run_time:.2f}',
+                'threads': threads,
+                'outputs': ','.join(outputs[sample['sample']]),
+                'log': log
+            }
+            if returncode == 0:
+                result['input_reads'] = reads[0][sample['sample']]
+                result['output_reads'] = reads[len(mates)][sample['sample']]
+            results.append(result)
+        return results
+
+    async def run_async(self, pipeline, samples, output, arguments=[], jobs=1, threads=1, job_threads=None, memory=None, job_memory=0, count=True, multiplex=False):
+        """
+        Runs the pipeline on all samples, as many at a time as the limits allow.
+
+        Parameters
+        ----------
+        pipeline : string
+            Name of the pipeline.
+        samples : list
+            The samples, as returned by read_sheet().
+        output : string
+            Path of the output directory.
+        arguments : list
+            Arguments passed on to the pipeline of every sample, e.g. the index.
+        jobs : int
+            Maximum number of samples processed at a time.
+        threads : int
+            Maximum number of threads used at a time.
+        job_threads : int
+            Number of threads of a sample, unless the sample sheet sets it. Defaults to threads // jobs.
+        memory : float
+            Maximum memory (GiB) used at a time. None if unlimited.
+        job_memory : float
+            Memory (GiB) reserved for a sample, unless the sample sheet sets it.
+        count : bool
+            Whether to count the input and output reads of every sample.
+        multiplex : bool
+            Whether to run the pipeline once on all paired samples and once on all unpaired samples,
+            see run_multiplexed(), instead of once per sample. The threads and memory set by the sample sheet are ignored.
+
+        Returns
+        -------
+        results : list
+            One result per sample, in the order of the samples.
+
+        Raises
+        ------
+        ValueError
+            If the pipeline does not exist.
+            If the pipeline cannot be multiplexed.
+
+        """
+        pipeline_class(pipeline)
+        job_threads = job_threads if job_threads else max(threads // max(jobs, 1), 1)
+        scheduler = Scheduler(jobs, threads, memory=memory)
+        logger.info(f'Running pipeline {pipeline} on {len(samples)} samples, at most {jobs} at a time with {threads} threads')
+
+        def job(sample):
+            sample_threads = sample['threads'] or job_threads
+            sample_memory = sample['memory'] if sample['memory'] is not None else job_memory
+            return scheduler.run(lambda: self.run_sample(pipeline, sample, output, min(sample_threads, threads), arguments, count=count),
+                                 sample_threads,
+                                 sample_memory)
+        os.makedirs(output, exist_ok=True)
+        if not multiplex:
+            return await asyncio.gather(*[job(sample) for sample in samples])
+
+        groups = [(name, [sample for sample in samples if bool(sample['fastq_2']) == paired])
+                  for name, paired in [('multiplexed_paired', True), ('multiplexed_unpaired', False)]]
+        groups = [(name, group) for name, group in groups if group]
+        group_results = await asyncio.gather(*[scheduler.run(lambda name=name, group=group: self.run_multiplexed(pipeline, group, output, job_threads, arguments, name),
+                                                             job_threads,
+                                                             job_memory)
+                                               for name, group in groups])
+        results = {result['sample']: result for group in group_results for result in group}
+        return [results[sample['sample']] for sample in samples]
+
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments and starts the batch.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser. Unknown arguments are passed on to the pipeline.
+
+        Returns
+        -------
+        returncode : int
+            0 if all samples succeeded, 1 otherwise.
+
+        """
+        parser = ArgParser(
+            description='hocort batch: run a pipeline on every sample of a sample sheet',
+            usage='hocort batch [-h] <pipeline> --samples <sheet> --output <dir> [--jobs <int>] [--threads <int>] [--job-threads <int>] [--memory <GiB>] [--job-memory <GiB>] [--results <path>] [--count <bool>] [--multiplex <bool>] [pipeline options]',
+            allow_abbrev=False
+        )
+        parser.add_argument(
+            'pipeline',
+            type=str,
+            help='str: pipeline to run on every sample, see "hocort map -h" (required)'
+        )
+        parser.add_argument(
+            '--samples',
+            required=True,
+            type=str,
+            metavar=('<sheet>'),
+            help='str: TSV (or .csv) sample sheet with the columns sample, fastq_1 and optionally fastq_2, threads, memory (required)'
+        )
+        parser.add_argument(
+            '--output',
+            required=True,
+            type=str,
+            metavar=('<dir>'),
+            help='str: output directory, which gets one subdirectory per sample (required)'
+        )
+        parser.add_argument(
+            '--jobs',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            help='int: maximum number of samples processed at a time (default: one per 16 threads)'
+        )
+        parser.add_argument(
+            '--threads',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=resources.available_cpus(),
+            help='int: maximum number of threads used at a time (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '--job-threads',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            help='int: number of threads of each sample (default: threads / jobs)'
+        )
+        parser.add_argument(
+            '--memory',
+            required=False,
+            type=float,
+            metavar=('<GiB>'),
+            help='float: maximum memory reserved by the samples running at a time (default: available memory)'
+        )
+        parser.add_argument(
+            '--job-memory',
+            required=False,
+            type=float,
+            metavar=('<GiB>'),
+            default=0,
+            help='float: memory reserved for each sample (default: 0)'
+        )
+        parser.add_argument(
+            '--results',
+            required=False,
+            type=str,
+            metavar=('<path>'),
+            help='str: path of the per-sample results table (default: <output>/results.tsv)'
+        )
+        parser.add_argument(
+            '--count',
+            required=False,
+            choices=['true', 'false'],
+            default='true',
+            help='str: set to false to skip counting the input and output reads of every sample (default: true)'
+        )
+        parser.add_argument(
+            '--multiplex',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to stream all samples through a single run of the pipeline, which loads the index once (default: false)'
+        )
+        parsed, arguments = parser.parse_known_args(args=args)
+
+        threads = parsed.threads if parsed.threads else 1
+        jobs = parsed.jobs if parsed.jobs else budget.shards(threads)
+        memory = parsed.memory
+        if memory is None:
+            available = resources.available_memory()
+            memory = available / 2**30 if available else None
+        results_path = parsed.results if parsed.results else os.path.join(parsed.output, 'results.tsv')
+
+        samples = read_sheet(parsed.samples)
+        results = asyncio.run(self.run_async(parsed.pipeline,
+                                              samples,
+                                              parsed.output,
+                                              arguments=arguments,
+                                              jobs=jobs,
+                                              threads=threads,
+                                              job_threads=parsed.job_threads,
+                                              memory=memory,
+                                              job_memory=parsed.job_memory,
+                                              count=True if parsed.count == 'true' else False,
+                                              multiplex=True if parsed.multiplex == 'true' else False))
+        write_results(results_path, results)
+        failed = [result['sample'] for result in results if result['returncode'] != 0]
+        logger.info(f'Wrote the results of {len(results)} samples to {results_path}')
+        if failed:
+            logger.error(f'{len(failed)} samples failed: {failed}')
+            return 1
+        return 0
@@ -0,0 +1,118 @@
+"""
+Splits a budget of threads, and optionally CPUs, between pipeline stages which run concurrently.
+
+"""
+import logging
+import math
+import os
+
+import hocort.execute as exe
+
+logger = logging.getLogger(__file__)
+
+# Relative share of the threads given to a tool when it runs concurrently with other tools.
+# The aligners and classifiers do the heavy lifting, samtools and gzip only convert their output.
+WEIGHTS = {
+    'bowtie2': 9,
+    'hisat2': 9,
+    'bwa-mem2': 9,
+    'bbmap.sh': 9,
+    'minimap2': 9,
+    'kraken2': 9,
+    'biobloomcategorizer': 9,
+    'samtools': 1,
+    'gzip': 1
+}
+
+# Weight of tools which are not listed in WEIGHTS.
+DEFAULT_WEIGHT = 1
+
+# Threads per shard when the number of shards is chosen automatically.
+# Bowtie2, HISAT2 and BBMap stop scaling well at around 16-24 threads.
+SHARD_THREADS = 16
+
+
+def split(threads, tools, weights=WEIGHTS):
+    """
+    Splits a number of threads between tools which run concurrently, proportionally to their weights.
+    Every tool gets at least one thread, so the total exceeds threads if there are fewer threads than tools.
+
+    Parameters
+    ----------
+    threads : int
+        Total number of threads.
+    tools : list
+        Names of the tools (executables), in the order their threads are returned.
+    weights : dict
+        Weight of each tool. Tools which are not listed get DEFAULT_WEIGHT.
+
+    Returns
+    -------
+    counts : list
+        Number of threads of each tool.
+
+    """
+    if not tools:
+        return []
+    threads = max(int(threads), 1)
+    tool_weights = [weights.get(tool, DEFAULT_WEIGHT) for tool in tools]
+    shares = [threads * weight / sum(tool_weights) for weight in tool_weights]
+    counts = [max(int(share), 1) for share in shares]
+    # hand out the threads lost to rounding down, or take back those given by the minimum of one thread
+    total = max(threads, len(tools))
+    while sum(counts) < total:
+        i = max(range(len(tools)), key=lambda i: shares[i] - counts[i])
+        counts[i] += 1
+    while sum(counts) > total:
+        i = max((i for i in range(len(tools)) if counts[i] > 1), key=lambda i: counts[i] - shares[i])
+        counts[i] -= 1
+    logger.debug(f'Split {threads} threads between {tools}: {counts}')
+    return counts
+
+def pin(cmds, counts, cpus=None):
+    """
+    Pins each command to its own set of CPUs, the size of which is given by counts.
+    The sets are disjoint unless there are fewer CPUs than threads, in which case they wrap around.
+
+    Parameters
+    ----------
+    cmds : list
+        List of commands.
+    counts : list
+        Number of CPUs of each command, as returned by split().
+    cpus : set
+        CPUs to distribute. Defaults to the CPUs this process may run on.
+
+    Returns
+    -------
+    cmds : list
+        List of exe.Command objects, which keep the stdout redirection and FIFOs of the given commands.
+
+    """
+    available = sorted(os.sched_getaffinity(0) if cpus is None else cpus)
+    pinned = []
+    start = 0
+    for cmd, count in zip(cmds, counts):
+        count = min(count, len(available))
+        cmd_cpus = {available[(start + i) % len(available)] for i in range(count)}
+        start += count
+        pinned.append(exe.Command(cmd, stdout=getattr(cmd, 'stdout', None), cpus=cmd_cpus, fifos=getattr(cmd, 'fifos', None)))
+    logger.debug(f'Pinned commands to CPUs: {[cmd.cpus for cmd in pinned]}')
+    return pinned
+
+def shards(threads):
+    """
+    Chooses the number of shards to split a run into, so that each shard gets at most SHARD_THREADS threads.
+
+    Parameters
+    ----------
+    threads : int
+        Total number of threads.
+
+    Returns
+    -------
+    shards : int
+        Number of shards.
+
+    """
+    return max(math.ceil(threads / SHARD_THREADS), 1)
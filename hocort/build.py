@@ -0,0 +1,398 @@
+"""
+Builds the indexes of several tools from one FASTA file at the same time ("hocort index all"),
+as many at a time as the limits on threads and memory allow.
+
+The threads are split between the tools which build their index with several threads, the others get one.
+The memory of a build is estimated from its previous build if the catalog has a record of it,
+and from the size of the FASTA file otherwise. Every build is recorded in the catalog (see hocort.catalog),
+so unchanged indexes are not built again, and the build time and peak memory of every tool are reported.
+
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sys
+
+import hocort.aligners as aligners
+import hocort.catalog as catalog
+import hocort.resources as resources
+from hocort.aligners.kraken2 import TAXONOMY_DIR
+from hocort.batch import Scheduler
+from hocort.parse.parser import ArgParser
+
+logger = logging.getLogger(__file__)
+
+# Tools whose index is built, in the order of "hocort index".
+TOOLS = ['bowtie2', 'hisat2', 'bwamem2', 'minimap2', 'bbmap', 'kraken2', 'biobloom']
+
+# Tools which build their index with a single thread.
+SINGLE_THREADED = ['bwamem2']
+
+# Estimated peak memory of an index build, in multiples of the size of the FASTA file.
+# Used until the catalog has a record of the build.
+MEMORY_FACTORS = {
+    'bowtie2': 4,
+    'hisat2': 4,
+    'bwamem2': 28,
+    'minimap2': 4,
+    'bbmap': 12,
+    'kraken2': 4,
+    'biobloom': 2
+}
+
+# Columns of the report.
+REPORT_COLUMNS = ['tool', 'index', 'status', 'build_time', 'peak_memory']
+
+
+def index_paths(tool, dir, basename):
+    """
+    Determines where the index of a tool is built, in its own directory under the output directory.
+
+    Parameters
+    ----------
+    tool : string
+        Name of the tool, one of TOOLS.
+    dir : string
+        Output directory.
+    basename : string
+        Basename of the index files.
+
+    Returns
+    -------
+    path : string
+        Output path passed to build_index() of the tool.
+    index : string
+        Path of the index, as passed to "hocort map".
+
+    """
+    tool_dir = os.path.join(dir, tool)
+    if tool == 'minimap2':
+        return os.path.join(tool_dir, basename + '.mmi'), os.path.join(tool_dir, basename + '.mmi')
+    if tool == 'biobloom':
+        return tool_dir, os.path.join(tool_dir, 'reference.bf')
+    if tool in ['bbmap', 'kraken2']:
+        return tool_dir, tool_dir
+    return os.path.join(tool_dir, basename), os.path.join(tool_dir, basename)
+
+def estimate_memory(tool, index, fasta):
+    """
+    Estimates the peak memory of an index build.
+
+    Parameters
+    ----------
+    tool : string
+        Name of the tool, one of TOOLS.
+    index : string
+        Path of the index.
+    fasta : string
+        Path of the FASTA file.
+
+    Returns
+    -------
+    memory : float
+        Estimated peak memory (GiB), the peak memory of the previous build if it was recorded.
+
+    """
+    record = catalog.read_record(catalog.record_path(index))
+    if record and record.get('peak_memory'):
+        return record['peak_memory'] / 2**30
+    return MEMORY_FACTORS[tool] * os.path.getsize(fasta) / 2**30
+
+def plan(tools, fasta, dir, threads, memory=None, taxonomy=None):
+    """
+    Plans the index builds of several tools.
+
+    Parameters
+    ----------
+    tools : list
+        Names of the tools, from TOOLS.
+    fasta : string
+        Path of the FASTA file.
+    dir : string
+        Output directory.
+    threads : int
+        Number of threads shared by the builds.
+    memory : float
+        Memory (GiB) shared by the builds, None if unlimited.
+    taxonomy : string
+        Taxonomy cache directory of the Kraken2 build, None to download the taxonomy.
+
+    Returns
+    -------
+    builds : list
+        Tool, its directory, output path, index path, threads, estimated memory (GiB)
+        and taxonomy cache directory of every build, the largest first.
+
+    Raises
+    ------
+    ValueError
+        If a tool is unknown.
+
+    """
+    for tool in tools:
+        if tool not in TOOLS:
+            raise ValueError(f'Invalid tool: {tool}, choose from {TOOLS}')
+    name = os.path.basename(fasta)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    basename = os.path.splitext(name)[0] or name
+    multi_threaded = [tool for tool in tools if tool not in SINGLE_THREADED]
+    share = max((threads - (len(tools) - len(multi_threaded))) // max(len(multi_threaded), 1), 1)
+    builds = []
+    for tool in tools:
+        path, index = index_paths(tool, dir, basename)
+        estimate = estimate_memory(tool, index, fasta)
+        builds.append({
+            'tool': tool,
+            'dir': os.path.join(dir, tool),
+            'path': path,
+            'index': index,
+            'threads': 1 if tool in SINGLE_THREADED else share,
+            'memory': min(estimate, memory) if memory is not None else estimate,
+            'taxonomy': taxonomy if tool == 'kraken2' else None
+        })
+    return sorted(builds, key=lambda build: -build['memory'])
+
+def commands(build, fasta):
+    """
+    Generates the commands of an index build.
+
+    Parameters
+    ----------
+    build : dict
+        The build, as returned by plan().
+    fasta : string
+        Path of the FASTA file.
+
+    Returns
+    -------
+    cmds : list
+        Commands which build the index.
+    parameters : dict
+        Parameters which affect the index.
+
+    """
+    tool = build['tool']
+    options = []
+    if tool == 'bbmap':
+        # the Java heap of BBMap is limited to the memory reserved for its build, instead of the memory of the machine
+        heap = max(int(build['memory'] * 2**30), 2**30)
+        if resources.java_heap():
+            heap = min(heap, resources.java_heap())
+        options = [f'-Xmx{heap // 2**20}m']
+    cmds = getattr(aligners, tool)().build_index(build['path'], fasta, threads=build['threads'], taxonomy=build['taxonomy'], options=options)
+    parameters = {'preset': 'illumina'} if tool == 'minimap2' else {}
+    if tool == 'kraken2':
+        parameters = aligners.kraken2().taxonomy_parameters(build['taxonomy'])
+    return cmds, parameters
+
+def build_index(build, fasta, name=None, force=False):
+    """
+    Builds the index of a tool, unless it is up to date, see catalog.build().
+
+    Parameters
+    ----------
+    build : dict
+        The build, as returned by plan().
+    fasta : string
+        Path of the FASTA file.
+    name : string
+        Name to register the index under.
+    force : bool
+        Whether to build the index even if it is up to date.
+
+    Returns
+    -------
+    report : dict
+        Tool, index, status ("built", "up to date" or "failed (<returncode>)"), build time (s) and peak memory (bytes).
+
+    """
+    tool, index = build['tool'], build['index']
+    os.makedirs(build['dir'], exist_ok=True)
+    if build['taxonomy']:
+        returncode = aligners.kraken2().download_taxonomy(build['taxonomy'], threads=build['threads'])
+        if returncode != 0:
+            return {'tool': tool, 'index': index, 'status': f'failed ({returncode})', 'build_time': None, 'peak_memory': None}
+    cmds, parameters = commands(build, fasta)
+    logger.info(f'Building the {tool} index {index} with {build["threads"]} threads')
+    before = catalog.read_record(catalog.record_path(index))
+    returncode = catalog.build(tool, index, fasta, cmds, parameters, name=name, force=force)
+    record = catalog.read_record(catalog.record_path(index))
+    if returncode != 0:
+        status = f'failed ({returncode})'
+    else:
+        status = 'up to date' if record == before else 'built'
+    return {
+        'tool': tool,
+        'index': index,
+        'status': status,
+        'build_time': record.get('build_time') if record and returncode == 0 else None,
+        'peak_memory': record.get('peak_memory') if record and returncode == 0 else None
+    }
+
+async def build_all(builds, fasta, threads, memory=None, name=None, force=False):
+    """
+    Runs index builds concurrently, as many at a time as the limits on threads and memory allow.
+
+    Parameters
+    ----------
+    builds : list
+        The builds, as returned by plan().
+    fasta : string
+        Path of the FASTA file.
+    threads : int
+        Number of threads shared by the builds.
+    memory : float
+        Memory (GiB) shared by the builds, None if unlimited.
+    name : string
+        Name to register the indexes under.
+    force : bool
+        Whether to build the indexes even if they are up to date.
+
+    Returns
+    -------
+    reports : list
+        Report of every build, see build_index(), in the order of builds.
+
+    """
+    scheduler = Scheduler(len(builds), threads, memory=memory)
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(builds), 1)) as executor:
+        def job(build):
+            return scheduler.run(lambda: loop.run_in_executor(executor, build_index, build, fasta, name, force),
+                                 build['threads'], build['memory'])
+        return await asyncio.gather(*(job(build) for build in builds))
+
+def format_report(report):
+    """
+    Formats the report of a build as a tab-separated row of REPORT_COLUMNS.
+
+    Parameters
+    ----------
+    report : dict
+        The report, as returned by build_index().
+
+    Returns
+    -------
+    row : string
+        The row.
+
+    """
+    build_time = f'{report["build_time"]:.1f}s' if report['build_time'] is not None else '-'
+    peak_memory = f'{report["peak_memory"] / 2**30:.2f}GiB' if report['peak_memory'] else '-'
+    return '\t'.join([report['tool'], report['index'], report['status'], build_time, peak_memory])
+
+class BuildAll():
+    """
+    Builds the indexes of several tools from one FASTA file, see "hocort index all".
+
+    """
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments, builds the indexes and reports the builds.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser.
+
+        Returns
+        -------
+        returncode : int
+            0 if every index was built or is up to date, 1 otherwise.
+
+        """
+        parser = ArgParser(
+            description='hocort index all: build the indexes of several tools from one FASTA file at the same time',
+            usage='hocort index all [-h] [--tools <tool> ...] [--threads <int>] [--memory <GiB>] [--taxonomy <dir>] [--name <str>] [--force <bool>] -i <fasta> -o <dir>'
+        )
+        parser.add_argument(
+            '-i',
+            '--input',
+            required=True,
+            type=str,
+            metavar=('<fasta>'),
+            help='str: path to sequence files (required)'
+        )
+        parser.add_argument(
+            '-o',
+            '--output',
+            required=True,
+            type=str,
+            metavar=('<dir>'),
+            help='str: output directory, the index of every tool is built in <dir>/<tool>/ (required)'
+        )
+        parser.add_argument(
+            '--tools',
+            required=False,
+            nargs='+',
+            choices=TOOLS,
+            default=TOOLS,
+            metavar=('<tool>'),
+            help=f'str: tools whose index is built (default: {" ".join(TOOLS)})'
+        )
+        parser.add_argument(
+            '-t',
+            '--threads',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=resources.available_cpus(),
+            help='int: maximum number of threads used at a time (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '--memory',
+            required=False,
+            type=float,
+            metavar=('<GiB>'),
+            help='float: maximum memory reserved by the builds running at a time (default: available memory)'
+        )
+        parser.add_argument(
+            '--taxonomy',
+            required=False,
+            type=str,
+            metavar=('<dir>'),
+            default=TAXONOMY_DIR,
+            help='str: taxonomy cache directory of the Kraken2 index, see "hocort index kraken2" (default: $HOCORT_TAXONOMY_DIR, or download the taxonomy into the index)'
+        )
+        parser.add_argument(
+            '-n',
+            '--name',
+            required=False,
+            type=str,
+            metavar=('<str>'),
+            help='str: name to register every index under, which can be given to "hocort map" instead of its path'
+        )
+        parser.add_argument(
+            '--force',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to build the indexes even if they were already built from the same FASTA file with the same tool version and parameters (default: false)'
+        )
+        parsed = parser.parse_args(args=args)
+
+        fasta = parsed.input
+        dir = parsed.output
+        threads = parsed.threads
+        memory = parsed.memory
+        if memory is None:
+            available = resources.available_memory()
+            memory = available / 2**30 if available else None
+        if not os.path.isfile(fasta):
+            logger.error(f'Input FASTA file does not exist: {fasta}')
+            sys.exit(1)
+        if not os.path.isdir(dir):
+            logger.error(f'Output path does not exist: {dir}')
+            sys.exit(1)
+
+        tools = list(dict.fromkeys(parsed.tools))
+        builds = plan(tools, fasta, dir, threads, memory=memory, taxonomy=parsed.taxonomy)
+        logger.info(f'Building the indexes of {", ".join(tools)} with {threads} threads'
+                    + (f' and {memory:.1f} GiB of memory' if memory is not None else ''))
+        reports = asyncio.run(build_all(builds, fasta, threads, memory=memory, name=parsed.name, force=parsed.force == 'true'))
+        print('\t'.join(REPORT_COLUMNS))
+        for report in sorted(reports, key=lambda report: TOOLS.index(report['tool'])):
+            print(format_report(report))
+        return 0 if all(not report['status'].startswith('failed') for report in reports) else 1
@@ -0,0 +1,343 @@
+"""
+Keeps a catalog of the indexes built with "hocort index", so that unchanged indexes are not built again,
+and indexes can be looked up by name.
+
+Every built index gets a record next to it (<index>.catalog.json), which holds the checksum of the FASTA file
+it was built from, the version of the tool, the build parameters, and the time and peak memory the build took.
+A build is skipped if the record shows that the index was built from the same FASTA file, with the same tool version
+and parameters, and the files of the index have not changed since. An index built with a name is also registered
+in the catalog directory, and the name can be passed to the pipelines instead of the path of the index.
+
+"""
+import json
+import logging
+import os
+import re
+import time
+
+import hocort.execute as exe
+import hocort.indexes as indexes
+import hocort.results as results
+from hocort.parse.parser import ArgParser
+
+logger = logging.getLogger(__file__)
+
+# Directory where the names of indexes are registered.
+# Can be set with the environment variable HOCORT_CATALOG_DIR.
+CATALOG_DIR = os.environ.get('HOCORT_CATALOG_DIR') or os.path.join(os.path.expanduser('~'), '.hocort', 'catalog')
+
+# Suffix of the record describing how an index was built, next to the index.
+RECORD_SUFFIX = '.catalog.json'
+
+# Characters allowed in the name of an index.
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+def record_path(index):
+    """
+    Returns the path of the record of an index.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index, as passed to the tool.
+
+    Returns
+    -------
+    path : string
+        Path of the record.
+
+    """
+    return os.path.normpath(os.path.abspath(index)) + RECORD_SUFFIX
+
+def read_record(path):
+    """
+    Reads a record, or a registered name.
+
+    Parameters
+    ----------
+    path : string
+        Path of the record.
+
+    Returns
+    -------
+    record : dict
+        The record, None if it does not exist or can not be read.
+
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_record(path, record):
+    """
+    Writes a record atomically.
+
+    Parameters
+    ----------
+    path : string
+        Path of the record.
+    record : dict
+        The record.
+
+    Returns
+    -------
+    None
+
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+def is_current(record, tool, index, fasta, version, parameters):
+    """
+    Checks whether an index is identical to the one which would be built.
+    The FASTA file is only checksummed if its size or modification time differ from the record.
+
+    Parameters
+    ----------
+    record : dict
+        The record of the index, see build().
+    tool : string
+        Name of the tool, a key of indexes.INDEX_FILES.
+    index : string
+        Path of the index.
+    fasta : string
+        Path of the FASTA file.
+    version : string
+        Version of the tool.
+    parameters : dict
+        Parameters of the build.
+
+    Returns
+    -------
+    current : bool
+        True if the index does not need to be built again.
+
+    """
+    if not record:
+        return False
+    if record.get('tool') != tool or record.get('version') != version:
+        return False
+    if record.get('parameters') != json.loads(json.dumps(parameters, sort_keys=True)):
+        return False
+    files = indexes.index_files(index, tool)
+    base = os.path.dirname(os.path.normpath(os.path.abspath(index)))
+    if not files or record.get('files') != indexes.describe(files, base):
+        return False
+    stat = os.stat(fasta)
+    if record.get('fasta_size') == stat.st_size and record.get('fasta_mtime') == stat.st_mtime_ns:
+        return True
+    return record.get('fasta_checksum') == indexes.checksum(fasta)
+
+def register(name, tool, index):
+    """
+    Registers the name of an index in the catalog directory (CATALOG_DIR).
+
+    Parameters
+    ----------
+    name : string
+        Name of the index.
+    tool : string
+        Name of the tool.
+    index : string
+        Path of the index.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If the name contains disallowed characters.
+
+    """
+    if not NAME_PATTERN.match(name):
+        raise ValueError(f'Invalid index name: {name}, use letters, digits, ".", "_" and "-"')
+    os.makedirs(os.path.join(CATALOG_DIR, tool), exist_ok=True)
+    write_record(os.path.join(CATALOG_DIR, tool, name + '.json'), {'name': name, 'tool': tool, 'index': os.path.abspath(index)})
+    logger.info(f'Registered {tool} index {index} as: {name}')
+
+def lookup(name, tool):
+    """
+    Looks up the path of an index by its name. Paths of existing indexes are returned unchanged,
+    so lookup() can be applied to anything given as an index.
+
+    Parameters
+    ----------
+    name : string
+        Name or path of the index.
+    tool : string
+        Name of the tool.
+
+    Returns
+    -------
+    index : string
+        Path of the index.
+
+    """
+    if not name or not NAME_PATTERN.match(name) or indexes.index_files(name, tool):
+        return name
+    entry = read_record(os.path.join(CATALOG_DIR, tool, name + '.json'))
+    if not entry:
+        return name
+    logger.info(f'Using {tool} index {entry["index"]} for name: {name}')
+    return entry['index']
+
+def entries(tool=None):
+    """
+    Lists the registered indexes.
+
+    Parameters
+    ----------
+    tool : string
+        Only list the indexes of this tool.
+
+    Returns
+    -------
+    entries : list
+        (name, tool, index, record) of every registered index, sorted by tool and name.
+        record is None if the index has no record.
+
+    """
+    result = []
+    tools = [tool] if tool else sorted(os.listdir(CATALOG_DIR)) if os.path.isdir(CATALOG_DIR) else []
+    for tool in tools:
+        dir = os.path.join(CATALOG_DIR, tool)
+        for file in sorted(os.listdir(dir)) if os.path.isdir(dir) else []:
+            entry = read_record(os.path.join(dir, file)) if file.endswith('.json') else None
+            if entry:
+                result.append((entry['name'], tool, entry['index'], read_record(record_path(entry['index']))))
+    return result
+
+def build(tool, index, fasta, cmds, parameters, name=None, force=False, messages=None):
+    """
+    Builds an index, unless its record shows that an identical index was already built, and records the build.
+
+    Parameters
+    ----------
+    tool : string
+        Name of the tool, a key of indexes.INDEX_FILES.
+    index : string
+        Path of the index, as passed to the tool.
+    fasta : string
+        Path of the FASTA file the index is built from.
+    cmds : list
+        Commands which build the index, run one after the other.
+    parameters : dict
+        Parameters which affect the index (not e.g. the number of threads).
+    name : string
+        Name to register the index under, see register().
+    force : bool
+        Whether to build the index even if it is current.
+    messages : list
+        Message logged before each command.
+
+    Returns
+    -------
+    returncode : int
+        0 if the index was built or is current, the returncode of the failed command otherwise.
+
+    Raises
+    ------
+    ValueError
+        If the name contains disallowed characters.
+
+    """
+    if name and not NAME_PATTERN.match(name):
+        raise ValueError(f'Invalid index name: {name}, use letters, digits, ".", "_" and "-"')
+    path = record_path(index)
+    version = results.tool_version(cmds[0][0])
+    if not force and os.path.isfile(fasta) and is_current(read_record(path), tool, index, fasta, version, parameters):
+        logger.info(f'Index {index} is up to date, built {read_record(path).get("built")} from {fasta}')
+    else:
+        start_time = time.time()
+        peak_memory = None
+        for i, cmd in enumerate(cmds):
+            logger.info(messages[i] if messages else f'Generating index for: {tool}')
+            returncodes = exe.execute([cmd], pipe=False, merge_stdout_stderr=True)
+            for stage in returncodes.stages:
+                if stage.max_rss is not None:
+                    peak_memory = max(peak_memory or 0, stage.max_rss * 1024)
+            if returncodes[0] != 0:
+                return returncodes[0]
+        build_time = time.time() - start_time
+        stat = os.stat(fasta)
+        files = indexes.index_files(index, tool)
+        record = {
+            'tool': tool,
+            'index': os.path.abspath(index),
+            'fasta': os.path.abspath(fasta),
+            'fasta_checksum': indexes.checksum(fasta),
+            'fasta_size': stat.st_size,
+            'fasta_mtime': stat.st_mtime_ns,
+            'version': version,
+            'parameters': json.loads(json.dumps(parameters, sort_keys=True)),
+            'built': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'build_time': build_time,
+            'peak_memory': peak_memory,
+            'files': indexes.describe(files, os.path.dirname(os.path.normpath(os.path.abspath(index))))
+        }
+        write_record(path, record)
+        logger.info(f'Built index {index} in {build_time:.1f} seconds'
+                    + (f', peak memory {peak_memory / 2**30:.2f} GiB' if peak_memory else ''))
+    if name:
+        register(name, tool, index)
+    return 0
+
+class Catalog():
+    """
+    Lists the catalog of indexes, see "hocort index catalog".
+
+    """
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments, then lists the registered indexes,
+        or shows the record of an index.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser.
+
+        Returns
+        -------
+        returncode : int
+            0 if successful, 1 otherwise.
+
+        """
+        parser = ArgParser(
+            description='hocort index catalog: list the indexes registered by name, or show how an index was built',
+            usage='hocort index catalog [-h] [<tool>] [-x <idx>]'
+        )
+        parser.add_argument(
+            'tool',
+            nargs='?',
+            choices=list(indexes.INDEX_FILES),
+            help='str: only list the indexes of this tool'
+        )
+        parser.add_argument(
+            '-x',
+            '--index',
+            required=False,
+            type=str,
+            metavar=('<idx>'),
+            help='str: path or name of an index whose record is shown (requires <tool> for names)'
+        )
+        parsed = parser.parse_args(args=args)
+
+        if parsed.index:
+            index = lookup(parsed.index, parsed.tool) if parsed.tool else parsed.index
+            record = read_record(record_path(index))
+            if not record:
+                logger.error(f'No record of index {parsed.index}, it was not built with "hocort index"')
+                return 1
+            print(json.dumps(record, indent=4))
+            return 0
+        for name, tool, index, record in entries(parsed.tool):
+            built = f'built {record["built"]} from {record["fasta"]}' if record else 'no record'
+            print(f'{tool}\t{name}\t{index}\t{built}')
+        return 0
@@ -0,0 +1,595 @@
+"""
+Runs pipelines on worker processes ("hocort worker"), possibly on other machines,
+which receive shards of the input reads over TCP or Unix sockets.
+
+Every message is a frame: an 8 byte big-endian length followed by the payload.
+A request is a JSON frame, which the worker accepts or rejects with a JSON frame.
+The input files follow an accepted request, each as a sequence of data frames terminated by an empty frame.
+The worker answers with a JSON frame holding the returncode of the pipeline, followed by the output files
+if the pipeline succeeded.
+
+The workers run the pipelines with the index paths given by the coordinator, so every worker
+needs its own copy of the indexes at the same paths, and only serves the indexes it was started with.
+Coordinators may only set the arguments in REMOTE_ARGUMENTS, none of which names a file on the worker
+or passes options on to the tools. If the environment variable HOCORT_WORKER_TOKEN is set, the coordinator
+sends it with every request and the worker rejects requests without it. Workers only listen on other than
+Unix sockets and loopback addresses with a token. The data is not encrypted, so the workers should only be
+reachable from a trusted network.
+
+"""
+import asyncio
+import hmac
+import inspect
+import ipaddress
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+
+import hocort.pipelines
+import hocort.resources as resources
+from hocort.parse.parser import ArgParser
+from hocort.parse.parser import validate_args
+
+logger = logging.getLogger(__file__)
+
+# Length prefix of a frame.
+FRAME_HEADER = struct.Struct('>Q')
+
+# Size (in bytes) of the data frames files are sent in.
+CHUNK_SIZE = 1048576
+
+# Upper bound (in bytes) on the size of a JSON frame.
+MAX_MESSAGE_SIZE = 1048576
+
+# Environment variable holding the token shared by the coordinator and the workers.
+TOKEN_VARIABLE = 'HOCORT_WORKER_TOKEN'
+
+# Arguments which are set by the worker instead of the coordinator.
+RESERVED_ARGUMENTS = ['seq1', 'seq2', 'out1', 'out2', 'other1', 'other2', 'threads', 'shards', 'ordered', 'workers']
+
+# Output files which the worker sends back.
+OUTPUT_ARGUMENTS = ['out1', 'out2', 'other1', 'other2']
+
+# Pipelines which workers run, and the arguments coordinators may set besides the index.
+# None of them names a file on the worker or passes options on to the tools.
+REMOTE_ARGUMENTS = {
+    'bowtie2': ['mfilter', 'preset', 'pin', 'mmap', 'native', 'decision_only', 'speed'],
+    'hisat2': ['mfilter', 'pin', 'mmap', 'native', 'decision_only', 'speed'],
+    'bwamem2': ['mfilter', 'pin', 'decision_only', 'speed'],
+    'minimap2': ['mfilter', 'preset', 'pin', 'decision_only', 'speed'],
+    'bbmap': ['mfilter', 'preset', 'pin', 'native', 'decision_only', 'speed']
+}
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer sends an invalid message.
+
+    """
+    pass
+
+def parse_address(address):
+    """
+    Parses a worker address.
+
+    Parameters
+    ----------
+    address : string
+        'unix:<path>' for a Unix socket, '<host>:<port>' for a TCP socket.
+
+    Returns
+    -------
+    address : tuple
+        ('unix', path) or ('tcp', host, port).
+
+    Raises
+    ------
+    ValueError
+        If the address is invalid.
+
+    """
+    if address.startswith('unix:'):
+        return ('unix', address[len('unix:'):])
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError(f'Invalid worker address: {address}, expected <host>:<port> or unix:<path>')
+    return ('tcp', host.strip('[]') or 'localhost', int(port))
+
+def is_local(address):
+    """
+    Checks whether an address can only be reached from this machine.
+
+    Parameters
+    ----------
+    address : string
+        Address, see parse_address().
+
+    Returns
+    -------
+    local : bool
+        True for Unix sockets and loopback addresses.
+
+    """
+    parsed = parse_address(address)
+    if parsed[0] == 'unix' or parsed[1] == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(parsed[1]).is_loopback
+    except ValueError:
+        # a host name, which may resolve to any address
+        return False
+
+async def open_connection(address):
+    """
+    Connects to a worker.
+
+    Parameters
+    ----------
+    address : string
+        Address of the worker, see parse_address().
+
+    Returns
+    -------
+    (reader, writer) : tuple
+        asyncio.StreamReader and asyncio.StreamWriter of the connection.
+
+    """
+    parsed = parse_address(address)
+    if parsed[0] == 'unix':
+        return await asyncio.open_unix_connection(parsed[1])
+    return await asyncio.open_connection(parsed[1], parsed[2])
+
+async def start_server(handler, address):
+    """
+    Starts listening for connections.
+
+    Parameters
+    ----------
+    handler : function
+        Coroutine function called with (reader, writer) for every connection.
+    address : string
+        Address to listen on, see parse_address().
+
+    Returns
+    -------
+    server : asyncio.AbstractServer
+        The listening server.
+
+    """
+    parsed = parse_address(address)
+    if parsed[0] == 'unix':
+        return await asyncio.start_unix_server(handler, parsed[1])
+    return await asyncio.start_server(handler, parsed[1], parsed[2])
+
+async def send_frame(writer, data):
+    writer.write(FRAME_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+async def read_frame(reader, limit=None):
+    size, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if limit is not None and size > limit:
+        raise ProtocolError(f'Frame of {size} bytes exceeds the limit of {limit} bytes')
+    return await reader.readexactly(size)
+
+async def send_message(writer, message):
+    await send_frame(writer, json.dumps(message).encode())
+
+async def read_message(reader):
+    try:
+        return json.loads(await read_frame(reader, limit=MAX_MESSAGE_SIZE))
+    except ValueError as e:
+        raise ProtocolError(f'Invalid message: {e}')
+
+async def send_file(writer, path):
+    """
+    Sends a file as data frames terminated by an empty frame.
+
+    Parameters
+    ----------
+    writer : asyncio.StreamWriter
+        Writer of the connection.
+    path : string
+        Path of the file.
+
+    Returns
+    -------
+    None
+
+    """
+    loop = asyncio.get_event_loop()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            await send_frame(writer, chunk)
+    await send_frame(writer, b'')
+
+async def receive_file(reader, path):
+    """
+    Receives a file sent by send_file().
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        Reader of the connection.
+    path : string
+        Path the file is written to.
+
+    Returns
+    -------
+    None
+
+    """
+    loop = asyncio.get_event_loop()
+    with open(path, 'wb') as f:
+        while True:
+            chunk = await read_frame(reader, limit=CHUNK_SIZE)
+            if not chunk:
+                break
+            await loop.run_in_executor(None, f.write, chunk)
+
+def pipeline_class(name):
+    """
+    Looks up a pipeline by its name in hocort.pipelines, as used by "hocort map".
+
+    Parameters
+    ----------
+    name : string
+        Name of the pipeline.
+
+    Returns
+    -------
+    pipeline : class
+        The pipeline class.
+
+    Raises
+    ------
+    ValueError
+        If there is no such pipeline.
+
+    """
+    pipeline = getattr(hocort.pipelines, name, None) if not name.startswith('_') else None
+    if not inspect.isclass(pipeline):
+        raise ValueError(f'Invalid pipeline: {name}')
+    return pipeline
+
+def pipeline_name(pipeline):
+    """
+    Finds the name of a pipeline in hocort.pipelines, the inverse of pipeline_class().
+
+    Parameters
+    ----------
+    pipeline : object
+        The pipeline.
+
+    Returns
+    -------
+    name : string
+        Name of the pipeline.
+
+    Raises
+    ------
+    ValueError
+        If the pipeline is not listed in hocort.pipelines.
+
+    """
+    for name in dir(hocort.pipelines):
+        if not name.startswith('_') and getattr(hocort.pipelines, name) is type(pipeline):
+            return name
+    raise ValueError(f'{type(pipeline).__name__} can not be run by workers')
+
+def remote_arguments(name, pipeline, arguments):
+    """
+    Selects the arguments of a pipeline which are sent to the workers.
+
+    Parameters
+    ----------
+    name : string
+        Name of the pipeline in hocort.pipelines.
+    pipeline : object
+        The pipeline.
+    arguments : dict
+        All arguments of pipeline.commands(), by name.
+
+    Returns
+    -------
+    arguments : dict
+        The index and the arguments in REMOTE_ARGUMENTS.
+
+    Raises
+    ------
+    ValueError
+        If the pipeline can not be run by workers, or an argument which workers do not accept
+        (e.g. options) differs from its default.
+
+    """
+    if name not in REMOTE_ARGUMENTS:
+        raise ValueError(f'{type(pipeline).__name__} can not be run by workers')
+    allowed = ['idx'] + REMOTE_ARGUMENTS[name]
+    defaults = {arg: parameter.default for arg, parameter in inspect.signature(pipeline.commands).parameters.items()}
+    for arg, value in arguments.items():
+        if arg not in allowed + RESERVED_ARGUMENTS and value != defaults.get(arg):
+            raise ValueError(f'Argument {arg} can not be sent to workers')
+    return {arg: value for arg, value in arguments.items() if arg in allowed}
+
+async def run_remote(address, pipeline, arguments, inputs, outputs, token=None):
+    """
+    Runs a pipeline on a worker.
+
+    Parameters
+    ----------
+    address : string
+        Address of the worker, see parse_address().
+    pipeline : string
+        Name of the pipeline in hocort.pipelines.
+    arguments : dict
+        Keyword arguments of the pipeline, see remote_arguments(). Must be JSON serializable.
+    inputs : dict
+        Paths of the input files, keyed by argument name (seq1, seq2).
+    outputs : dict
+        Paths the output files are written to, keyed by argument name (out1, out2, other1, other2).
+    token : string
+        Token expected by the worker, defaults to the environment variable HOCORT_WORKER_TOKEN.
+
+    Returns
+    -------
+    returncode : int
+        Returncode of the pipeline on the worker, 1 if the worker rejected the request.
+
+    """
+    token = token if token is not None else os.environ.get(TOKEN_VARIABLE, '')
+    reader, writer = await open_connection(address)
+    try:
+        await send_message(writer, {
+            'token': token,
+            'pipeline': pipeline,
+            'arguments': arguments,
+            'inputs': list(inputs),
+            'outputs': {name: os.path.basename(path) for name, path in outputs.items()}
+        })
+        response = await read_message(reader)
+        if not response.get('accepted'):
+            logger.error(f'Worker {address} rejected the request: {response.get("error", "")}')
+            return 1
+        for path in inputs.values():
+            await send_file(writer, path)
+        response = await read_message(reader)
+        returncode = response.get('returncode', 1)
+        if returncode != 0:
+            logger.error(f'Worker {address} failed: {response.get("error", "")}')
+            return returncode
+        for name, path in outputs.items():
+            await receive_file(reader, path)
+        logger.info(f'Worker {address} finished in {response.get("run_time")} seconds')
+        return 0
+    finally:
+        writer.close()
+
+class Worker():
+    """
+    Worker which runs pipelines for a coordinator, see run_remote().
+
+    """
+    def __init__(self, threads=1, dir=None, token=None, indexes=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        threads : int
+            Number of threads each pipeline is run with.
+        dir : string
+            Path where the received and produced files are written.
+        token : string
+            Token required from the coordinator, defaults to the environment variable HOCORT_WORKER_TOKEN.
+        indexes : list
+            Paths (or names, see hocort.catalog) of the indexes which coordinators may use.
+
+        Returns
+        -------
+        None
+
+        """
+        self.threads = threads
+        self.dir = dir
+        self.token = token if token is not None else os.environ.get(TOKEN_VARIABLE, '')
+        self.indexes = indexes if indexes else []
+        # created in serve(), one request at a time as each pipeline uses all threads
+        self.lock = None
+
+    def check(self, request):
+        """
+        Validates a request.
+
+        Parameters
+        ----------
+        request : dict
+            The request.
+
+        Returns
+        -------
+        pipeline : class
+            The requested pipeline.
+
+        Raises
+        ------
+        ValueError
+            If the request is invalid.
+
+        """
+        if type(request) is not dict:
+            raise ValueError('Invalid request')
+        if not hmac.compare_digest(str(request.get('token', '')), self.token):
+            raise ValueError('Invalid token')
+        name = str(request.get('pipeline', ''))
+        if name not in REMOTE_ARGUMENTS:
+            raise ValueError(f'Invalid pipeline: {name}')
+        pipeline = pipeline_class(name)
+        arguments = request.get('arguments')
+        if type(arguments) is not dict or any(arg not in ['idx'] + REMOTE_ARGUMENTS[name] for arg in arguments):
+            raise ValueError('Invalid pipeline arguments')
+        if any(type(value) not in (str, bool) for value in arguments.values()):
+            raise ValueError('Invalid pipeline arguments')
+        if arguments.get('idx') not in self.indexes:
+            raise ValueError(f'Index not served by this worker: {arguments.get("idx")}')
+        valid, arg, chars = validate_args(list(arguments.values()))
+        if not valid:
+            raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
+        if not set(request.get('inputs', [])) <= {'seq1', 'seq2'} or 'seq1' not in request.get('inputs', []):
+            raise ValueError('Invalid inputs')
+        outputs = request.get('outputs')
+        if type(outputs) is not dict or not set(outputs) <= set(OUTPUT_ARGUMENTS):
+            raise ValueError('Invalid outputs')
+        for name in outputs.values():
+            if type(name) is not str or name != os.path.basename(name) or name in ['', '.', '..']:
+                raise ValueError('Invalid output name')
+        return pipeline
+
+    async def handle(self, reader, writer):
+        """
+        Handles a connection from a coordinator.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            Reader of the connection.
+        writer : asyncio.StreamWriter
+            Writer of the connection.
+
+        Returns
+        -------
+        None
+
+        """
+        try:
+            request = await read_message(reader)
+            try:
+                pipeline = self.check(request)
+            except ValueError as e:
+                logger.error(f'Rejected request: {e}')
+                await send_message(writer, {'accepted': False, 'error': str(e)})
+                return
+            await send_message(writer, {'accepted': True})
+            with tempfile.TemporaryDirectory(dir=self.dir) as work_dir:
+                paths = {}
+                for name in request['inputs']:
+                    paths[name] = f'{work_dir}/{name}.fastq'
+                    await receive_file(reader, paths[name])
+                os.mkdir(f'{work_dir}/out')
+                for name, filename in request['outputs'].items():
+                    paths[name] = f'{work_dir}/out/{filename}'
+                async with self.lock:
+                    logger.info(f'Running pipeline {request["pipeline"]} for {writer.get_extra_info("peername")}')
+                    start_time = time.time()
+                    try:
+                        returncode = await pipeline().run_async(**request['arguments'], **paths, threads=self.threads)
+                        error = ''
+                    except (ValueError, TypeError, OSError) as e:
+                        returncode, error = 1, str(e)
+                    run_time = time.time() - start_time
+                await send_message(writer, {'returncode': returncode, 'error': error, 'run_time': run_time})
+                if returncode == 0:
+                    for name in request['outputs']:
+                        await send_file(writer, paths[name])
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError) as e:
+            logger.error(f'Connection failed: {e}')
+        finally:
+            writer.close()
+
+    async def serve(self, address):
+        """
+        Serves coordinators until cancelled.
+
+        Parameters
+        ----------
+        address : string
+            Address to listen on, see parse_address().
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If the address is reachable from other machines, but no token is set.
+
+        """
+        if not self.token and not is_local(address):
+            raise ValueError(f'Set {TOKEN_VARIABLE} to listen on {address}, which other machines can reach')
+        self.lock = asyncio.Lock()
+        server = await start_server(self.handle, address)
+        logger.info(f'Worker listening on {address} with {self.threads} threads')
+        try:
+            await server.serve_forever()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments and starts the worker.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser.
+
+        Returns
+        -------
+        None
+
+        """
+        parser = ArgParser(
+            description='hocort worker: run pipelines on shards of reads sent by coordinators',
+            usage='hocort worker [-h] [--threads <int>] [--temp <dir>] --listen <address> --indexes <idx> [<idx> ...]'
+        )
+        parser.add_argument(
+            '--listen',
+            required=True,
+            type=str,
+            metavar=('<address>'),
+            help='str: address to listen on, <host>:<port> or unix:<path>, other than unix sockets and loopback addresses require HOCORT_WORKER_TOKEN (required)'
+        )
+        parser.add_argument(
+            '-x',
+            '--indexes',
+            required=True,
+            type=str,
+            nargs=('+'),
+            metavar=('<idx>'),
+            help='str: paths or names of the indexes which coordinators may use, as given to -x of the pipelines (required)'
+        )
+        parser.add_argument(
+            '-t',
+            '--threads',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '--temp',
+            required=False,
+            type=str,
+            metavar=('<dir>'),
+            help='str: path where the received shards are written (default: system temporary directory)'
+        )
+        parsed = parser.parse_args(args=args)
+
+        self.threads = parsed.threads if parsed.threads else 1
+        self.dir = parsed.temp
+        self.indexes = parsed.indexes
+        try:
+            asyncio.run(self.serve(parsed.listen))
+        except KeyboardInterrupt:
+            pass
+        except ValueError as e:
+            logger.error(str(e))
+            return 1
+        return 0
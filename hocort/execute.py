@@ -2,61 +2,760 @@
 Executes commands as subprocesses at the OS level.
 
 """
+import asyncio
 import subprocess
+import threading
 import logging
+import os
+import queue
+import signal
+import time
 
 logger = logging.getLogger(__file__)
 
+# Upper bound (in bytes) on a single line read from a subprocess pipe.
+# Longer lines are logged in chunks of this size, which keeps memory usage
+# bounded regardless of what the external tools write.
+MAX_LINE_LENGTH = 65536
 
-def execute(cmds, pipe=False, merge_stdout_stderr=False):
+# Seconds the remaining stages of a failed pipe are given to exit after
+# SIGTERM, before they are killed with SIGKILL.
+TERMINATE_TIMEOUT = 10
+
+
+class Command(list):
+    """
+    A command (list of arguments) whose stdout is written to a file instead of
+    being piped to the next command or logged, and/or which is pinned to a set of CPUs,
+    and/or which exchanges data with another command of the pipe through FIFOs.
+    Only the last command of a pipe may redirect its stdout.
+
+    """
+    def __init__(self, args, stdout=None, cpus=None, fifos=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        args : list
+            The command and its arguments.
+        stdout : string
+            Path of the file which the stdout of the command is written to.
+            If '-', the stdout of the command is the stdout of this process.
+            If None, the stdout is handled like that of a plain list.
+        cpus : set
+            CPUs which the command is pinned to (see os.sched_setaffinity).
+            If None, the command may run on any CPU available to this process.
+        fifos : list
+            Paths of FIFOs which the command writes to or reads from, and another command of the same pipe
+            reads from or writes to. They are created before the commands are started, and removed after they exit.
+
+        Returns
+        -------
+        None
+
+        """
+        super(Command, self).__init__(args)
+        self.stdout = stdout
+        self.cpus = cpus
+        self.fifos = fifos
+
+def affinity(cmd):
+    """
+    Returns a function which pins the calling process to the CPUs of a command.
+    It is run in the child process before the command is executed.
+
+    Parameters
+    ----------
+    cmd : list
+        The command. Only Command objects may be pinned to CPUs.
+
+    Returns
+    -------
+    preexec_fn : function or None
+        None if the command is not pinned to any CPUs.
+
+    """
+    cpus = getattr(cmd, 'cpus', None)
+    if not cpus:
+        return None
+    return lambda: os.sched_setaffinity(0, cpus)
+
+def make_fifos(cmds):
+    """
+    Creates the FIFOs of the commands, see Command.
+
+    Parameters
+    ----------
+    cmds : list
+        List of commands.
+
+    Returns
+    -------
+    paths : list
+        Paths of the created FIFOs.
+
+    """
+    paths = []
+    try:
+        for cmd in cmds:
+            for path in getattr(cmd, 'fifos', None) or []:
+                os.mkfifo(path)
+                paths.append(path)
+    except BaseException:
+        remove_fifos(paths)
+        raise
+    return paths
+
+def remove_fifos(paths):
+    """
+    Removes FIFOs created by make_fifos().
+
+    Parameters
+    ----------
+    paths : list
+        Paths of the FIFOs.
+
+    Returns
+    -------
+    None
+
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def open_stdout(cmd):
+    """
+    Opens the stdout redirection target of a command.
+
+    Parameters
+    ----------
+    cmd : list
+        The command. Only Command objects may redirect their stdout.
+
+    Returns
+    -------
+    stdout : file or int or None
+        Value to pass as stdout to the subprocess.
+        subprocess.PIPE if the command does not redirect its stdout.
+
+    """
+    redirect = getattr(cmd, 'stdout', None)
+    if not redirect:
+        return subprocess.PIPE
+    if redirect == '-':
+        return None
+    return open(redirect, 'wb')
+
+class StageResult():
+    """
+    Result and resource usage of one executed subprocess (pipeline stage).
+    Resources which could not be measured are set to None.
+
+    Attributes
+    ----------
+    cmd : list
+        The executed command.
+    returncode : int
+        Returncode of the subprocess.
+    wall_time : float
+        Wall time in seconds from spawning the subprocess until it exited.
+    user_time : float
+        User CPU time in seconds.
+    system_time : float
+        System CPU time in seconds.
+    max_rss : int
+        Maximum resident set size in KiB.
+    read_chars : int
+        Bytes read by the subprocess, including pipes and page cache hits.
+    write_chars : int
+        Bytes written by the subprocess, including pipes.
+    read_bytes : int
+        Bytes fetched from the storage layer.
+    write_bytes : int
+        Bytes sent to the storage layer.
+
+    """
+    def __init__(self, cmd, returncode, wall_time, user_time=None, system_time=None, max_rss=None,
+                 read_chars=None, write_chars=None, read_bytes=None, write_bytes=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+        self.read_chars = read_chars
+        self.write_chars = write_chars
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+    @property
+    def name(self):
+        """
+        Name of the executed program.
+
+        """
+        cmd = self.cmd if isinstance(self.cmd, list) else [self.cmd]
+        return os.path.basename(cmd[0])
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.__dict__})'
+
+    def __str__(self):
+        def fmt(value, unit):
+            if value is None: return 'n/a'
+            if type(value) is float: return f'{value:.2f} {unit}'
+            return f'{value} {unit}'
+        return (f'{self.name}: returncode {self.returncode}, '
+                f'wall time {fmt(self.wall_time, "s")}, '
+                f'user time {fmt(self.user_time, "s")}, '
+                f'system time {fmt(self.system_time, "s")}, '
+                f'max RSS {fmt(self.max_rss, "KiB")}, '
+                f'read {fmt(self.read_chars, "B")} ({fmt(self.read_bytes, "B")} from storage), '
+                f'written {fmt(self.write_chars, "B")} ({fmt(self.write_bytes, "B")} to storage)')
+
+class ExecutionResult(list):
+    """
+    List of returncodes from the executed subprocesses, which additionally
+    holds the StageResult of every subprocess in the "stages" attribute, and
+    the StageResult of the first stage which failed in the "failed" attribute.
+
+    """
+    def __init__(self, stages, failed=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        stages : list
+            List of StageResult objects, in the order the commands were given.
+        failed : StageResult
+            The first stage which exited with a non-zero returncode, None if all succeeded.
+
+        Returns
+        -------
+        None
+
+        """
+        super(ExecutionResult, self).__init__(stage.returncode for stage in stages)
+        self.stages = stages
+        self.failed = failed
+
+def read_proc_io(pid):
+    """
+    Reads the I/O counters of a process from /proc/<pid>/io.
+
+    Parameters
+    ----------
+    pid : int
+        Process ID.
+
+    Returns
+    -------
+    counters : dict
+        Dictionary with the counters, empty if they could not be read.
+
+    """
+    counters = {}
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+def wait(proc, cmd, start_time):
+    """
+    Waits for a subprocess to exit and measures its resource usage.
+    The I/O counters are read while the process is a zombie, before it is reaped with os.wait4().
+
+    Parameters
+    ----------
+    proc : subprocess.Popen
+        The subprocess to wait for.
+    cmd : list
+        The command which the subprocess executes.
+    start_time : float
+        Time (as returned by time.time()) when the subprocess was spawned.
+
+    Returns
+    -------
+    stage : StageResult
+        Returncode and resource usage of the subprocess.
+
+    """
+    try:
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        io = read_proc_io(proc.pid)
+        pid, status, rusage = os.wait4(proc.pid, 0)
+    except (AttributeError, ChildProcessError):
+        # os.waitid is not available on every platform
+        proc.wait()
+        return StageResult(cmd, proc.returncode, time.time() - start_time)
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return StageResult(cmd,
+                       proc.returncode,
+                       time.time() - start_time,
+                       user_time=rusage.ru_utime,
+                       system_time=rusage.ru_stime,
+                       max_rss=rusage.ru_maxrss,
+                       read_chars=io.get('rchar'),
+                       write_chars=io.get('wchar'),
+                       read_bytes=io.get('read_bytes'),
+                       write_bytes=io.get('write_bytes'))
+
+def wait_in_thread(stages, i, proc, cmd, start_time, finished):
+    """
+    Starts a daemon thread which waits for a subprocess and stores its StageResult in stages[i].
+    When the subprocess has exited, i is put into the finished queue.
+
+    Parameters
+    ----------
+    stages : list
+        List where the StageResult is stored.
+    i : int
+        Index in stages where the StageResult is stored.
+    proc : subprocess.Popen
+        The subprocess to wait for.
+    cmd : list
+        The command which the subprocess executes.
+    start_time : float
+        Time (as returned by time.time()) when the subprocess was spawned.
+    finished : queue.Queue
+        Queue which receives i once the subprocess has exited.
+
+    Returns
+    -------
+    thread : threading.Thread
+        The started waiter thread.
+
+    """
+    def target():
+        stages[i] = wait(proc, cmd, start_time)
+        finished.put(i)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+def kill(procs, sig):
+    """
+    Sends a signal to the process groups of all subprocesses which have not yet exited.
+
+    Parameters
+    ----------
+    procs : list
+        List of subprocess.Popen or asyncio.subprocess.Process objects,
+        started with start_new_session=True.
+    sig : int
+        Signal to send.
+
+    Returns
+    -------
+    None
+
+    """
+    for proc in procs:
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+def supervise(procs, stages, finished, fail_fast=True):
+    """
+    Watches piped subprocesses until all of them have exited.
+    If fail_fast is set and a subprocess exits with a non-zero returncode,
+    the remaining subprocesses are terminated, and killed if they do not exit
+    within TERMINATE_TIMEOUT seconds.
+
+    Parameters
+    ----------
+    procs : list
+        List of subprocess.Popen objects.
+    stages : list
+        List where the waiter threads store the StageResult of every subprocess.
+    finished : queue.Queue
+        Queue which receives the index of every subprocess which has exited.
+    fail_fast : bool
+        Whether to terminate the remaining subprocesses when one fails.
+
+    Returns
+    -------
+    failed : StageResult
+        The first stage which exited with a non-zero returncode, None if all succeeded.
+
+    """
+    failed = None
+    deadline = None
+    running = len(procs)
+    while running > 0:
+        timeout = None if deadline is None else max(0, deadline - time.time())
+        try:
+            i = finished.get(timeout=timeout)
+        except queue.Empty:
+            kill(procs, signal.SIGKILL)
+            deadline = None
+            continue
+        running -= 1
+        if stages[i].returncode != 0 and failed is None:
+            failed = stages[i]
+            if fail_fast and running > 0:
+                logger.error(f'Stage {i + 1} ({failed.name}) exited with returncode {failed.returncode}, terminating the remaining stages')
+                kill(procs, signal.SIGTERM)
+                deadline = time.time() + TERMINATE_TIMEOUT
+    return failed
+
+def log_stream(stream):
+    """
+    Reads a subprocess output stream line by line until EOF and logs every line.
+
+    Parameters
+    ----------
+    stream : file
+        Binary file object (subprocess pipe) to read from.
+
+    Returns
+    -------
+    None
+
+    """
+    with stream:
+        for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), b''):
+            logger.info(line.rstrip().decode('utf-8', errors='replace'))
+
+def drain(stream):
+    """
+    Starts a daemon thread which drains and logs a subprocess output stream.
+
+    Parameters
+    ----------
+    stream : file
+        Binary file object (subprocess pipe) to read from.
+
+    Returns
+    -------
+    thread : threading.Thread
+        The started reader thread.
+
+    """
+    thread = threading.Thread(target=log_stream, args=(stream,), daemon=True)
+    thread.start()
+    return thread
+
+def check_redirects(cmds, pipe):
+    """
+    Checks that only the last command of a pipe redirects its stdout.
+
+    Parameters
+    ----------
+    cmds : list
+        List of commands to be executed.
+    pipe : bool
+        Whether the commands are piped.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If a command other than the last one of a pipe redirects its stdout.
+
+    """
+    if not pipe: return
+    for cmd in cmds[:-1]:
+        if getattr(cmd, 'stdout', None):
+            raise ValueError(f'Only the last command of a pipe may redirect its stdout: {cmd}')
+
+def execute(cmds, pipe=False, merge_stdout_stderr=False, fail_fast=True):
     """
     Takes a list of commands, and spawns subprocesses.
 
+    The stdout and stderr pipes of every subprocess are drained concurrently
+    by reader threads, so a subprocess never blocks on a full pipe.
+    The resource usage (CPU time, peak RSS, I/O) of every subprocess is measured.
+    Every subprocess runs in its own process group, which is killed if execute()
+    is interrupted (e.g. by KeyboardInterrupt).
+
     Parameters
     ----------
     cmds : list
         List of commands to be executed.
         Format: [[ls], [grep file]]
+        The last command may be a Command which redirects its stdout to a file,
+        in which case its stdout is not logged.
     pipe : bool
         Whether to pipe output from cmd1 to cmd2 etc.
+        If False, the commands are executed one after another.
     merge_stdout_stderr : bool
         Whether to merge stderr output into stdout.
+    fail_fast : bool
+        Only used if pipe is True. Whether to terminate all stages of the pipe
+        as soon as one stage exits with a non-zero returncode.
 
     Returns
     -------
-    returncodes : list
+    returncodes : ExecutionResult
         List of returncodes from the executed subprocesses.
+        The resource usage of every subprocess is available in its "stages" attribute,
+        and the first stage which failed in its "failed" attribute.
 
     """
     logger.debug(f'Commands: {cmds}')
 
-    returncodes = []
+    stages = [None] * len(cmds)
     procs = []
+    readers = []
+    finished = queue.Queue()
+    failed = None
 
     stdin = None
 
     if type(cmds) is not list:
         logger.error(f'Commands supplied are not in a list: {cmds}')
         raise TypeError(f'Commands supplied are not in a list: {cmds}')
-    for cmd, i in zip(cmds, range(len(cmds))):
-        if i == len(cmds) - 1:
-            stderr = subprocess.STDOUT if merge_stdout_stderr else subprocess.PIPE
-        else:
-            stderr = subprocess.STDOUT if not pipe and merge_stdout_stderr else subprocess.PIPE
-        proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr)
-        # realtime print stdout and stderr
-        if i == len(cmds) - 1 and pipe or not pipe:
-            for line in iter(proc.stdout.readline, b''):
-                logger.info(line.rstrip().decode('utf-8'))
-        stdin = proc.stdout if pipe else None
-        procs.append(proc)
+    check_redirects(cmds, pipe)
+    fifos = make_fifos(cmds)
+    try:
+        for cmd, i in zip(cmds, range(len(cmds))):
+            if i == len(cmds) - 1:
+                stderr = subprocess.STDOUT if merge_stdout_stderr else subprocess.PIPE
+            else:
+                stderr = subprocess.STDOUT if not pipe and merge_stdout_stderr else subprocess.PIPE
+            start_time = time.time()
+            stdout = open_stdout(cmd)
+            try:
+                proc = subprocess.Popen(cmd,
+                                        stdin=stdin,
+                                        stdout=stdout,
+                                        stderr=stderr,
+                                        preexec_fn=affinity(cmd),
+                                        start_new_session=True)
+            finally:
+                # the child holds its own copy of the pipe, closing ours lets
+                # the upstream process receive SIGPIPE if this stage exits early
+                if stdin: stdin.close()
+                if stdout not in (subprocess.PIPE, None): stdout.close()
+            procs.append(proc)
+            if proc.stdout and (i == len(cmds) - 1 and pipe or not pipe):
+                readers.append(drain(proc.stdout))
+            if proc.stderr:
+                readers.append(drain(proc.stderr))
+            stdin = proc.stdout if pipe else None
+            if pipe:
+                wait_in_thread(stages, i, proc, cmd, start_time, finished)
+            else:
+                stages[i] = wait(proc, cmd, start_time)
+                if stages[i].returncode != 0 and failed is None:
+                    failed = stages[i]
 
-    for proc in procs:
-        if not merge_stdout_stderr and proc.stderr:
-            for line in iter(proc.stderr.readline, b''):
-                logger.info(line.rstrip().decode('utf-8'))
-        proc.wait()
-    for proc in procs:
-        returncodes.append(proc.returncode)
+        if pipe:
+            failed = supervise(procs, stages, finished, fail_fast=fail_fast)
+        for reader in readers:
+            reader.join()
+    except BaseException:
+        kill(procs, signal.SIGKILL)
+        raise
+    finally:
+        remove_fifos(fifos)
+    returncodes = ExecutionResult(stages, failed=failed)
+    for stage in stages:
+        logger.debug(repr(stage))
+
+    return returncodes
+
+async def log_stream_async(stream):
+    """
+    Reads an asyncio subprocess output stream line by line until EOF and logs every line.
+
+    Parameters
+    ----------
+    stream : asyncio.StreamReader
+        Stream to read from.
+
+    Returns
+    -------
+    None
+
+    """
+    while True:
+        try:
+            line = await stream.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        except asyncio.LimitOverrunError as e:
+            line = await stream.read(e.consumed)
+        if not line: break
+        logger.info(line.rstrip().decode('utf-8', errors='replace'))
+
+async def wait_async(proc, cmd, start_time):
+    """
+    Waits for an asyncio subprocess to exit and measures its wall time.
+
+    Parameters
+    ----------
+    proc : asyncio.subprocess.Process
+        The subprocess to wait for.
+    cmd : list
+        The command which the subprocess executes.
+    start_time : float
+        Time (as returned by time.time()) when the subprocess was spawned.
+
+    Returns
+    -------
+    stage : StageResult
+        Returncode and wall time of the subprocess.
+
+    """
+    returncode = await proc.wait()
+    return StageResult(cmd, returncode, time.time() - start_time)
+
+async def supervise_async(procs, waiters, fail_fast=True):
+    """
+    Asynchronous counterpart of supervise(). Watches piped subprocesses until all of them have exited.
+
+    Parameters
+    ----------
+    procs : list
+        List of asyncio.subprocess.Process objects.
+    waiters : list
+        List of tasks which return the StageResult of every subprocess.
+    fail_fast : bool
+        Whether to terminate the remaining subprocesses when one fails.
+
+    Returns
+    -------
+    failed : StageResult
+        The first stage which exited with a non-zero returncode, None if all succeeded.
+
+    """
+    failed = None
+    deadline = None
+    pending = set(waiters)
+    while pending:
+        timeout = None if deadline is None else max(0, deadline - time.time())
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            kill(procs, signal.SIGKILL)
+            deadline = None
+            continue
+        for task in waiters:
+            if task not in done: continue
+            stage = task.result()
+            if stage.returncode != 0 and failed is None:
+                failed = stage
+                if fail_fast and pending:
+                    logger.error(f'Stage {waiters.index(task) + 1} ({failed.name}) exited with returncode {failed.returncode}, terminating the remaining stages')
+                    kill(procs, signal.SIGTERM)
+                    deadline = time.time() + TERMINATE_TIMEOUT
+    return failed
+
+async def execute_async(cmds, pipe=False, merge_stdout_stderr=False, fail_fast=True):
+    """
+    Asynchronous counterpart of execute(). Takes a list of commands, and spawns subprocesses
+    with asyncio, which allows many command lists to be executed concurrently in one event loop.
+    If the coroutine is cancelled, the process groups of the spawned subprocesses are killed.
+    The subprocesses are reaped by asyncio, so only the wall time of every subprocess is measured.
+
+    Parameters
+    ----------
+    cmds : list
+        List of commands to be executed.
+        Format: [[ls], [grep file]]
+        The last command may be a Command which redirects its stdout to a file,
+        in which case its stdout is not logged.
+    pipe : bool
+        Whether to pipe output from cmd1 to cmd2 etc.
+        If False, the commands are executed one after another.
+    merge_stdout_stderr : bool
+        Whether to merge stderr output into stdout.
+    fail_fast : bool
+        Only used if pipe is True. Whether to terminate all stages of the pipe
+        as soon as one stage exits with a non-zero returncode.
+
+    Returns
+    -------
+    returncodes : ExecutionResult
+        List of returncodes from the executed subprocesses.
+        The wall time of every subprocess is available in its "stages" attribute,
+        and the first stage which failed in its "failed" attribute.
+
+    """
+    logger.debug(f'Commands: {cmds}')
+
+    procs = []
+    readers = []
+    waiters = []
+    failed = None
+
+    stdin = None
+
+    if type(cmds) is not list:
+        logger.error(f'Commands supplied are not in a list: {cmds}')
+        raise TypeError(f'Commands supplied are not in a list: {cmds}')
+    check_redirects(cmds, pipe)
+    fifos = make_fifos(cmds)
+    try:
+        for cmd, i in zip(cmds, range(len(cmds))):
+            if i == len(cmds) - 1:
+                stderr = subprocess.STDOUT if merge_stdout_stderr else subprocess.PIPE
+            else:
+                stderr = subprocess.STDOUT if not pipe and merge_stdout_stderr else subprocess.PIPE
+            next_stdin = None
+            if pipe and i < len(cmds) - 1:
+                next_stdin, stdout = os.pipe()
+            else:
+                stdout = open_stdout(cmd)
+            start_time = time.time()
+            try:
+                proc = await asyncio.create_subprocess_exec(*([cmd] if type(cmd) is str else cmd),
+                                                            stdin=stdin,
+                                                            stdout=stdout,
+                                                            stderr=stderr,
+                                                            limit=MAX_LINE_LENGTH,
+                                                            preexec_fn=affinity(cmd),
+                                                            start_new_session=True)
+            except BaseException:
+                if next_stdin is not None: os.close(next_stdin)
+                raise
+            finally:
+                # the children hold their own copies of the pipe
+                if stdin is not None: os.close(stdin)
+                if next_stdin is not None: os.close(stdout)
+                elif stdout not in (subprocess.PIPE, None): stdout.close()
+            stdin = next_stdin
+            procs.append(proc)
+            if proc.stdout:
+                readers.append(asyncio.ensure_future(log_stream_async(proc.stdout)))
+            if proc.stderr:
+                readers.append(asyncio.ensure_future(log_stream_async(proc.stderr)))
+            waiters.append(asyncio.ensure_future(wait_async(proc, cmd, start_time)))
+            if not pipe:
+                stage = await waiters[-1]
+                if stage.returncode != 0 and failed is None:
+                    failed = stage
+
+        if pipe:
+            failed = await supervise_async(procs, waiters, fail_fast=fail_fast)
+        stages = [waiter.result() for waiter in waiters]
+        await asyncio.gather(*readers)
+    except BaseException:
+        kill(procs, signal.SIGKILL)
+        for task in readers + waiters:
+            task.cancel()
+        for proc in procs:
+            await proc.wait()
+        raise
+    finally:
+        remove_fifos(fifos)
+    returncodes = ExecutionResult(stages, failed=failed)
+    for stage in stages:
+        logger.debug(repr(stage))
 
     return returncodes
@@ -0,0 +1,870 @@
+"""
+Keeps indexes close to the tools, so that runs do not spend most of their time reading the index
+from a slow or shared filesystem.
+
+An index can be staged, i.e. copied into shared memory (/dev/shm), where it is shared by all processes
+of the node. An index can also be warmed, i.e. read into the page cache, and optionally locked there with mlock.
+If a cache directory on a node-local disk is configured, indexes are copied there on first use, verified with
+a checksum, and the least recently used indexes are evicted when the size of the cache exceeds its limit.
+
+The pipelines resolve their index once per run with resolve(), which points them at the staged or cached copy
+as long as it is identical to the original (same files, sizes and modification times). A run holds a shared lock
+on the copy it uses until it finishes, and evict() skips copies which are in use.
+
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from hocort.parse.parser import ArgParser
+
+logger = logging.getLogger(__file__)
+
+# Directory where indexes are staged. Can be set with the environment variable HOCORT_STAGING_DIR.
+STAGING_DIR = os.environ.get('HOCORT_STAGING_DIR', '/dev/shm/hocort')
+
+# Node-local directory where indexes are cached on first use, None to disable the cache.
+# Can be set with the environment variable HOCORT_CACHE_DIR.
+CACHE_DIR = os.environ.get('HOCORT_CACHE_DIR') or None
+
+# Maximum size (GiB) of the cache, None if unlimited. Can be set with the environment variable HOCORT_CACHE_SIZE.
+CACHE_SIZE = float(os.environ['HOCORT_CACHE_SIZE']) if os.environ.get('HOCORT_CACHE_SIZE') else None
+
+# Name of the file describing a staged or cached index, in its directory.
+# Its modification time records when the copy was last used.
+MANIFEST = 'manifest.json'
+
+# Suffix of the lock file next to a staged or cached index, which runs using the copy hold shared
+# so that it is not evicted, see resolve().
+IN_USE_SUFFIX = '.use'
+
+# Size (in bytes) of the chunks in which files are copied and checksummed.
+COPY_CHUNK_SIZE = 8388608
+
+# Files which make up an index, per tool. {index} is the index path as passed to the tool,
+# {stem} the index path without its extension.
+INDEX_FILES = {
+    'bowtie2': ['{index}.*.bt2', '{index}.*.bt2l'],
+    'hisat2': ['{index}.*.ht2', '{index}.*.ht2l'],
+    'bwamem2': ['{index}.0123', '{index}.amb', '{index}.ann', '{index}.bwt.2bit.64', '{index}.pac'],
+    'minimap2': ['{index}'],
+    'bbmap': ['{index}/ref/**'],
+    'kraken2': ['{index}/*.k2d'],
+    'biobloom': ['{index}', '{stem}.txt']
+}
+
+# Size (in bytes) of the reads which pull a file into the page cache.
+WARM_CHUNK_SIZE = 8388608
+
+
+def index_files(index, tool):
+    """
+    Lists the files which make up an index.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index, as passed to the tool.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+
+    Returns
+    -------
+    files : list
+        Paths of the existing files of the index, sorted.
+
+    Raises
+    ------
+    ValueError
+        If the tool is unknown.
+
+    """
+    if tool not in INDEX_FILES:
+        raise ValueError(f'Invalid tool: {tool}, choose from {list(INDEX_FILES)}')
+    index = os.path.normpath(index)
+    stem = os.path.splitext(index)[0]
+    files = set()
+    for pattern in INDEX_FILES[tool]:
+        pattern = pattern.format(index=glob.escape(index), stem=glob.escape(stem))
+        files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(files)
+
+def describe(files, base):
+    """
+    Describes files by their size and modification time, which tells whether a copy is still current.
+
+    Parameters
+    ----------
+    files : list
+        Paths of the files.
+    base : string
+        Directory the paths are made relative to.
+
+    Returns
+    -------
+    description : dict
+        [size, modification time in ns] of every file, by its path relative to base.
+
+    """
+    description = {}
+    for path in files:
+        stat = os.stat(path)
+        description[os.path.relpath(path, base)] = [stat.st_size, stat.st_mtime_ns]
+    return description
+
+def staging_paths(index, tool, dir=None):
+    """
+    Determines where an index is staged.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+    dir : string
+        Staging directory, defaults to STAGING_DIR.
+
+    Returns
+    -------
+    (stage_dir, staged_index) : tuple
+        Directory holding the staged copy, and the path of the staged index as passed to the tool.
+
+    """
+    dir = dir if dir else STAGING_DIR
+    index = os.path.normpath(os.path.abspath(index))
+    key = hashlib.sha1(f'{tool}:{index}'.encode()).hexdigest()[:16]
+    stage_dir = os.path.join(dir, key)
+    return stage_dir, os.path.join(stage_dir, os.path.basename(index))
+
+@contextlib.contextmanager
+def locked(path):
+    """
+    Holds an exclusive lock on a file while the context is active, so that concurrent processes
+    do not stage the same index at the same time.
+
+    Parameters
+    ----------
+    path : string
+        Path of the lock file, which is created if it does not exist.
+
+    """
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def hold(stage_dir, stack):
+    """
+    Takes a shared lock on the in-use lock file of a staged or cached index, which is held until
+    the stack is closed, so that evict() skips the copy while it is used.
+
+    Parameters
+    ----------
+    stage_dir : string
+        Directory of the copy, whose parent must exist.
+    stack : contextlib.ExitStack
+        Stack which releases the lock when it is closed.
+
+    Returns
+    -------
+    None
+
+    """
+    f = stack.enter_context(open(stage_dir + IN_USE_SUFFIX, 'a'))
+    fcntl.flock(f, fcntl.LOCK_SH)
+
+def is_current(index, tool, stage_dir):
+    """
+    Checks whether the staged copy of an index is identical to the index.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+    stage_dir : string
+        Directory holding the staged copy.
+
+    Returns
+    -------
+    current : bool
+        True if the staged copy is identical to the index.
+
+    """
+    try:
+        with open(os.path.join(stage_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    files = index_files(index, tool)
+    base = os.path.dirname(os.path.normpath(os.path.abspath(index)))
+    return bool(files) and manifest.get('files') == describe(files, base)
+
+def checksum(path):
+    """
+    Computes the SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    path : string
+        Path of the file.
+
+    Returns
+    -------
+    checksum : string
+        Hexadecimal SHA-256 digest.
+
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def copy_verified(src, dst):
+    """
+    Copies a file, checksumming the data read from src, then verifies the copy by checksumming dst.
+
+    Parameters
+    ----------
+    src : string
+        Path of the file.
+    dst : string
+        Path of the copy.
+
+    Returns
+    -------
+    checksum : string
+        Hexadecimal SHA-256 digest of the file.
+
+    Raises
+    ------
+    OSError
+        If the copy differs from the file.
+
+    """
+    digest = hashlib.sha256()
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        for chunk in iter(lambda: s.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            d.write(chunk)
+    if checksum(dst) != digest.hexdigest():
+        raise OSError(f'Checksum of the copy {dst} does not match {src}')
+    return digest.hexdigest()
+
+def copies(dir):
+    """
+    Lists the staged or cached indexes of a directory.
+
+    Parameters
+    ----------
+    dir : string
+        Staging or cache directory.
+
+    Returns
+    -------
+    copies : list
+        (stage_dir, manifest, last_used) of every copy, least recently used first.
+
+    """
+    result = []
+    for path in glob.glob(f'{glob.escape(dir)}/*/{MANIFEST}'):
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            result.append((os.path.dirname(path), manifest, os.stat(path).st_mtime))
+        except (OSError, ValueError):
+            continue
+    return sorted(result, key=lambda copy: copy[2])
+
+def evict(dir, size, capacity, keep=None):
+    """
+    Removes the least recently used copies from a directory until size more bytes fit into its capacity.
+    Copies which are being written by another process, or used by a run, are skipped.
+
+    Parameters
+    ----------
+    dir : string
+        Staging or cache directory.
+    size : int
+        Number of bytes which must fit.
+    capacity : int
+        Maximum number of bytes of all copies.
+    keep : string
+        Directory of a copy which is never evicted.
+
+    Returns
+    -------
+    fits : bool
+        True if size bytes fit into the capacity.
+
+    """
+    entries = [entry for entry in copies(dir) if entry[0] != keep]
+    used = sum(manifest.get('size', 0) for stage_dir, manifest, last_used in entries)
+    for stage_dir, manifest, last_used in entries:
+        if used + size <= capacity:
+            break
+        with open(stage_dir + '.lock', 'a') as f, open(stage_dir + IN_USE_SUFFIX, 'a') as g:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(g, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            try:
+                # processes which opened the files of the copy before it was held keep them
+                shutil.rmtree(stage_dir, ignore_errors=True)
+            finally:
+                fcntl.flock(g, fcntl.LOCK_UN)
+                fcntl.flock(f, fcntl.LOCK_UN)
+        used -= manifest.get('size', 0)
+        logger.info(f'Evicted {manifest.get("index") or manifest.get("key")} from {dir}')
+    return used + size <= capacity
+
+def stage(index, tool, dir=None, verify=False, capacity=None):
+    """
+    Copies an index into a staging or cache directory, unless an identical copy is already there.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+    dir : string
+        Staging or cache directory, defaults to STAGING_DIR.
+    verify : bool
+        Whether to verify the copy with checksums, which are recorded in its manifest.
+    capacity : float
+        Maximum size (GiB) of all copies in dir. The least recently used copies are evicted to make room.
+        None if unlimited.
+
+    Returns
+    -------
+    staged_index : string
+        Path of the copied index, as passed to the tool.
+
+    Raises
+    ------
+    ValueError
+        If the index has no files, or does not fit into the directory.
+    OSError
+        If copying or verifying the index fails.
+
+    """
+    dir = dir if dir else STAGING_DIR
+    files = index_files(index, tool)
+    if not files:
+        raise ValueError(f'No {tool} index found at: {index}')
+    stage_dir, staged_index = staging_paths(index, tool, dir=dir)
+    os.makedirs(dir, exist_ok=True)
+    with locked(stage_dir + '.lock'):
+        if is_current(index, tool, stage_dir):
+            logger.info(f'Index {index} is already copied to {staged_index}')
+            os.utime(os.path.join(stage_dir, MANIFEST))
+            return staged_index
+        if os.path.isdir(stage_dir):
+            shutil.rmtree(stage_dir)
+        size = sum(os.path.getsize(path) for path in files)
+        if capacity is not None:
+            with locked(os.path.join(dir, '.evict.lock')):
+                if not evict(dir, size, int(capacity * 2**30), keep=stage_dir):
+                    raise ValueError(f'Index {index} ({size} bytes) does not fit into the capacity of {dir} ({capacity} GiB)')
+        free = shutil.disk_usage(dir).free
+        if size > free:
+            raise ValueError(f'Index {index} ({size} bytes) does not fit into {dir} ({free} bytes free)')
+
+        logger.info(f'Copying index {index} ({size / 2**30:.2f} GiB) to {staged_index}')
+        start_time = time.time()
+        base = os.path.dirname(os.path.normpath(os.path.abspath(index)))
+        tmp_dir = tempfile.mkdtemp(dir=dir, prefix=os.path.basename(stage_dir) + '.')
+        try:
+            checksums = {}
+            for path in files:
+                name = os.path.relpath(os.path.abspath(path), base)
+                target = os.path.join(tmp_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if verify:
+                    checksums[name] = copy_verified(path, target)
+                else:
+                    shutil.copyfile(path, target)
+            manifest = {'tool': tool, 'index': os.path.abspath(index), 'size': size, 'files': describe(files, base)}
+            if verify:
+                manifest['checksums'] = checksums
+            with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+                json.dump(manifest, f)
+            os.rename(tmp_dir, stage_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info(f'Copied index {index} in {time.time() - start_time:.1f} seconds')
+    return staged_index
+
+def unstage(index, tool, dir=None):
+    """
+    Removes the staged or cached copy of an index.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+    dir : string
+        Staging or cache directory, defaults to STAGING_DIR.
+
+    Returns
+    -------
+    removed : bool
+        True if there was a copy.
+
+    """
+    stage_dir, staged_index = staging_paths(index, tool, dir=dir)
+    if not os.path.isdir(stage_dir):
+        return False
+    with locked(stage_dir + '.lock'):
+        shutil.rmtree(stage_dir, ignore_errors=True)
+    logger.info(f'Removed the copy of index {index} from {os.path.dirname(stage_dir)}')
+    return True
+
+def cache(index, tool, dir=None, capacity=None):
+    """
+    Copies an index into the cache directory on first use, see stage().
+
+    Parameters
+    ----------
+    index : string
+        Path of the index.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+    dir : string
+        Cache directory, defaults to CACHE_DIR.
+    capacity : float
+        Maximum size (GiB) of the cache, defaults to CACHE_SIZE.
+
+    Returns
+    -------
+    cached_index : string
+        Path of the cached index, as passed to the tool.
+
+    Raises
+    ------
+    ValueError
+        If no cache directory is configured, the index has no files, or does not fit into the cache.
+    OSError
+        If copying or verifying the index fails.
+
+    """
+    dir = dir if dir else CACHE_DIR
+    if not dir:
+        raise ValueError('No cache directory is configured, set HOCORT_CACHE_DIR')
+    return stage(index, tool, dir=dir, verify=True, capacity=capacity if capacity is not None else CACHE_SIZE)
+
+def resolve(index, tool, dir=None, stack=None):
+    """
+    Returns the path of the staged copy of an index if it is current. Otherwise, if a cache directory
+    is configured, returns the path of the cached copy, copying the index into the cache first if needed.
+    Otherwise, or if caching fails, returns the index itself. Staged and cached copies are returned unchanged.
+    Called by the pipelines once per run, before their commands are built, so that every pipeline uses staged
+    and cached indexes automatically.
+
+    Parameters
+    ----------
+    index : string
+        Path of the index.
+    tool : string
+        Name of the tool, a key of INDEX_FILES.
+    dir : string
+        Staging directory, defaults to STAGING_DIR.
+    stack : contextlib.ExitStack
+        Stack which holds the copy in use, see hold(), until it is closed. None to not hold it.
+
+    Returns
+    -------
+    index : string
+        Path of the index to pass to the tool.
+
+    """
+    if not index:
+        return index
+    dir = dir if dir else STAGING_DIR
+    copy_dir = os.path.dirname(os.path.dirname(os.path.normpath(os.path.abspath(index))))
+    if any(d and copy_dir == os.path.normpath(os.path.abspath(d)) for d in [dir, CACHE_DIR]):
+        return index
+    stage_dir, staged_index = staging_paths(index, tool, dir=dir)
+    with contextlib.ExitStack() as held:
+        # the copy is held before it is checked, so that it can not be evicted in between
+        if os.path.isdir(stage_dir):
+            hold(stage_dir, held)
+            if is_current(index, tool, stage_dir):
+                logger.info(f'Using staged index: {staged_index}')
+                if stack is not None:
+                    stack.enter_context(held.pop_all())
+                return staged_index
+        held.close()
+        if CACHE_DIR and index_files(index, tool):
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                hold(staging_paths(index, tool, dir=CACHE_DIR)[0], held)
+                cached_index = cache(index, tool)
+                logger.info(f'Using cached index: {cached_index}')
+                if stack is not None:
+                    stack.enter_context(held.pop_all())
+                return cached_index
+            except (ValueError, OSError) as e:
+                logger.warning(f'Could not cache index {index}, using it directly: {e}')
+    return index
+
+def libc():
+    lib = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    lib.mmap.restype = ctypes.c_void_p
+    lib.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    lib.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    lib.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    lib.mlock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    return lib
+
+def map_file(lib, path):
+    """
+    Maps a file into memory with mmap(2), which unlike the mmap module exposes the address for mincore and mlock.
+
+    Parameters
+    ----------
+    lib : ctypes.CDLL
+        The C library, as returned by libc().
+    path : string
+        Path of the file.
+
+    Returns
+    -------
+    (address, size) : tuple
+        Address and size of the mapping. The address is None if the file is empty.
+
+    Raises
+    ------
+    OSError
+        If the file cannot be mapped.
+
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return None, 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        address = lib.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+    finally:
+        os.close(fd)
+    if address is None or address == ctypes.c_void_p(-1).value:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f'mmap failed: {os.strerror(errno)}', path)
+    return address, size
+
+def resident(files):
+    """
+    Measures how much of the files is held in the page cache.
+
+    Parameters
+    ----------
+    files : list
+        Paths of the files.
+
+    Returns
+    -------
+    (resident, size) : tuple
+        Number of resident bytes and total number of bytes of the files.
+
+    """
+    lib = libc()
+    page_size = mmap.PAGESIZE
+    resident_bytes = 0
+    total = 0
+    for path in files:
+        address, size = map_file(lib, path)
+        total += size
+        if not size:
+            continue
+        try:
+            pages = (size + page_size - 1) // page_size
+            vector = (ctypes.c_ubyte * pages)()
+            if lib.mincore(address, size, vector) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f'mincore failed: {os.strerror(errno)}', path)
+            resident_bytes += min(sum(page & 1 for page in vector) * page_size, size)
+        finally:
+            lib.munmap(address, size)
+    return resident_bytes, total
+
+def warm(files):
+    """
+    Reads files into the page cache.
+
+    Parameters
+    ----------
+    files : list
+        Paths of the files.
+
+    Returns
+    -------
+    None
+
+    """
+    buffer = bytearray(WARM_CHUNK_SIZE)
+    for path in files:
+        with open(path, 'rb', buffering=0) as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while f.readinto(buffer):
+                pass
+
+def lock(files):
+    """
+    Locks files into memory with mlock, until this process exits.
+    Requires a sufficient RLIMIT_MEMLOCK (ulimit -l) or CAP_IPC_LOCK.
+
+    Parameters
+    ----------
+    files : list
+        Paths of the files.
+
+    Returns
+    -------
+    mappings : list
+        (address, size) of the locked mappings.
+
+    Raises
+    ------
+    OSError
+        If a file cannot be locked.
+
+    """
+    lib = libc()
+    mappings = []
+    for path in files:
+        address, size = map_file(lib, path)
+        if not size:
+            continue
+        if lib.mlock(address, size) != 0:
+            errno = ctypes.get_errno()
+            lib.munmap(address, size)
+            for mapping in mappings:
+                lib.munmap(*mapping)
+            raise OSError(errno, f'mlock failed: {os.strerror(errno)}', path)
+        mappings.append((address, size))
+    return mappings
+
+class Warm():
+    """
+    Stages indexes into shared memory and warms the page cache, see "hocort index warm".
+
+    """
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments, then stages and/or warms the index.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser.
+
+        Returns
+        -------
+        returncode : int
+            0 if the index was staged and/or warmed, 1 otherwise.
+
+        """
+        parser = ArgParser(
+            description='hocort index warm: stage an index into shared memory and/or read it into the page cache',
+            usage='hocort index warm [-h] <tool> -x <idx> [--stage <bool>] [--unstage <bool>] [--lock <bool>] [--dir <dir>]'
+        )
+        parser.add_argument(
+            'tool',
+            choices=list(INDEX_FILES),
+            help='str: tool the index belongs to (required)'
+        )
+        parser.add_argument(
+            '-x',
+            '--index',
+            required=True,
+            type=str,
+            metavar=('<idx>'),
+            help='str: path to the index, as passed to "hocort map" (required)'
+        )
+        parser.add_argument(
+            '--stage',
+            required=False,
+            choices=['true', 'false'],
+            default='true',
+            help='str: set to false to only warm the page cache instead of copying the index into shared memory (default: true)'
+        )
+        parser.add_argument(
+            '--unstage',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to remove the staged copy of the index (default: false)'
+        )
+        parser.add_argument(
+            '--lock',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to lock the index into memory with mlock, which lasts until this command is stopped (default: false)'
+        )
+        parser.add_argument(
+            '--dir',
+            required=False,
+            type=str,
+            metavar=('<dir>'),
+            help=f'str: staging directory (default: {STAGING_DIR}, or $HOCORT_STAGING_DIR)'
+        )
+        parsed = parser.parse_args(args=args)
+
+        tool = parsed.tool
+        index = parsed.index
+        if parsed.unstage == 'true':
+            if not unstage(index, tool, dir=parsed.dir):
+                logger.warning(f'Index {index} is not staged')
+            return 0
+        try:
+            if parsed.stage == 'true':
+                index = stage(index, tool, dir=parsed.dir)
+            files = index_files(index, tool)
+            if not files:
+                raise ValueError(f'No {tool} index found at: {index}')
+            resident_bytes, size = resident(files)
+            logger.info(f'Index {index}: {resident_bytes / 2**30:.2f} of {size / 2**30:.2f} GiB resident in memory')
+            if resident_bytes < size:
+                start_time = time.time()
+                warm(files)
+                resident_bytes, size = resident(files)
+                logger.info(f'Warmed index {index} in {time.time() - start_time:.1f} seconds: {resident_bytes / 2**30:.2f} of {size / 2**30:.2f} GiB resident in memory')
+            if parsed.lock == 'true':
+                mappings = lock(files)
+                logger.info(f'Locked index {index} into memory, stop this command to release it')
+                signal.signal(signal.SIGTERM, lambda signum, frame: signal.default_int_handler(signum, frame))
+                try:
+                    while True:
+                        signal.pause()
+                except KeyboardInterrupt:
+                    logger.info(f'Released index {index}')
+        except (ValueError, OSError) as e:
+            logger.error(str(e))
+            return 1
+        return 0
+
+class Cache():
+    """
+    Manages the node-local index cache, see "hocort index cache".
+
+    """
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments, then fills, lists or clears the cache.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser.
+
+        Returns
+        -------
+        returncode : int
+            0 if successful, 1 otherwise.
+
+        """
+        parser = ArgParser(
+            description='hocort index cache: copy an index into the node-local index cache, or list or clear the cache',
+            usage='hocort index cache [-h] [<tool> -x <idx>] [--remove <bool>] [--list <bool>] [--clear <bool>] [--dir <dir>] [--size <GiB>]'
+        )
+        parser.add_argument(
+            'tool',
+            nargs='?',
+            choices=list(INDEX_FILES),
+            help='str: tool the index belongs to'
+        )
+        parser.add_argument(
+            '-x',
+            '--index',
+            required=False,
+            type=str,
+            metavar=('<idx>'),
+            help='str: path to the index, as passed to "hocort map"'
+        )
+        parser.add_argument(
+            '--remove',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to remove the index from the cache instead of copying it (default: false)'
+        )
+        parser.add_argument(
+            '--list',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to list the cached indexes, least recently used first (default: false)'
+        )
+        parser.add_argument(
+            '--clear',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to remove all cached indexes (default: false)'
+        )
+        parser.add_argument(
+            '--dir',
+            required=False,
+            type=str,
+            metavar=('<dir>'),
+            default=CACHE_DIR,
+            help='str: cache directory (default: $HOCORT_CACHE_DIR)'
+        )
+        parser.add_argument(
+            '--size',
+            required=False,
+            type=float,
+            metavar=('<GiB>'),
+            default=CACHE_SIZE,
+            help='float: maximum size of the cache, the least recently used indexes are evicted (default: $HOCORT_CACHE_SIZE, or unlimited)'
+        )
+        parsed = parser.parse_args(args=args)
+
+        if not parsed.dir:
+            logger.error('No cache directory given, use --dir or set HOCORT_CACHE_DIR')
+            return 1
+        if parsed.clear == 'true':
+            for stage_dir, manifest, last_used in copies(parsed.dir):
+                unstage(manifest['index'], manifest['tool'], dir=parsed.dir)
+        elif parsed.tool and parsed.index:
+            try:
+                if parsed.remove == 'true':
+                    if not unstage(parsed.index, parsed.tool, dir=parsed.dir):
+                        logger.warning(f'Index {parsed.index} is not cached')
+                else:
+                    cache(parsed.index, parsed.tool, dir=parsed.dir, capacity=parsed.size)
+            except (ValueError, OSError) as e:
+                logger.error(str(e))
+                return 1
+        elif parsed.list != 'true':
+            parser.error('give <tool> -x <idx>, --list true or --clear true')
+        if parsed.list == 'true':
+            total = 0
+            for stage_dir, manifest, last_used in copies(parsed.dir):
+                total += manifest.get('size', 0)
+                print(f'{manifest["tool"]}\t{manifest["index"]}\t{manifest.get("size", 0) / 2**30:.2f} GiB\t'
+                      f'last used {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_used))}')
+            print(f'total\t{total / 2**30:.2f} GiB' + (f' of {parsed.size} GiB' if parsed.size else ''))
+        return 0
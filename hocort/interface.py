@@ -5,13 +5,18 @@ Command line user interface for HoCoRT.
 from argparse import Action
 import sys
 import inspect
-import multiprocessing
 import platform
 
 import hocort.aligners
 import hocort.pipelines
+import hocort.distributed as distributed
+import hocort.batch as batch
+import hocort.indexes as indexes
+import hocort.catalog as catalog
+import hocort.build as build
 import hocort.version as version
 import hocort.logging
+import hocort.resources as resources
 from hocort.parse.parser import ArgParser
 
 
@@ -31,6 +36,14 @@ for pipeline in dir(hocort.pipelines):
         if inspect.isclass(m):
             pipelines[pipeline] = m
 
+# Index management commands of "hocort index", besides building the index of a tool
+index_commands = {
+    'warm': indexes.Warm,
+    'cache': indexes.Cache,
+    'catalog': catalog.Catalog,
+    'all': build.BuildAll
+}
+
 class HelpActionMap(Action):
     """
     Called when '-h' or '--help' flags are given.
@@ -92,6 +105,8 @@ class HelpActionIndex(Action):
             if tool in aligners:
                 tool_interface = aligners[tool]().index_interface
                 tool_interface(['-h'])
+            elif tool in index_commands:
+                index_commands[tool]().interface(['-h'])
         else:
             parser.print_help()
         parser.exit()
@@ -100,7 +115,9 @@ def machine_info():
     message = '\n'
     message += '{}\n'.format(platform.platform())
     message += 'Python {}\n'.format(platform.python_version())
-    message += 'Available threads: {}'.format(str(multiprocessing.cpu_count()))
+    message += 'Available threads: {}\n'.format(str(resources.available_cpus()))
+    memory = resources.available_memory()
+    message += 'Available memory: {}'.format(f'{memory / 2**30:.1f} GiB' if memory else 'unknown')
     message += '\n\n'
     return message
 
@@ -134,6 +151,9 @@ def extra_help_index():
     message = '\navailable tools:'
     for aligner in aligners:
         message += f'\n    {aligner}'
+    message += '\n\navailable commands:'
+    for command in index_commands:
+        message += f'\n    {command}'
     message += '\n'
     message += machine_info()
     return message
@@ -227,7 +247,7 @@ def main():
     parser_index.add_argument(
         'tool',
         type=str,
-        help='str: tool to generate index for (required)'
+        help='str: tool to generate index for, or index command (required)'
     )
     parser_index.add_argument(
         '-h',
@@ -254,6 +274,60 @@ def main():
         type=str,
         help='str: path to log file'
     )
+    # batch subcommand
+    parser_batch = subparsers.add_parser(
+        'batch',
+        prog='hocort',
+        description='hocort batch: run a pipeline on every sample of a sample sheet',
+        usage='hocort batch [pipeline] [options]',
+        help='run a pipeline on every sample of a sample sheet',
+        add_help=False
+    )
+    parser_batch.add_argument(
+        '-d',
+        '--debug',
+        action='store_true',
+        help='flag: verbose output'
+    )
+    parser_batch.add_argument(
+        '-q',
+        '--quiet',
+        action='store_true',
+        help='flag: quiet output (overrides -d/--debug)'
+    )
+    parser_batch.add_argument(
+        '-l',
+        '--log-file',
+        type=str,
+        help='str: path to log file'
+    )
+    # worker subcommand
+    parser_worker = subparsers.add_parser(
+        'worker',
+        prog='hocort',
+        description='hocort worker: run pipelines on shards of reads sent by other hocort processes',
+        usage='hocort worker [options]',
+        help='run pipelines on shards of reads sent by other hocort processes',
+        add_help=False
+    )
+    parser_worker.add_argument(
+        '-d',
+        '--debug',
+        action='store_true',
+        help='flag: verbose output'
+    )
+    parser_worker.add_argument(
+        '-q',
+        '--quiet',
+        action='store_true',
+        help='flag: quiet output (overrides -d/--debug)'
+    )
+    parser_worker.add_argument(
+        '-l',
+        '--log-file',
+        type=str,
+        help='str: path to log file'
+    )
 
     args, unknown_args = parser.parse_known_args()
     cmd = args.subcommand
@@ -275,9 +349,19 @@ def main():
         interface = None
         if args.tool in aligners.keys():
             interface = aligners[args.tool]().index_interface
+        elif args.tool in index_commands:
+            interface = index_commands[args.tool]().interface
         else:
             logger.error(f'Invalid tool: {args.tool}')
             sys.exit(1)
         returncode = interface(unknown_args)
         logger.info(f'Process exited with returncode: {returncode}')
         sys.exit(returncode)
+    if cmd == 'worker':
+        returncode = distributed.Worker().interface(unknown_args)
+        logger.info(f'Worker exited with returncode: {returncode}')
+        sys.exit(returncode)
+    if cmd == 'batch':
+        returncode = batch.Batch().interface(unknown_args)
+        logger.info(f'Batch exited with returncode: {returncode}')
+        sys.exit(returncode)
@@ -0,0 +1,240 @@
+import collections
+import gzip
+import itertools
+import shutil
+
+# Number of reads written to a shard at a time when the reads are distributed round-robin.
+BLOCK_READS = 16384
+
+# Separates the sample from the read name in multiplexed reads. Sample names cannot contain it,
+# as it is not among the characters allowed by validate_args(), and SAM read names can.
+SAMPLE_SEPARATOR = '|'
+
+# Maximum number of output files demultiplex() keeps open at a time.
+MAX_OPEN_FILES = 64
+
+
+class FastQ:
+    """
+    FastQ splitting and merging class.
+
+    """
+    def open(path, mode='rt'):
+        """
+        Opens a FastQ file, which may be gzip compressed.
+
+        Parameters
+        ----------
+        path : string
+            FastQ file path. Compressed if it ends with '.gz'.
+        mode : string
+            Mode in which the file is opened.
+
+        Returns
+        -------
+        file : file object
+            The opened file.
+
+        """
+        if path.endswith('.gz'):
+            return gzip.open(path, mode)
+        return open(path, mode)
+
+    def count(path):
+        """
+        Counts the reads of a FastQ file.
+
+        Parameters
+        ----------
+        path : string
+            FastQ file path.
+
+        Returns
+        -------
+        reads : int
+            Number of reads (four lines each).
+
+        """
+        with FastQ.open(path) as f:
+            return sum(1 for line in f) // 4
+
+    def split(path, shard_paths, ordered=False, reads=None):
+        """
+        Splits a FastQ file into shards. Mates stay consistent when the files of both mates are split
+        with the same arguments, as only the position of a read decides its shard.
+
+        Parameters
+        ----------
+        path : string
+            Input FastQ file path.
+        shard_paths : list
+            Output FastQ file paths, one per shard.
+        ordered : bool
+            True: shard i holds the i-th contiguous part of the reads, so concatenating the shards
+            restores the input order. Requires reads, or counts them first.
+            False: blocks of BLOCK_READS reads are distributed round-robin in a single pass.
+        reads : int
+            Number of reads in the input, only used if ordered.
+
+        Returns
+        -------
+        None
+
+        """
+        shards = [open(shard_path, 'w') for shard_path in shard_paths]
+        try:
+            if ordered:
+                if reads is None:
+                    reads = FastQ.count(path)
+                sizes = [reads // len(shards) + (1 if i < reads % len(shards) else 0) for i in range(len(shards))]
+            with FastQ.open(path) as f:
+                if ordered:
+                    for shard, size in zip(shards, sizes):
+                        shard.writelines(itertools.islice(f, size * 4))
+                else:
+                    for shard in itertools.cycle(shards):
+                        block = list(itertools.islice(f, BLOCK_READS * 4))
+                        if not block:
+                            break
+                        shard.writelines(block)
+        finally:
+            for shard in shards:
+                shard.close()
+
+    def concatenate(paths, out):
+        """
+        Concatenates files, in the given order. Gzip compressed files are concatenated as gzip members,
+        which makes the result a valid gzip file as well. Uncompressed files are compressed
+        into a gzip member of their own if the output path ends with '.gz'.
+
+        Parameters
+        ----------
+        paths : list
+            Input file paths.
+        out : string
+            Output file path.
+
+        Returns
+        -------
+        None
+
+        """
+        with open(out, 'wb') as o:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    if out.endswith('.gz') and f.peek(2)[:2] != b'\x1f\x8b':
+                        with gzip.GzipFile(fileobj=o, mode='wb') as member:
+                            shutil.copyfileobj(f, member, 1048576)
+                    else:
+                        shutil.copyfileobj(f, o, 1048576)
+
+    def mate_pattern(path1, path2):
+        """
+        Returns the pattern of a pair of FastQ file paths which only differ in the mate number,
+        with the number replaced by '%', as taken by the --un-conc and --al-conc options of Bowtie2 and HISAT2.
+
+        Parameters
+        ----------
+        path1 : string
+            Path of the first FastQ file.
+        path2 : string
+            Path of the second FastQ file.
+
+        Returns
+        -------
+        pattern : string
+            The pattern, None if the paths differ in anything but a '1' in path1 and a '2' in path2.
+
+        """
+        if len(path1) != len(path2):
+            return None
+        diffs = [i for i, (a, b) in enumerate(zip(path1, path2)) if a != b]
+        if len(diffs) != 1 or path1[diffs[0]] != '1' or path2[diffs[0]] != '2' or '%' in path1:
+            return None
+        return path1[:diffs[0]] + '%' + path1[diffs[0] + 1:]
+
+    def multiplex(inputs, out):
+        """
+        Concatenates the reads of many samples into one FastQ file, prefixing every read name
+        with its sample and SAMPLE_SEPARATOR, so that demultiplex() can split them again.
+
+        Parameters
+        ----------
+        inputs : list
+            List of (sample, path) tuples.
+        out : string
+            Output FastQ file path, may be a FIFO.
+
+        Returns
+        -------
+        reads : dict
+            Number of reads of each sample.
+
+        """
+        reads = {}
+        with open(out, 'w') as o:
+            for sample, path in inputs:
+                count = 0
+                with FastQ.open(path) as f:
+                    for i, line in enumerate(f):
+                        if i % 4 == 0:
+                            o.write(f'@{sample}{SAMPLE_SEPARATOR}{line[1:]}')
+                            count += 1
+                        else:
+                            o.write(line)
+                reads[sample] = count
+        return reads
+
+    def demultiplex(path, outputs):
+        """
+        Splits multiplexed reads (see multiplex()) into one FastQ file per sample, restoring the read names.
+        Every output file is written, even if its sample has no reads. At most MAX_OPEN_FILES are kept open,
+        so that thousands of samples do not exhaust the file descriptors.
+
+        Parameters
+        ----------
+        path : string
+            Input FastQ file path, may be a FIFO.
+        outputs : dict
+            Output FastQ file path of each sample. Compressed if it ends with '.gz'.
+
+        Returns
+        -------
+        reads : dict
+            Number of reads of each sample.
+
+        Raises
+        ------
+        ValueError
+            If a read does not belong to any of the samples.
+
+        """
+        reads = {sample: 0 for sample in outputs}
+        files = collections.OrderedDict()
+        def output(sample):
+            if sample in files:
+                files.move_to_end(sample)
+                return files[sample]
+            if len(files) >= MAX_OPEN_FILES:
+                files.popitem(last=False)[1].close()
+            # reopened files are appended to, gzip members included
+            files[sample] = FastQ.open(outputs[sample], 'at' if reads[sample] else 'wt')
+            return files[sample]
+        try:
+            with FastQ.open(path) as f:
+                for header in f:
+                    record = [next(f, ''), next(f, ''), next(f, '')]
+                    sample, separator, name = header[1:].partition(SAMPLE_SEPARATOR)
+                    if not separator or sample not in outputs:
+                        raise ValueError(f'Read does not belong to any sample: {header.strip()}')
+                    o = output(sample)
+                    o.write('@' + name)
+                    o.writelines(record)
+                    reads[sample] += 1
+        finally:
+            for o in files.values():
+                o.close()
+        for sample, count in reads.items():
+            if count == 0:
+                FastQ.open(outputs[sample], 'wt').close()
+        return reads
@@ -1,3 +1,10 @@
+import os
+import tempfile
+import uuid
+
+import hocort.execute as exe
+
+
 class SAM:
     """
     SAM parsing and processing class.
@@ -48,9 +55,10 @@ class SAM:
 
         return [cmd]
 
-    def sam_to_fastq(input_path=None, out1=None, out2=None, threads=1, mfilter=False):
+    def sam_to_fastq(input_path=None, out1=None, out2=None, threads=1, mfilter=False, other1=None, other2=None):
         """
         Takes SAM input, selects mapped/unmapped reads, and outputs FastQ.
+        Optionally the reads which are not selected are output as well, from the same input.
 
         Parameters
         ----------
@@ -66,22 +74,51 @@ class SAM:
             Whether to output mapped/unmapped sequences.
             True: output unmapped sequences
             False: output mapped sequences
+            None: output all sequences
+        other1 : string
+            FastQ READ1 (if paired), READ_OTHER (if unpaired) output path of the other reads,
+            i.e. all reads which are not selected. Paired reads of which only one mate is mapped
+            are selected with neither mfilter, so they are output here in both cases.
+        other2 : string
+            FastQ READ2 output path of the other reads.
 
         Returns
         -------
         [cmd] : list
             List of commands to be executed.
+            If other1 is given, three piped commands: samtools view passes the selected reads on,
+            and writes the rest to a FIFO read by the last command.
 
         """
+        if other1:
+            fifo = os.path.join(tempfile.gettempdir(), f'hocort_{uuid.uuid4().hex}.fifo')
+            split_cmd = ['samtools', 'view', '--threads', f'{threads}', '-u', '-U', fifo]
+            if out1 and out2:
+                split_cmd += ['-f', '13'] if mfilter else ['-F', '12', '-f', '1']
+            else:
+                split_cmd += ['-f', '4'] if mfilter else ['-F', '4']
+            split_cmd += [input_path] if input_path else ['-']
+            selected_cmd = SAM.sam_to_fastq(out1=out1, out2=out2, threads=threads, mfilter=mfilter)[0]
+            # the rejects are converted as they are, so that the two outputs hold all the reads
+            other_cmd = SAM.sam_to_fastq(input_path=fifo, out1=other1, out2=other2, threads=threads, mfilter=None)[0]
+            # the stdout of the selected reads is piped into the last command, which does not read it
+            if out1 and out2:
+                selected_cmd[5:5] = ['-0', os.devnull]
+            return [exe.Command(split_cmd, fifos=[fifo]), selected_cmd, other_cmd]
+
         cmd = ['samtools', 'fastq', '--threads', f'{threads}', '-N']
         if out1 and out2:
-            if mfilter:
+            if mfilter is None:
+                pass
+            elif mfilter:
                 cmd += ['-f', '13']
             else:
                 cmd += ['-F', '12', '-f', '1']
             cmd += ['-1', out1, '-2', out2]
         if out1 and not out2:
-            if mfilter:
+            if mfilter is None:
+                pass
+            elif mfilter:
                 cmd += ['-f', '4']
             else:
                 cmd += ['-F', '4']
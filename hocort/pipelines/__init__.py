@@ -8,3 +8,4 @@ from hocort.pipelines.kraken2_bowtie2 import Kraken2Bowtie2 as kraken2bowtie2
 from hocort.pipelines.kraken2_hisat2 import Kraken2HISAT2 as kraken2hisat2
 from hocort.pipelines.kraken2_minimap2 import Kraken2Minimap2 as kraken2minimap2
 from hocort.pipelines.bbmap import BBMap as bbmap
+from hocort.pipelines.cascade import Cascade as cascade
@@ -1,24 +1,42 @@
-import time
-import os
+import asyncio
+import contextlib
 import logging
 
 from hocort.pipelines.utils import debug_log_args
+from hocort.pipelines.utils import speed_options
+from hocort.pipelines.utils import SPEEDS
+from hocort.pipelines.utils import execute_pipeline
+from hocort.pipelines.utils import execute_pipeline_async
+from hocort.pipelines.utils import resolve_index
+from hocort.pipelines.utils import execute_sharded_async
+from hocort.pipelines.utils import standard_streams
 from hocort.aligners.bbmap import BBMap as bb
 from hocort.parse.sam import SAM
 from hocort.parse.parser import ArgParser
-import hocort.execute as exe
+import hocort.budget as budget
+import hocort.resources as resources
+import hocort.results as results
 
 logger = logging.getLogger(__file__)
 
+# Extensions of the paths which BBMap writes as FastQ.
+FASTQ_EXTENSIONS = ('.fastq', '.fq', '.fastq.gz', '.fq.gz')
+
+# Options of BBMap for the speed tiers, see hocort.pipelines.utils.speed_options().
+SPEED_OPTIONS = {
+    'fast': ['fast=t'],
+    'sensitive': ['slow=t']
+}
+
 
 class BBMap():
     """
     BBMap pipeline which maps reads to a genome and includes/excludes matching reads from the output FastQ file/-s.
 
     """
-    def run(self, idx, seq1, out1, seq2=None, out2=None, mfilter=True, preset='illumina', threads=1, options=''):
+    def commands(self, idx, seq1, out1, seq2=None, out2=None, mfilter=True, preset='illumina', threads=1, options='', pin=False, other1=None, other2=None, native=False, decision_only=False, speed='balanced'):
         """
-        Run function which starts the pipeline.
+        Builds the commands which make up the pipeline.
 
         Parameters
         ----------
@@ -40,31 +58,51 @@ class BBMap():
             Type of reads to align to reference.
             Types: 'illumina' and 'nanopore'.
         threads : int
-            Number of threads to use.
+            Number of threads to use, split between the aligner and samtools.
         options : string
             An options string where arguments may be defined.
             Overrides "preset" argument.
+        pin : bool
+            Whether to pin the aligner and samtools to disjoint sets of CPUs.
+        other1 : string
+            Path where the first output FastQ file of the other reads will be written, i.e. those
+            which the opposite mfilter would output. Both are written from the same alignment.
+        other2 : string
+            Path where the second output FastQ file of the other reads will be written.
+        native : bool
+            Whether BBMap writes the output FastQ files itself (outu=, outm=) instead of writing SAM
+            which samtools converts, saving the SAM output and the samtools processes. A pair counts as mapped
+            if either of its reads maps, whereas samtools selects pairs by whether both reads map.
+            Falls back to samtools for output paths without a FastQ extension (.fastq, .fq, optionally .gz).
+        decision_only : bool
+            Whether the aligner only decides whether reads align instead of searching for their best alignment,
+            see DECISION_OPTIONS of hocort.aligners.bbmap. Reads are still output by whether they align.
+        speed : string
+            Speed tier, one of hocort.pipelines.utils.SPEEDS, which trades sensitivity for speed
+            with the options in SPEED_OPTIONS. 'balanced' keeps the defaults of BBMap.
 
         Returns
         -------
-        returncode : int
-            Resulting returncode after the process is finished.
+        cmds : list
+            List of commands to be executed.
 
         Raises
         ------
         ValueError
-            If input FastQ_2 file is given without output FastQ_2.
+            If input FastQ_2 file is given without output FastQ_2, or other output FastQ_2.
             If disallowed characters are found in input.
+            If the speed tier is invalid.
 
         """
         debug_log_args(logger,
-                       self.run.__name__,
+                       self.commands.__name__,
                        locals())
         if seq2 and not out2:
             raise ValueError(f'Input FastQ_2 was given, but no output FastQ_2.')
-
-        logger.info(f'Running pipeline: {self.__class__.__name__}')
-        start_time = time.time()
+        if other1 and seq2 and not other2:
+            raise ValueError(f'Input FastQ_2 was given, but no other output FastQ_2.')
+        if other2 and not (other1 and seq2):
+            raise ValueError(f'Other output FastQ_2 was given, but no input FastQ_2 or other output FastQ_1.')
 
         final_options = []
         if preset == 'illumina':
@@ -74,29 +112,125 @@ class BBMap():
 
         if len(options) > 0:
             final_options = [options]
+        final_options = speed_options(SPEED_OPTIONS, speed) + final_options
+
+        outputs = [path for path in [out1, out2, other1, other2] if path]
+        if native and not all(path.endswith(FASTQ_EXTENSIONS) for path in outputs):
+            logger.warning(f'Output paths without a FastQ extension, converting the alignment with samtools instead')
+            native = False
+        if native:
+            selected = [out1, out2] if seq2 else [out1]
+            others = ([other1, other2] if seq2 else [other1]) if other1 else None
+            cmds = bb().align(idx,
+                              seq1,
+                              seq2=seq2,
+                              threads=threads,
+                              options=final_options,
+                              decision_only=decision_only,
+                              unaligned=selected if mfilter else others,
+                              aligned=others if mfilter else selected)
+            if pin:
+                cmds = budget.pin(cmds, [threads])
+            return cmds
 
+        aligner_threads, samtools_threads = budget.split(threads, ['bbmap.sh', 'samtools'])
         bbmap_cmd = bb().align(idx,
                                seq1,
                                output='stdout.sam',
                                seq2=seq2,
-                               threads=threads,
-                               options=final_options)
-        if bbmap_cmd == None: return 1
+                               threads=aligner_threads,
+                               options=final_options,
+                               decision_only=decision_only)
         fastq_cmd = SAM.sam_to_fastq(out1=out1,
                                      out2=out2,
-                                     threads=threads,
-                                     mfilter=mfilter)
+                                     threads=samtools_threads,
+                                     mfilter=mfilter,
+                                     other1=other1,
+                                     other2=other2)
+
+        cmds = bbmap_cmd + fastq_cmd
+        if pin:
+            cmds = budget.pin(cmds, [aligner_threads] + [samtools_threads] * len(fastq_cmd))
+        return cmds
+
+    def run(self, *args, shards=1, ordered=False, workers=None, resume=False, **kwargs):
+        """
+        Run function which starts the pipeline.
 
-        returncodes = exe.execute(bbmap_cmd + fastq_cmd,
-                                  pipe=True)
+        Parameters
+        ----------
+        *args, **kwargs
+            Passed on to commands(), see its documentation for the available arguments.
+        shards : int
+            Number of shards the input reads are split into, which are run concurrently with
+            an equal share of the threads. 0 chooses the number of shards from the number of threads.
+        ordered : bool
+            Whether the output keeps the input order of the reads when sharded,
+            as far as the aligner itself does. Requires an extra pass over the input.
+        workers : list
+            Addresses of "hocort worker" processes which run the shards, see hocort.distributed.
+            Defaults to one shard per worker. The workers need the index at the same path.
+        resume : bool
+            Whether to record the completed shards in a journal next to the output (<out1>.journal),
+            so that running the pipeline again after an interruption only runs the unfinished shards.
+            Without shards or workers, the number of shards is chosen from the number of threads.
 
-        logger.debug(returncodes)
-        for returncode in returncodes:
-            if returncode != 0: return 1
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
 
-        end_time = time.time()
-        logger.info(f'Pipeline {self.__class__.__name__} run time: {end_time - start_time} seconds')
-        return 0
+        Raises
+        ------
+        ValueError
+            If commands() raises ValueError.
+
+        """
+        if shards != 1 or workers or resume:
+            return asyncio.run(self.run_async(*args, shards=shards, ordered=ordered, workers=workers, resume=resume, **kwargs))
+        with contextlib.ExitStack() as stack:
+            cmds = self.commands(**resolve_index('bbmap', self.commands, args, kwargs, stack))
+            cache = results.entry('bbmap', self.commands, args, kwargs)
+            return execute_pipeline(logger, self.__class__.__name__, cmds, pipe=True, cache=cache)
+
+    async def run_async(self, *args, shards=1, ordered=False, workers=None, resume=False, **kwargs):
+        """
+        Asynchronous counterpart of run(), which allows many pipelines to run concurrently in one event loop.
+        Cancelling the returned coroutine terminates the running subprocesses.
+
+        Parameters
+        ----------
+        *args, **kwargs
+            Passed on to commands(), see its documentation for the available arguments.
+        shards : int
+            Number of shards, see run().
+        ordered : bool
+            Whether to keep the input order of the reads when sharded, see run().
+        workers : list
+            Addresses of workers which run the shards, see run().
+        resume : bool
+            Whether to resume an interrupted sharded run, see run().
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        Raises
+        ------
+        ValueError
+            If commands() raises ValueError.
+
+        """
+        if shards != 1 or workers or resume:
+            cache = await asyncio.get_event_loop().run_in_executor(None, results.entry, 'bbmap', self.commands, args, kwargs)
+            return await execute_sharded_async(logger, self, args, kwargs, shards, ordered=ordered, pipe=True, workers=workers, cache=cache, resume=resume, tool='bbmap')
+        loop = asyncio.get_event_loop()
+        with contextlib.ExitStack() as stack:
+            arguments = await loop.run_in_executor(None, resolve_index, 'bbmap', self.commands, args, kwargs, stack)
+            cmds = self.commands(**arguments)
+            cache = await loop.run_in_executor(None, results.entry, 'bbmap', self.commands, args, kwargs)
+            return await execute_pipeline_async(logger, self.__class__.__name__, cmds, pipe=True, cache=cache)
 
     def interface(self, args):
         """
@@ -114,7 +248,7 @@ class BBMap():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} pipeline',
-            usage=f'hocort map {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] [--preset <type>] [-c=<str>] -x <idx> -i <fastq_1> [<fastq_2>] -o <fastq_1> [<fastq_2>]'
+            usage=f'hocort map {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] [--pin <bool>] [--shards <int>] [--ordered <bool>] [--workers <address> ...] [--resume <bool>] [--native <bool>] [--decision_only <bool>] [--speed <str>] [--preset <type>] [-c=<str>] -x <idx> -i <fastq_1> [<fastq_2>] -o <fastq_1> [<fastq_2>] [--other <fastq_1> [<fastq_2>]]'
         )
         parser.add_argument(
             '-x',
@@ -131,7 +265,7 @@ class BBMap():
             type=str,
             nargs=('+'),
             metavar=('<fastq_1>', '<fastq_2>'),
-            help='str: path to sequence files, max 2 (.gz compression supported) (required)'
+            help='str: path to sequence files, max 2 (.gz compression supported) (- reads stdin, - - reads interleaved pairs from stdin) (required)'
         )
         parser.add_argument(
             '-o',
@@ -140,7 +274,15 @@ class BBMap():
             type=str,
             nargs=('+'),
             metavar=('<fastq_1>', '<fastq_2>'),
-            help='str: path to output files, max 2 (.gz compression supported) (required)'
+            help='str: path to output files, max 2 (.gz compression supported) (- writes stdout, interleaved if paired) (required)'
+        )
+        parser.add_argument(
+            '--other',
+            required=False,
+            type=str,
+            nargs=('+'),
+            metavar=('<fastq_1>', '<fastq_2>'),
+            help='str: path to output files of the other reads (mapped with --filter true, unmapped otherwise), written from the same alignment, max 2 (default: not written)'
         )
         parser.add_argument(
             '-t',
@@ -148,8 +290,8 @@ class BBMap():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
         )
         parser.add_argument(
             '-f',
@@ -175,6 +317,64 @@ class BBMap():
             metavar=('<str>'),
             help='str: used to pass along arguments to the aligner, use with caution, usage: -c="list arguments here"'
         )
+        parser.add_argument(
+            '--pin',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to pin the aligner and samtools to disjoint sets of CPUs (default: false)'
+        )
+        parser.add_argument(
+            '--shards',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=1,
+            help='int: number of shards the input is split into and aligned concurrently, 0 to choose from the number of threads (default: 1)'
+        )
+        parser.add_argument(
+            '--ordered',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to keep the input order of the reads when sharded (default: false)'
+        )
+        parser.add_argument(
+            '--workers',
+            required=False,
+            type=str,
+            nargs=('+'),
+            metavar=('<address>'),
+            help='str: addresses of "hocort worker" processes to run the shards on, <host>:<port> or unix:<path> (default: run locally)'
+        )
+        parser.add_argument(
+            '--resume',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to record the completed shards in <fastq_1>.journal, and only run the unfinished shards when the same command is run again (default: false)'
+        )
+        parser.add_argument(
+            '--native',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to let BBMap write the output FastQ files itself instead of converting its SAM output with samtools (default: false)'
+        )
+        parser.add_argument(
+            '--decision_only',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to only decide whether reads align instead of searching for their best alignment: BBMap keeps the first of equally good sites and reports no secondary ones (ambiguous=first secondary=f) (default: false)'
+        )
+        parser.add_argument(
+            '--speed',
+            required=False,
+            choices=SPEEDS,
+            default='balanced',
+            help='str: speed tier, trading sensitivity for speed with options of BBMap (default: balanced)'
+        )
         parsed = parser.parse_args(args=args)
 
         idx = parsed.index
@@ -182,20 +382,42 @@ class BBMap():
         out = parsed.output
         threads = parsed.threads if parsed.threads else 1
         mfilter = True if parsed.filter == 'true' else False
+        pin = True if parsed.pin == 'true' else False
+        shards = parsed.shards
+        ordered = True if parsed.ordered == 'true' else False
+        workers = parsed.workers
+        resume = True if parsed.resume == 'true' else False
+        decision_only = True if parsed.decision_only == 'true' else False
+        native = True if parsed.native == 'true' else False
         preset = parsed.preset
         config = parsed.config if parsed.config else ''
+        speed = parsed.speed
+
+        with standard_streams(seq, out) as (seq, out):
+            seq1 = seq[0]
+            seq2 = None if len(seq) < 2 else seq[1]
+            out1 = out[0]
+            out2 = None if len(out) < 2 else out[1]
+            other = parsed.other if parsed.other else []
+            other1 = None if len(other) < 1 else other[0]
+            other2 = None if len(other) < 2 else other[1]
 
-        seq1 = seq[0]
-        seq2 = None if len(seq) < 2 else seq[1]
-        out1 = out[0]
-        out2 = None if len(out) < 2 else out[1]
-
-        return self.run(idx,
-                        seq1,
-                        out1,
-                        out2=out2,
-                        seq2=seq2,
-                        mfilter=mfilter,
-                        preset=preset,
-                        threads=threads,
-                        options=config)
+            return self.run(idx,
+                            seq1,
+                            out1,
+                            out2=out2,
+                            seq2=seq2,
+                            other1=other1,
+                            other2=other2,
+                            mfilter=mfilter,
+                            preset=preset,
+                            threads=threads,
+                            options=config,
+                            speed=speed,
+                            pin=pin,
+                            shards=shards,
+                            ordered=ordered,
+                            workers=workers,
+                            resume=resume,
+                            native=native,
+                            decision_only=decision_only)
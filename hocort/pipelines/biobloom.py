@@ -1,11 +1,15 @@
-import time
-import os
+import asyncio
+import contextlib
 import logging
 
 from hocort.pipelines.utils import debug_log_args
+from hocort.pipelines.utils import execute_pipeline
+from hocort.pipelines.utils import execute_pipeline_async
+from hocort.pipelines.utils import resolve_index
+from hocort.pipelines.utils import standard_streams
 from hocort.aligners.biobloom import BioBloom as biobloom
 from hocort.parse.parser import ArgParser
-import hocort.execute as exe
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
@@ -15,9 +19,9 @@ class BioBloom():
     BioBloom pipeline which maps reads to a genome and matching/non-matching reads in the output FastQ file/-s.
 
     """
-    def run(self, idx, seq1, out, seq2=None, threads=1, options=''):
+    def commands(self, idx, seq1, out, seq2=None, threads=1, options=''):
         """
-        Run function which starts the pipeline.
+        Builds the commands which make up the pipeline.
 
         Parameters
         ----------
@@ -36,8 +40,8 @@ class BioBloom():
 
         Returns
         -------
-        returncode : int
-            Resulting returncode after the process is finished.
+        cmds : list
+            List of commands to be executed.
 
         Raises
         ------
@@ -46,33 +50,70 @@ class BioBloom():
 
         """
         debug_log_args(logger,
-                       self.run.__name__,
+                       self.commands.__name__,
                        locals())
 
         final_options = []
         if len(options) > 0:
             final_options = [options]
 
-        logger.info(f'Running pipeline: {self.__class__.__name__}')
-        start_time = time.time()
-
         cmd = biobloom().classify(idx,
                                   seq1,
                                   out=out,
                                   seq2=seq2,
                                   threads=threads,
                                   options=final_options)
-        if cmd == None: return 1
-        returncodes = exe.execute(cmd,
-                                  pipe=False)
+        return cmd
+
+    def run(self, *args, **kwargs):
+        """
+        Run function which starts the pipeline.
+
+        Parameters
+        ----------
+        *args, **kwargs
+            Passed on to commands(), see its documentation for the available arguments.
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        Raises
+        ------
+        ValueError
+            If commands() raises ValueError.
+
+        """
+        with contextlib.ExitStack() as stack:
+            cmds = self.commands(**resolve_index('biobloom', self.commands, args, kwargs, stack))
+            return execute_pipeline(logger, self.__class__.__name__, cmds, pipe=False)
+
+    async def run_async(self, *args, **kwargs):
+        """
+        Asynchronous counterpart of run(), which allows many pipelines to run concurrently in one event loop.
+        Cancelling the returned coroutine terminates the running subprocesses.
+
+        Parameters
+        ----------
+        *args, **kwargs
+            Passed on to commands(), see its documentation for the available arguments.
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
 
-        logger.debug(returncodes)
-        for returncode in returncodes:
-            if returncode != 0: return 1
+        Raises
+        ------
+        ValueError
+            If commands() raises ValueError.
 
-        end_time = time.time()
-        logger.info(f'Pipeline {self.__class__.__name__} run time: {end_time - start_time} seconds')
-        return 0
+        """
+        with contextlib.ExitStack() as stack:
+            arguments = await asyncio.get_event_loop().run_in_executor(None, resolve_index, 'biobloom', self.commands, args, kwargs, stack)
+            cmds = self.commands(**arguments)
+            return await execute_pipeline_async(logger, self.__class__.__name__, cmds, pipe=False)
 
     def interface(self, args):
         """
@@ -107,7 +148,7 @@ class BioBloom():
             type=str,
             nargs=('+'),
             metavar=('<fastq_1>', '<fastq_2>'),
-            help='str: path to sequence files, max 2 (.gz compression supported) (required)'
+            help='str: path to sequence files, max 2 (.gz compression supported) (- reads stdin, - - reads interleaved pairs from stdin) (required)'
         )
         parser.add_argument(
             '-o',
@@ -123,8 +164,8 @@ class BioBloom():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
         )
         parser.add_argument(
             '-c',
@@ -142,12 +183,15 @@ class BioBloom():
         threads = parsed.threads if parsed.threads else 1
         config = parsed.config if parsed.config else ''
 
-        seq1 = seq[0]
-        seq2 = None if len(seq) < 2 else seq[1]
-
-        return self.run(idx,
-                        seq1,
-                        out,
-                        seq2=seq2,
-                        threads=threads,
-                        options=config)
+        if out == '-':
+            parser.error('BioBloom writes one output file per category, it cannot write to stdout')
+        with standard_streams(seq, []) as (seq, _):
+            seq1 = seq[0]
+            seq2 = None if len(seq) < 2 else seq[1]
+
+            return self.run(idx,
+                            seq1,
+                            out,
+                            seq2=seq2,
+                            threads=threads,
+                            options=config)
@@ -0,0 +1,743 @@
+import asyncio
+import contextlib
+import os
+import shutil
+import time
+import tempfile
+import logging
+
+from hocort.pipelines.utils import debug_log_args
+from hocort.pipelines.utils import run_streaming
+from hocort.pipelines.utils import run_sharded
+from hocort.pipelines.utils import create_journal
+from hocort.pipelines.utils import SPEEDS
+from hocort.pipelines.utils import standard_streams
+from hocort.pipelines.bowtie2 import Bowtie2
+from hocort.pipelines.hisat2 import HISAT2
+from hocort.pipelines.bwa_mem2 import BWA_MEM2
+from hocort.pipelines.minimap2 import Minimap2
+from hocort.pipelines.bbmap import BBMap
+from hocort.pipelines.kraken2 import Kraken2
+from hocort.pipelines.biobloom import BioBloom
+from hocort.parse.parser import ArgParser
+from hocort.parse.fastq import FastQ
+import hocort.budget as budget
+import hocort.catalog as catalog
+import hocort.indexes as indexes
+import hocort.resources as resources
+
+logger = logging.getLogger(__file__)
+
+# Pipelines which may be used as aligner stages of a cascade, and the executable doing the work.
+ALIGNERS = {
+    'bowtie2': (Bowtie2, 'bowtie2'),
+    'hisat2': (HISAT2, 'hisat2'),
+    'bwamem2': (BWA_MEM2, 'bwa-mem2'),
+    'minimap2': (Minimap2, 'minimap2'),
+    'bbmap': (BBMap, 'bbmap.sh')
+}
+
+# Pipelines which may be used as classifier stages of a cascade, and the executable doing the work.
+CLASSIFIERS = {
+    'kraken2': (Kraken2, 'kraken2'),
+    'biobloom': (BioBloom, 'biobloomcategorizer')
+}
+
+# Stages whose output may be streamed into the next stage through FIFOs.
+# BioBloom writes one file per filter, which nothing would read, so its output goes to temporary files.
+STREAMABLE = ['bowtie2', 'hisat2', 'bwamem2', 'minimap2', 'bbmap', 'kraken2']
+
+
+class Stage():
+    """
+    One stage of a Cascade: an existing aligner or classifier pipeline together with its index and options.
+
+    """
+    def __init__(self, pipeline, idx, options='', **kwargs):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        pipeline : string
+            Name of the pipeline, a key of ALIGNERS or CLASSIFIERS.
+        idx : string
+            Path where the index is located.
+        options : string
+            An options string, for the tool, where arguments passed to the tool may be configured.
+        **kwargs
+            Additional keyword arguments of the pipeline, e.g. preset.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If the pipeline cannot be used as a cascade stage.
+
+        """
+        if pipeline not in ALIGNERS and pipeline not in CLASSIFIERS:
+            raise ValueError(f'Invalid cascade stage: {pipeline}, choose from {list(ALIGNERS) + list(CLASSIFIERS)}')
+        self.pipeline = pipeline
+        self.idx = idx
+        self.options = options
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f'Stage({self.pipeline!r}, {self.idx!r})'
+
+    def tool(self):
+        """
+        Returns the name of the executable doing the work of this stage.
+
+        Returns
+        -------
+        tool : string
+            Name of the executable, as used by budget.split().
+
+        """
+        return {**ALIGNERS, **CLASSIFIERS}[self.pipeline][1]
+
+    def outputs(self, prefix, paired, mfilter):
+        """
+        Returns the paths of the FastQ files which hold the reads passed on to the next stage.
+
+        Parameters
+        ----------
+        prefix : string
+            Path prefix of the output files of this stage.
+        paired : bool
+            Whether the reads are paired.
+        mfilter : bool
+            Whether to output mapped/unmapped sequences.
+
+        Returns
+        -------
+        outputs : list
+            One path for unpaired reads, two for paired reads.
+
+        """
+        if self.pipeline == 'biobloom':
+            category = 'noMatch' if mfilter else 'reference'
+            return [f'{prefix}_{category}_1.fq', f'{prefix}_{category}_2.fq'] if paired else [f'{prefix}_{category}.fq']
+        return [f'{prefix}_1.fastq', f'{prefix}_2.fastq'] if paired else [f'{prefix}_1.fastq']
+
+    def others(self, prefix, paired, mfilter):
+        """
+        Returns the paths of the FastQ files which hold the reads removed by this stage, see Cascade.run().
+
+        Parameters
+        ----------
+        prefix : string
+            Path prefix of the output files of this stage.
+        paired : bool
+            Whether the reads are paired.
+        mfilter : bool
+            Whether to output mapped/unmapped sequences.
+
+        Returns
+        -------
+        others : list
+            One path for unpaired reads, two for paired reads.
+
+        """
+        if self.pipeline == 'biobloom':
+            # BioBloom writes both categories anyway
+            return self.outputs(prefix, paired, not mfilter)
+        return [f'{prefix}_other_1.fastq', f'{prefix}_other_2.fastq'] if paired else [f'{prefix}_other_1.fastq']
+
+    def arguments(self, seq1, seq2, out1, out2, prefix, mfilter, threads, other=False):
+        """
+        Builds the arguments of the run function of the pipeline of this stage.
+
+        Parameters
+        ----------
+        seq1 : string
+            Path where the first input FastQ file is located.
+        seq2 : string
+            Path where the second input FastQ file is located.
+        out1 : string
+            Path where the first output FastQ file will be written. Only used by aligners.
+        out2 : string
+            Path where the second output FastQ file will be written. Only used by aligners.
+        prefix : string
+            Path prefix of the output files. Only used by classifiers.
+        mfilter : bool
+            Whether to output mapped/unmapped sequences.
+        threads : int
+            Number of threads to use.
+        other : bool
+            Whether to also write the reads removed by this stage, to the paths returned by others().
+
+        Returns
+        -------
+        args : list
+            Positional arguments.
+        kwargs : dict
+            Keyword arguments.
+
+        """
+        kwargs = dict(self.kwargs, seq2=seq2, threads=threads, options=self.options)
+        others = self.others(prefix, seq2 is not None, mfilter) if other else []
+        if self.pipeline == 'kraken2':
+            out = prefix + '#.fastq' if seq2 else prefix + '_1.fastq'
+            if other:
+                kwargs['other'] = prefix + '_other#.fastq' if seq2 else others[0]
+            return [self.idx, seq1, out], dict(kwargs, mfilter=mfilter)
+        if self.pipeline == 'biobloom':
+            return [self.idx, seq1, prefix], kwargs
+        if other:
+            kwargs.update(other1=others[0], other2=others[1] if seq2 else None)
+        return [self.idx, seq1, out1], dict(kwargs, out2=out2, mfilter=mfilter)
+
+    def run(self, *args, **kwargs):
+        """
+        Runs the pipeline of this stage, takes the same arguments as arguments().
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        """
+        args, kwargs = self.arguments(*args, **kwargs)
+        return {**ALIGNERS, **CLASSIFIERS}[self.pipeline][0]().run(*args, **kwargs)
+
+    async def run_async(self, *args, **kwargs):
+        """
+        Asynchronous counterpart of run().
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        """
+        args, kwargs = self.arguments(*args, **kwargs)
+        return await {**ALIGNERS, **CLASSIFIERS}[self.pipeline][0]().run_async(*args, **kwargs)
+
+class Cascade():
+    """
+    Cascade pipeline which runs a sequence of aligner and classifier stages, each stage processing the reads kept by the previous one.
+    It allows cheap classifiers to be put in front of expensive aligners. The last stage must be an aligner.
+
+    """
+    def __init__(self, dir=None):
+        """
+        Constructor which sets temporary file directory if specified.
+
+        Parameters
+        ----------
+        dir : string
+            Path where the temporary files are written.
+
+        Returns
+        -------
+        None
+
+        """
+        self.temp_dir = tempfile.TemporaryDirectory(dir=dir)
+        logger.debug(self.temp_dir.name)
+
+    def plan(self, stages, seq1, out1, seq2, out2, run_dir, mfilter, threads, stream, other=False):
+        """
+        Connects the stages and groups them into steps which are run one after the other.
+        Stages connected by FIFOs are put in the same step, as they have to run concurrently.
+
+        Parameters
+        ----------
+        stages : list
+            List of Stage objects.
+        seq1 : string
+            Path where the first input FastQ file is located.
+        out1 : string
+            Path where the first output FastQ file will be written.
+        seq2 : string
+            Path where the second input FastQ file is located.
+        out2 : string
+            Path where the second output FastQ file will be written.
+        run_dir : string
+            Directory where the temporary files and FIFOs of the stages are placed.
+        mfilter : bool
+            Whether to output mapped/unmapped sequences.
+        threads : int
+            Number of threads to use, split between the stages of a step.
+        stream : bool
+            Whether to stream between the stages where the tools allow it.
+        other : bool
+            Whether every stage also writes the reads it removes, see Stage.others().
+
+        Returns
+        -------
+        steps : list
+            List of (calls, links) tuples. calls is a list of (stage, arguments) tuples, where the arguments
+            are passed to Stage.run(). links is the list of (src, dst) FIFOs passed to run_streaming().
+
+        """
+        paired = seq2 is not None
+        steps = [([], [])]
+        inputs = [seq1, seq2]
+        for i, stage in enumerate(stages):
+            prefix = f'{run_dir}/stage{i}'
+            last = i == len(stages) - 1
+            outputs = [out1, out2] if last else stage.outputs(prefix, paired, mfilter)
+            streamed = stream and not last and stage.pipeline in STREAMABLE
+            calls, links = steps[-1]
+            calls.append((stage, [inputs[0], inputs[1], outputs[0], outputs[1] if len(outputs) > 1 else None, prefix, mfilter]))
+            next_inputs = outputs
+            if streamed:
+                next_inputs = [f'{prefix}_next_{n + 1}.fastq' for n in range(len(outputs))]
+                links += list(zip(outputs, next_inputs))
+            elif not last:
+                steps.append(([], []))
+            inputs = (next_inputs + [None])[:2]
+        for calls, links in steps:
+            counts = budget.split(threads, [stage.tool() for stage, args in calls]) if len(calls) > 1 else [threads]
+            for (stage, args), count in zip(calls, counts):
+                args += [count, True] if other else [count]
+        return steps
+
+    def collect_others(self, stages, run_dir, paired, mfilter, other1, other2):
+        """
+        Concatenates the reads removed by the stages into the other output files.
+
+        Parameters
+        ----------
+        stages : list
+            List of Stage objects.
+        run_dir : string
+            Directory of the files of the stages, as passed to plan().
+        paired : bool
+            Whether the reads are paired.
+        mfilter : bool
+            Whether to output mapped/unmapped sequences.
+        other1 : string
+            Path where the first other output FastQ file will be written.
+        other2 : string
+            Path where the second other output FastQ file will be written.
+
+        Returns
+        -------
+        None
+
+        """
+        others = [stage.others(f'{run_dir}/stage{i}', paired, mfilter) for i, stage in enumerate(stages)]
+        for mate, out in enumerate([other1, other2] if paired else [other1]):
+            FastQ.concatenate([paths[mate] for paths in others], out)
+
+    def validate(self, stages, seq2, out2, other1=None, other2=None):
+        """
+        Validates the arguments of run() and run_async().
+
+        Raises
+        ------
+        ValueError
+            If no stages are given, or the last stage is not an aligner.
+            If input FastQ_2 file is given without output FastQ_2.
+            If other output FastQ_1 is given without other output FastQ_2 for paired input, or the other way around.
+
+        """
+        if not stages:
+            raise ValueError(f'No cascade stages were given.')
+        if stages[-1].pipeline not in ALIGNERS:
+            raise ValueError(f'The last cascade stage must be an aligner, got: {stages[-1].pipeline}')
+        if seq2 is not None and not out2:
+            raise ValueError(f'Input FastQ_2 was given, but no output FastQ_2.')
+        if other1 and seq2 is not None and not other2:
+            raise ValueError(f'Input FastQ_2 was given, but no other output FastQ_2.')
+        if other2 and (seq2 is None or not other1):
+            raise ValueError(f'Other output FastQ_2 was given, but no input FastQ_2 or other output FastQ_1.')
+
+    def run(self, stages, seq1, out1, seq2=None, out2=None, mfilter=True, threads=1, stream=True, shards=1, ordered=False, resume=False, other1=None, other2=None):
+        """
+        Run function which starts the pipeline.
+
+        Parameters
+        ----------
+        stages : list
+            List of Stage objects, in the order they are run.
+        seq1 : string
+            Path where the first input FastQ file is located.
+        out1 : string
+            Path where the first output FastQ file will be written.
+        seq2 : string
+            Path where the second input FastQ file is located.
+        out2 : string
+            Path where the second output FastQ file will be written.
+        mfilter : bool
+            Whether to output mapped/unmapped sequences.
+            True: output unmapped sequences
+            False: output mapped sequences
+        threads : int
+            Number of threads to use.
+        stream : bool
+            Whether to stream the reads from each stage into the next through FIFOs where the tools allow it,
+            running those stages concurrently, instead of writing them to temporary files first.
+        shards : int
+            Number of shards the input reads are split into, which run through the stages concurrently with
+            an equal share of the threads. 0 chooses the number of shards from the number of threads.
+        ordered : bool
+            Whether the output keeps the input order of the reads when sharded,
+            as far as the tools themselves do. Requires an extra pass over the input.
+        resume : bool
+            Whether to record the completed stages of every shard in a journal next to the output (<out1>.journal),
+            which also holds the files passed between the stages, so that running the pipeline again
+            after an interruption only runs the unfinished stages and shards.
+        other1 : string
+            Path where the first output FastQ file of the other reads will be written: the reads removed by any
+            of the stages, so that together with the output they hold all the input reads.
+        other2 : string
+            Path where the second output FastQ file of the other reads will be written.
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        Raises
+        ------
+        ValueError
+            If no stages are given, or the last stage is not an aligner.
+            If input FastQ_2 file is given without output FastQ_2.
+            If other output FastQ_1 is given without other output FastQ_2 for paired input, or the other way around.
+            If disallowed characters are found in input.
+            If the journal directory holds no journal.
+
+        """
+        debug_log_args(logger,
+                       self.run.__name__,
+                       locals())
+        self.validate(stages, seq2, out2, other1, other2)
+        if shards != 1 or resume or stream and any(stage.pipeline in STREAMABLE for stage in stages[:-1]):
+            # subclasses override run_async() with their own arguments
+            return asyncio.run(Cascade.run_async(self, stages, seq1, out1, seq2=seq2, out2=out2, mfilter=mfilter, threads=threads, stream=stream, shards=shards, ordered=ordered, resume=resume, other1=other1, other2=other2))
+
+        logger.info(f'Running pipeline: {self.__class__.__name__}')
+        start_time = time.time()
+
+        with contextlib.ExitStack() as stack, tempfile.TemporaryDirectory(dir=self.temp_dir.name) as run_dir:
+            stages = self.resolve(stages, stack)
+            for calls, links in self.plan(stages, seq1, out1, seq2, out2, run_dir, mfilter, threads, False, other=bool(other1)):
+                stage, args = calls[0]
+                returncode = stage.run(*args)
+                if returncode != 0:
+                    logger.error('Pipeline was terminated')
+                    return 1
+            if other1:
+                self.collect_others(stages, run_dir, seq2 is not None, mfilter, other1, other2)
+
+        end_time = time.time()
+        logger.info(f'Pipeline {self.__class__.__name__} run time: {end_time - start_time} seconds')
+        return 0
+
+    async def run_async(self, stages, seq1, out1, seq2=None, out2=None, mfilter=True, threads=1, stream=True, shards=1, ordered=False, resume=False, other1=None, other2=None):
+        """
+        Asynchronous counterpart of run(), which allows many pipelines to run concurrently in one event loop.
+        Takes the same arguments as run(). Cancelling the returned coroutine terminates the running subprocesses.
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        Raises
+        ------
+        ValueError
+            If no stages are given, or the last stage is not an aligner.
+            If input FastQ_2 file is given without output FastQ_2.
+            If other output FastQ_1 is given without other output FastQ_2 for paired input, or the other way around.
+            If disallowed characters are found in input.
+            If the journal directory holds no journal.
+
+        """
+        debug_log_args(logger,
+                       self.run_async.__name__,
+                       locals())
+        self.validate(stages, seq2, out2, other1, other2)
+        journal = None
+        if resume:
+            shards = shards if shards > 0 else budget.shards(threads)
+            description = {'pipeline': self.__class__.__name__,
+                           'stages': [[stage.pipeline, stage.idx, stage.options, stage.kwargs] for stage in stages],
+                           'seq1': seq1, 'seq2': seq2, 'out1': out1, 'out2': out2, 'other1': other1, 'other2': other2,
+                           'mfilter': mfilter, 'stream': stream, 'shards': shards, 'ordered': ordered}
+            journal = create_journal(out1, description)
+
+        logger.info(f'Running pipeline: {self.__class__.__name__}')
+        start_time = time.time()
+
+        with contextlib.ExitStack() as stack:
+            # the journal keeps the indexes as given, the stages run on their staged or cached copies
+            stages = await asyncio.get_event_loop().run_in_executor(None, self.resolve, stages, stack)
+            if shards != 1:
+                shards = shards if shards > 0 else budget.shards(threads)
+                shard_threads = max(threads // shards, 1)
+                logger.info(f'Running {shards} shards with {shard_threads} threads each')
+                def run_shard(shard_seq1, shard_out1, shard_seq2, shard_out2, shard_other1=None, shard_other2=None):
+                    # the intermediate files of a shard are kept in the journal, next to its input
+                    name = os.path.splitext(os.path.basename(shard_seq1))[0]
+                    return self.run_steps(stages, shard_seq1, shard_out1, shard_seq2, shard_out2, mfilter, shard_threads, stream, journal=journal, name=name, other1=shard_other1, other2=shard_other2)
+                returncode = await run_sharded(logger,
+                                               run_shard,
+                                               seq1,
+                                               out1,
+                                               seq2=seq2,
+                                               out2=out2,
+                                               shards=shards,
+                                               ordered=ordered,
+                                               dir=self.temp_dir.name,
+                                               journal=journal,
+                                               other1=other1,
+                                               other2=other2)
+            elif journal:
+                journal.open(logger)
+                returncode = await self.run_steps(stages, seq1, out1, seq2, out2, mfilter, threads, stream, journal=journal, name='run', other1=other1, other2=other2)
+                if returncode == 0:
+                    journal.remove()
+            else:
+                returncode = await self.run_steps(stages, seq1, out1, seq2, out2, mfilter, threads, stream, other1=other1, other2=other2)
+        if returncode != 0:
+            logger.error('Pipeline was terminated')
+            return 1
+
+        end_time = time.time()
+        logger.info(f'Pipeline {self.__class__.__name__} run time: {end_time - start_time} seconds')
+        return 0
+
+    def resolve(self, stages, stack):
+        """
+        Resolves the index of every stage to its staged or cached copy once for the whole run, see hocort.indexes.resolve(),
+        so that the copies are not checked again for every stage and shard.
+
+        Parameters
+        ----------
+        stages : list
+            List of Stage objects.
+        stack : contextlib.ExitStack
+            Stack which holds the copies in use until it is closed, so that they are not evicted during the run.
+
+        Returns
+        -------
+        stages : list
+            Copies of the stages with the resolved indexes.
+
+        """
+        resolved = []
+        for stage in stages:
+            idx = indexes.resolve(catalog.lookup(stage.idx, stage.pipeline), stage.pipeline, stack=stack)
+            resolved.append(Stage(stage.pipeline, idx, stage.options, **stage.kwargs))
+        return resolved
+
+    async def run_steps(self, stages, seq1, out1, seq2, out2, mfilter, threads, stream, journal=None, name=None, other1=None, other2=None):
+        """
+        Runs the stages on one set of input files, see run() for the arguments.
+
+        Parameters
+        ----------
+        journal : Journal
+            Journal of a resumable run, see hocort.pipelines.utils.Journal. The intermediate files are kept in
+            a directory of the journal, and the steps which were completed by an earlier run are skipped.
+        name : string
+            Name of the directory of the intermediate files in the journal, unique for every set of input files.
+
+        Returns
+        -------
+        returncode : int
+            0 if all stages succeeded, 1 otherwise.
+
+        """
+        if not journal:
+            with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as run_dir:
+                returncode = await self.run_planned(self.plan(stages, seq1, out1, seq2, out2, run_dir, mfilter, threads, stream, other=bool(other1)))
+                if returncode == 0 and other1:
+                    self.collect_others(stages, run_dir, seq2 is not None, mfilter, other1, other2)
+                return returncode
+        run_dir = os.path.join(journal.dir, name)
+        os.makedirs(run_dir, exist_ok=True)
+        returncode = await self.run_planned(self.plan(stages, seq1, out1, seq2, out2, run_dir, mfilter, threads, stream, other=bool(other1)), journal=journal, name=name)
+        if returncode == 0:
+            if other1:
+                self.collect_others(stages, run_dir, seq2 is not None, mfilter, other1, other2)
+            shutil.rmtree(run_dir, ignore_errors=True)
+        return returncode
+
+    async def run_planned(self, steps, journal=None, name=None):
+        """
+        Runs the steps returned by plan() one after the other, see run_steps() for the arguments.
+
+        Returns
+        -------
+        returncode : int
+            0 if all stages succeeded, 1 otherwise.
+
+        """
+        for i, (calls, links) in enumerate(steps):
+            step = f'{name}/step{i}'
+            if journal and journal.is_done(step):
+                logger.info(f'Skipping completed stages: {", ".join(stage.pipeline for stage, args in calls)}')
+                continue
+            for src, dst in links:
+                # FIFOs left behind by an interrupted run
+                for path in [src, dst]:
+                    if os.path.exists(path):
+                        os.remove(path)
+            if links:
+                returncode = await run_streaming(logger, [stage.run_async(*args) for stage, args in calls], links)
+            else:
+                stage, args = calls[0]
+                returncode = await stage.run_async(*args)
+            if returncode != 0:
+                return 1
+            if journal:
+                journal.record(step)
+        return 0
+
+    def interface(self, args):
+        """
+        Main function for the user interface. Parses arguments and starts the pipeline.
+
+        Parameters
+        ----------
+        args : list
+            This list is parsed by ArgumentParser.
+
+        Returns
+        -------
+        None
+
+        """
+        parser = ArgParser(
+            description=f'{self.__class__.__name__} pipeline',
+            usage=f'hocort map {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] [--stream <bool>] [--shards <int>] [--ordered <bool>] [--resume <bool>] [--speed <str>] -s <pipeline>:<idx> [<pipeline>:<idx> ...] -i <fastq_1> [<fastq_2>] -o <fastq_1> [<fastq_2>] [--other <fastq_1> [<fastq_2>]]'
+        )
+        parser.add_argument(
+            '-s',
+            '--stages',
+            required=True,
+            type=str,
+            nargs=('+'),
+            metavar=('<pipeline>:<idx>'),
+            help=f'str: stages in the order they are run, the last one must be an aligner (choices: {", ".join(list(CLASSIFIERS) + list(ALIGNERS))}) (required)'
+        )
+        parser.add_argument(
+            '-i',
+            '--input',
+            required=True,
+            type=str,
+            nargs=('+'),
+            metavar=('<fastq_1>', '<fastq_2>'),
+            help='str: path to sequence files, max 2 (.gz compression supported) (- reads stdin, - - reads interleaved pairs from stdin) (required)'
+        )
+        parser.add_argument(
+            '-o',
+            '--output',
+            required=True,
+            type=str,
+            nargs=('+'),
+            metavar=('<fastq_1>', '<fastq_2>'),
+            help='str: path to output files, max 2 (.gz compression supported) (- writes stdout, interleaved if paired) (required)'
+        )
+        parser.add_argument(
+            '-t',
+            '--threads',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
+        )
+        parser.add_argument(
+            '-f',
+            '--filter',
+            required=False,
+            choices=['true', 'false'],
+            default='true',
+            help='str: set to false to output mapped sequences, true to output unmapped sequences (default: true)'
+        )
+        parser.add_argument(
+            '--stream',
+            required=False,
+            choices=['true', 'false'],
+            default='true',
+            help='str: set to false to write the reads passed between stages to temporary files instead of streaming them through FIFOs (default: true)'
+        )
+        parser.add_argument(
+            '--shards',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=1,
+            help='int: number of shards the input is split into and processed concurrently, 0 to choose from the number of threads (default: 1)'
+        )
+        parser.add_argument(
+            '--ordered',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to keep the input order of the reads when sharded (default: false)'
+        )
+        parser.add_argument(
+            '--resume',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to record the completed stages and shards in <fastq_1>.journal, and only run the unfinished ones when the same command is run again (default: false)'
+        )
+        parser.add_argument(
+            '--other',
+            required=False,
+            type=str,
+            nargs=('+'),
+            metavar=('<fastq_1>', '<fastq_2>'),
+            help='str: path to output files of the other reads (removed by any of the stages), written in the same run, max 2 (default: not written)'
+        )
+        parser.add_argument(
+            '--speed',
+            required=False,
+            choices=SPEEDS,
+            default='balanced',
+            help='str: speed tier of the stages, trading sensitivity for speed, BioBloom has none (default: balanced)'
+        )
+        parsed = parser.parse_args(args=args)
+
+        stages = []
+        for stage in parsed.stages:
+            pipeline, sep, idx = stage.partition(':')
+            if not sep:
+                parser.error(f'invalid stage: {stage}, expected <pipeline>:<idx>')
+            # BioBloom has no options trading sensitivity for speed
+            kwargs = {} if pipeline == 'biobloom' else {'speed': parsed.speed}
+            stages.append(Stage(pipeline, idx, **kwargs))
+        seq = parsed.input
+        out = parsed.output
+        threads = parsed.threads if parsed.threads else 1
+        mfilter = True if parsed.filter == 'true' else False
+        stream = True if parsed.stream == 'true' else False
+        shards = parsed.shards
+        ordered = True if parsed.ordered == 'true' else False
+        resume = True if parsed.resume == 'true' else False
+
+        with standard_streams(seq, out) as (seq, out):
+            seq1 = seq[0]
+            seq2 = None if len(seq) < 2 else seq[1]
+            out1 = out[0]
+            out2 = None if len(out) < 2 else out[1]
+            other = parsed.other if parsed.other else []
+            other1 = None if len(other) < 1 else other[0]
+            other2 = None if len(other) < 2 else other[1]
+
+            return self.run(stages,
+                            seq1,
+                            out1,
+                            seq2=seq2,
+                            out2=out2,
+                            threads=threads,
+                            mfilter=mfilter,
+                            stream=stream,
+                            shards=shards,
+                            ordered=ordered,
+                            resume=resume,
+                            other1=other1,
+                            other2=other2)
@@ -1,24 +1,40 @@
-import time
-import os
+import asyncio
+import contextlib
 import logging
+import os
 
 from hocort.pipelines.utils import debug_log_args
+from hocort.pipelines.utils import speed_options
+from hocort.pipelines.utils import SPEEDS
+from hocort.pipelines.utils import execute_pipeline
+from hocort.pipelines.utils import execute_pipeline_async
+from hocort.pipelines.utils import resolve_index
+from hocort.pipelines.utils import standard_streams
 from hocort.aligners.kraken2 import Kraken2 as kr2
 from hocort.parse.sam import SAM
 from hocort.parse.parser import ArgParser
+from hocort.parse.parser import validate_args
 import hocort.execute as exe
+import hocort.resources as resources
+import hocort.results as results
 
 logger = logging.getLogger(__file__)
 
+# Options of Kraken2 for the speed tiers, see hocort.pipelines.utils.speed_options().
+SPEED_OPTIONS = {
+    'fast': ['--quick'],
+    'sensitive': ['--minimum-hit-groups', '1']
+}
+
 
 class Kraken2():
     """
     Kraken2 pipeline which maps reads to a genome and includes/excludes matching reads from the output FastQ file/-s.
 
     """
-    def run(self, idx, seq1, out, seq2=None, mfilter=True, threads=1, options=''):
+    def commands(self, idx, seq1, out, seq2=None, mfilter=True, threads=1, kraken_output=None, report=None, options='', mmap=False, other=None, speed='balanced'):
         """
-        Run function which starts the pipeline.
+        Builds the commands which make up the pipeline.
 
         Parameters
         ----------
@@ -36,34 +52,60 @@ class Kraken2():
             False: output mapped sequences
         threads : int
             Number of threads to use.
+        kraken_output : string
+            Path where the per-read classification output of Kraken2 is written.
+            Compressed with gzip if the path ends with '.gz'.
+            If None, the per-read output is discarded.
+        report : string
+            Path where the Kraken2 report (per-taxon summary of the classifications) is written.
         options : string
             An options string where additional arguments may be specified.
+        mmap : bool
+            Whether to memory-map the database instead of loading it, so concurrent runs share it.
+        other : string
+            Path where the output FastQ files of the other reads will be written (with # if paired input),
+            i.e. those which the opposite mfilter would output. Kraken2 writes both in the same run.
+        speed : string
+            Speed tier, one of hocort.pipelines.utils.SPEEDS, which trades sensitivity for speed
+            with the options in SPEED_OPTIONS. 'balanced' keeps the defaults of Kraken2.
 
         Returns
         -------
-        returncode : int
-            Resulting returncode after the process is finished.
+        cmds : list
+            List of commands to be executed.
 
         Raises
         ------
         ValueError
             If disallowed characters are found in input.
+            If the speed tier is invalid.
 
         """
         debug_log_args(logger,
-                       self.run.__name__,
+                       self.commands.__name__,
                        locals())
 
+        valid, arg, chars = validate_args([kraken_output])
+        if not valid:
+            raise ValueError(f'Input with disallowed characters detected: "{arg}" - {chars}')
+
         final_options = []
         if len(options) > 0:
             final_options = [options]
-        final_options += ['--output', '-']
-
-        logger.info(f'Running pipeline: {self.__class__.__name__}')
-        start_time = time.time()
+        final_options = speed_options(SPEED_OPTIONS, speed) + final_options
+        # the per-read output must never reach stdout, where it would be logged line by line
+        compress_cmd = []
+        if not kraken_output:
+            # kraken2 suppresses the per-read output if the filename is '-'
+            final_options += ['--output', '-']
+        elif kraken_output.endswith('.gz'):
+            # kraken2 writes the per-read output to stdout, which is piped to gzip
+            compress_cmd = [exe.Command(['gzip', '-c'], stdout=kraken_output)]
+        else:
+            final_options += ['--output', kraken_output]
 
-        class_out = None
-        unclass_out = None
+        class_out = other
+        unclass_out = other
         if mfilter:
             unclass_out = out
         else:
@@ -75,18 +117,63 @@ class Kraken2():
                                  unclassified_out=unclass_out,
                                  seq2=seq2,
                                  threads=threads,
-                                 options=final_options)
-        if kr2_cmd == None: return 1
-        returncodes = exe.execute(kr2_cmd,
-                                  pipe=False)
+                                 report=report,
+                                 options=final_options,
+                                 mmap=mmap)
+        return kr2_cmd + compress_cmd
+
+    def run(self, *args, **kwargs):
+        """
+        Run function which starts the pipeline.
+
+        Parameters
+        ----------
+        *args, **kwargs
+            Passed on to commands(), see its documentation for the available arguments.
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        Raises
+        ------
+        ValueError
+            If commands() raises ValueError.
+
+        """
+        with contextlib.ExitStack() as stack:
+            cmds = self.commands(**resolve_index('kraken2', self.commands, args, kwargs, stack))
+            cache = results.entry('kraken2', self.commands, args, kwargs)
+            return execute_pipeline(logger, self.__class__.__name__, cmds, pipe=True, cache=cache)
+
+    async def run_async(self, *args, **kwargs):
+        """
+        Asynchronous counterpart of run(), which allows many pipelines to run concurrently in one event loop.
+        Cancelling the returned coroutine terminates the running subprocesses.
+
+        Parameters
+        ----------
+        *args, **kwargs
+            Passed on to commands(), see its documentation for the available arguments.
 
-        logger.debug(returncodes)
-        for returncode in returncodes:
-            if returncode != 0: return 1
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
 
-        end_time = time.time()
-        logger.info(f'Pipeline {self.__class__.__name__} run time: {end_time - start_time} seconds')
-        return 0
+        Raises
+        ------
+        ValueError
+            If commands() raises ValueError.
+
+        """
+        loop = asyncio.get_event_loop()
+        with contextlib.ExitStack() as stack:
+            arguments = await loop.run_in_executor(None, resolve_index, 'kraken2', self.commands, args, kwargs, stack)
+            cmds = self.commands(**arguments)
+            cache = await loop.run_in_executor(None, results.entry, 'kraken2', self.commands, args, kwargs)
+            return await execute_pipeline_async(logger, self.__class__.__name__, cmds, pipe=True, cache=cache)
 
     def interface(self, args):
         """
@@ -104,7 +191,7 @@ class Kraken2():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} pipeline',
-            usage=f'hocort map {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] [-c=<str>] -x <idx> -i <fastq_1> [<fastq_2>] -o <out#.fastq>'
+            usage=f'hocort map {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] [--kraken_output <path>] [--report <path>] [--mmap <bool>] [--speed <str>] [-c=<str>] -x <idx> -i <fastq_1> [<fastq_2>] -o <out#.fastq> [--other <out#.fastq>]'
         )
         parser.add_argument(
             '-x',
@@ -121,7 +208,7 @@ class Kraken2():
             type=str,
             nargs=('+'),
             metavar=('<fastq_1>', '<fastq_2>'),
-            help='str: path to sequence files, max 2 (.gz compression supported) (required)'
+            help='str: path to sequence files, max 2 (.gz compression supported) (- reads stdin, - - reads interleaved pairs from stdin) (required)'
         )
         parser.add_argument(
             '-o',
@@ -129,7 +216,14 @@ class Kraken2():
             required=True,
             type=str,
             metavar=('<out#.fastq>'),
-            help='str: output path kraken2 format (with # if paired input) (.gz compression NOT supported) (required)'
+            help='str: output path kraken2 format (with # if paired input) (.gz compression NOT supported) (- writes stdout, interleaved if paired) (required)'
+        )
+        parser.add_argument(
+            '--other',
+            required=False,
+            type=str,
+            metavar=('<out#.fastq>'),
+            help='str: output path of the other reads (classified with --filter true, unclassified otherwise), kraken2 format, written in the same run (default: not written)'
         )
         parser.add_argument(
             '-t',
@@ -137,8 +231,8 @@ class Kraken2():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
         )
         parser.add_argument(
             '-f',
@@ -148,6 +242,21 @@ class Kraken2():
             default='true',
             help='str: set to false to output mapped sequences, true to output unmapped sequences (default: true)'
         )
+        parser.add_argument(
+            '--kraken_output',
+            required=False,
+            type=str,
+            metavar=('<path>'),
+            help='str: path to write the per-read classification output to (.gz compression supported) (default: discarded)'
+        )
+        parser.add_argument(
+            '-r',
+            '--report',
+            required=False,
+            type=str,
+            metavar=('<path>'),
+            help='str: path to write the per-taxon classification summary to (default: not written)'
+        )
         parser.add_argument(
             '-c',
             '--config',
@@ -156,6 +265,20 @@ class Kraken2():
             metavar=('<str>'),
             help='str: used to pass along arguments to the aligner, use with caution, usage: -c="list arguments here"'
         )
+        parser.add_argument(
+            '--mmap',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to memory-map the database, so concurrent runs share it (default: false)'
+        )
+        parser.add_argument(
+            '--speed',
+            required=False,
+            choices=SPEEDS,
+            default='balanced',
+            help='str: speed tier, trading sensitivity for speed with options of Kraken2 (default: balanced)'
+        )
         parsed = parser.parse_args(args=args)
 
         idx = parsed.index
@@ -163,15 +286,28 @@ class Kraken2():
         out = parsed.output
         threads = parsed.threads if parsed.threads else 1
         mfilter = True if parsed.filter == 'true' else False
+        kraken_output = parsed.kraken_output
+        report = parsed.report
+        other = parsed.other
+        mmap = True if parsed.mmap == 'true' else False
         config = parsed.config if parsed.config else ''
+        speed = parsed.speed
 
-        seq1 = seq[0]
-        seq2 = None if len(seq) < 2 else seq[1]
+        with standard_streams(seq, [out]) as (seq, out):
+            # Kraken2 writes paired output to one path, replacing # with _1 and _2, which gives the names of the FIFOs
+            out = out[0] if len(out) < 2 else os.path.join(os.path.dirname(out[0]), 'stdout#.fastq')
+            seq1 = seq[0]
+            seq2 = None if len(seq) < 2 else seq[1]
 
-        return self.run(idx,
-                        seq1,
-                        out,
-                        seq2=seq2,
-                        mfilter=mfilter,
-                        threads=threads,
-                        options=config)
+            return self.run(idx,
+                            seq1,
+                            out,
+                            seq2=seq2,
+                            other=other,
+                            mfilter=mfilter,
+                            threads=threads,
+                            kraken_output=kraken_output,
+                            report=report,
+                            options=config,
+                            speed=speed,
+                            mmap=mmap)
@@ -1,39 +1,34 @@
-import time
-import os
-import tempfile
 import logging
 
-from hocort.pipelines.utils import debug_log_args
-from hocort.pipelines.hisat2 import HISAT2
-from hocort.pipelines.kraken2 import Kraken2
+from hocort.pipelines.cascade import Cascade
+from hocort.pipelines.cascade import Stage
+from hocort.pipelines.utils import SPEEDS
+from hocort.pipelines.utils import standard_streams
 from hocort.parse.parser import ArgParser
+import hocort.resources as resources
 
 logger = logging.getLogger(__file__)
 
 
-class Kraken2HISAT2():
+class Kraken2HISAT2(Cascade):
     """
     Kraken2HISAT2 pipeline which first runs Kraken2, then runs HISAT2. It maps reads to a genome and includes/excludes matching reads from the output FastQ file/-s.
 
     """
-    def __init__(self, dir=None):
+    def stages(self, hs2_idx, kr2_idx, hs2_options='', kr2_options='', speed='balanced'):
         """
-        Constructor which sets temporary file directory if specified.
-
-        Parameters
-        ----------
-        dir : string
-            Path where the temporary files are written.
+        Builds the stages of the cascade.
 
         Returns
         -------
-        None
+        stages : list
+            The Kraken2 and HISAT2 stages.
 
         """
-        self.temp_dir = tempfile.TemporaryDirectory(dir=dir)
-        logger.debug(self.temp_dir.name)
+        return [Stage('kraken2', kr2_idx, options=kr2_options, speed=speed),
+                Stage('hisat2', hs2_idx, options=hs2_options, speed=speed)]
 
-    def run(self, hs2_idx, kr2_idx, seq1, out1, seq2=None, out2=None, mfilter=True, threads=1, hs2_options='', kr2_options=''):
+    def run(self, hs2_idx, kr2_idx, seq1, out1, seq2=None, out2=None, mfilter=True, threads=1, hs2_options='', kr2_options='', stream=False, shards=1, ordered=False, resume=False, other1=None, other2=None, speed='balanced'):
         """
         Run function which starts the pipeline.
 
@@ -61,6 +56,25 @@ class Kraken2HISAT2():
             An options string, for HISAT2, where arguments passed to the tool may be configured.
         kr2_options : string
             An options string, for Kraken2, where arguments passed to the tool may be configured.
+        stream : bool
+            Whether to stream the reads from Kraken2 into HISAT2 through FIFOs, running both tools concurrently
+            and splitting the threads between them, instead of writing the Kraken2 output to temporary files first.
+        shards : int
+            Number of shards the input reads are split into, which run through the pipeline concurrently with
+            an equal share of the threads. 0 chooses the number of shards from the number of threads.
+        ordered : bool
+            Whether the output keeps the input order of the reads when sharded,
+            as far as the tools themselves do. Requires an extra pass over the input.
+        resume : bool
+            Whether to record the completed stages and shards in a journal next to the output (<out1>.journal),
+            so that running the pipeline again after an interruption only runs the unfinished ones.
+        other1 : string
+            Path where the first output FastQ file of the other reads will be written: the reads removed by
+            either tool, so that together with the output they hold all the input reads.
+        other2 : string
+            Path where the second output FastQ file of the other reads will be written.
+        speed : string
+            Speed tier of both tools, one of hocort.pipelines.utils.SPEEDS, see their pipelines.
 
         Returns
         -------
@@ -71,48 +85,57 @@ class Kraken2HISAT2():
         ------
         ValueError
             If input FastQ_2 file is given without output FastQ_2.
+            If other output FastQ_1 is given without other output FastQ_2 for paired input, or the other way around.
             If disallowed characters are found in input.
+            If the speed tier is invalid.
+
+        """
+        return super().run(self.stages(hs2_idx, kr2_idx, hs2_options=hs2_options, kr2_options=kr2_options, speed=speed),
+                           seq1,
+                           out1,
+                           seq2=seq2,
+                           out2=out2,
+                           mfilter=mfilter,
+                           threads=threads,
+                           stream=stream,
+                           shards=shards,
+                           ordered=ordered,
+                           resume=resume,
+                           other1=other1,
+                           other2=other2)
 
+    async def run_async(self, hs2_idx, kr2_idx, seq1, out1, seq2=None, out2=None, mfilter=True, threads=1, hs2_options='', kr2_options='', stream=False, shards=1, ordered=False, resume=False, other1=None, other2=None, speed='balanced'):
         """
-        debug_log_args(logger,
-                       self.run.__name__,
-                       locals())
-        if seq2 and not out2:
-            raise ValueError(f'Input FastQ_2 was given, but no output FastQ_2.')
-
-        logger.info(f'Running pipeline: {self.__class__.__name__}')
-        start_time = time.time()
-
-        kr2_out = self.temp_dir.name + '/out#.fastq' if seq2 and out2 else self.temp_dir.name + '/out_1.fastq'
-        returncode = Kraken2().run(kr2_idx,
-                                   seq1,
-                                   kr2_out,
-                                   seq2=seq2,
-                                   mfilter=mfilter,
-                                   threads=threads,
-                                   options=kr2_options)
-        if returncode != 0:
-            logger.error('Pipeline was terminated')
-            return 1
-
-        temp1 = f'{self.temp_dir.name}/out_1.fastq'
-        temp2 = None if seq2 == None else f'{self.temp_dir.name}/out_2.fastq'
-
-        returncode = HISAT2().run(hs2_idx,
-                                  temp1,
-                                  out1,
-                                  seq2=temp2,
-                                  out2=out2,
-                                  threads=threads,
-                                  mfilter=mfilter,
-                                  options=hs2_options)
-        if returncode != 0:
-            logger.error('Pipeline was terminated')
-            return 1
-
-        end_time = time.time()
-        logger.info(f'Pipeline {self.__class__.__name__} run time: {end_time - start_time} seconds')
-        return 0
+        Asynchronous counterpart of run(), which allows many pipelines to run concurrently in one event loop.
+        Takes the same arguments as run(). Cancelling the returned coroutine terminates the running subprocesses.
+
+        Returns
+        -------
+        returncode : int
+            Resulting returncode after the process is finished.
+
+        Raises
+        ------
+        ValueError
+            If input FastQ_2 file is given without output FastQ_2.
+            If other output FastQ_1 is given without other output FastQ_2 for paired input, or the other way around.
+            If disallowed characters are found in input.
+            If the speed tier is invalid.
+
+        """
+        return await super().run_async(self.stages(hs2_idx, kr2_idx, hs2_options=hs2_options, kr2_options=kr2_options, speed=speed),
+                                       seq1,
+                                       out1,
+                                       seq2=seq2,
+                                       out2=out2,
+                                       mfilter=mfilter,
+                                       threads=threads,
+                                       stream=stream,
+                                       shards=shards,
+                                       ordered=ordered,
+                                       resume=resume,
+                                       other1=other1,
+                                       other2=other2)
 
     def interface(self, args):
         """
@@ -130,7 +153,7 @@ class Kraken2HISAT2():
         """
         parser = ArgParser(
             description=f'{self.__class__.__name__} pipeline',
-            usage=f'hocort {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] --hisat2_index <idx> --kraken2_index <idx> -i <fastq_1> [<fastq_2>] -o <fastq_1> [<fastq_2>]'
+            usage=f'hocort {self.__class__.__name__} [-h] [--threads <int>] [--filter <bool>] [--stream <bool>] [--shards <int>] [--ordered <bool>] [--resume <bool>] [--speed <str>] --hisat2_index <idx> --kraken2_index <idx> -i <fastq_1> [<fastq_2>] -o <fastq_1> [<fastq_2>] [--other <fastq_1> [<fastq_2>]]'
         )
         parser.add_argument(
             '-s',
@@ -155,7 +178,7 @@ class Kraken2HISAT2():
             type=str,
             nargs=('+'),
             metavar=('<fastq_1>', '<fastq_2>'),
-            help='str: path to sequence files, max 2 (.gz compression supported) (required)'
+            help='str: path to sequence files, max 2 (.gz compression supported) (- reads stdin, - - reads interleaved pairs from stdin) (required)'
         )
         parser.add_argument(
             '-o',
@@ -164,7 +187,7 @@ class Kraken2HISAT2():
             type=str,
             nargs=('+'),
             metavar=('<fastq_1>', '<fastq_2>'),
-            help='str: path to output files, max 2 (.gz compression supported) (required)'
+            help='str: path to output files, max 2 (.gz compression supported) (- writes stdout, interleaved if paired) (required)'
         )
         parser.add_argument(
             '-t',
@@ -172,8 +195,8 @@ class Kraken2HISAT2():
             required=False,
             type=int,
             metavar=('<int>'),
-            default=os.cpu_count(),
-            help='int: number of threads (default: max available on machine)'
+            default=resources.available_cpus(),
+            help='int: number of threads (default: max available to the process, respecting CPU affinity and cgroup quotas)'
         )
         parser.add_argument(
             '-f',
@@ -183,6 +206,50 @@ class Kraken2HISAT2():
             default='true',
             help='str: set to false to output mapped sequences, true to output unmapped sequences (default: true)'
         )
+        parser.add_argument(
+            '--stream',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to stream reads from Kraken2 into the aligner through FIFOs instead of temporary files (default: false)'
+        )
+        parser.add_argument(
+            '--shards',
+            required=False,
+            type=int,
+            metavar=('<int>'),
+            default=1,
+            help='int: number of shards the input is split into and processed concurrently, 0 to choose from the number of threads (default: 1)'
+        )
+        parser.add_argument(
+            '--ordered',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to keep the input order of the reads when sharded (default: false)'
+        )
+        parser.add_argument(
+            '--resume',
+            required=False,
+            choices=['true', 'false'],
+            default='false',
+            help='str: set to true to record the completed stages and shards in <fastq_1>.journal, and only run the unfinished ones when the same command is run again (default: false)'
+        )
+        parser.add_argument(
+            '--other',
+            required=False,
+            type=str,
+            nargs=('+'),
+            metavar=('<fastq_1>', '<fastq_2>'),
+            help='str: path to output files of the other reads (removed by either tool), written in the same run, max 2 (default: not written)'
+        )
+        parser.add_argument(
+            '--speed',
+            required=False,
+            choices=SPEEDS,
+            default='balanced',
+            help='str: speed tier of both tools, trading sensitivity for speed (default: balanced)'
+        )
         parsed = parser.parse_args(args=args)
 
         hs2_idx = parsed.hisat2_index
@@ -191,17 +258,33 @@ class Kraken2HISAT2():
         out = parsed.output
         threads = parsed.threads if parsed.threads else 1
         mfilter = True if parsed.filter == 'true' else False
+        stream = True if parsed.stream == 'true' else False
+        shards = parsed.shards
+        ordered = True if parsed.ordered == 'true' else False
+        resume = True if parsed.resume == 'true' else False
+        speed = parsed.speed
+
+        with standard_streams(seq, out) as (seq, out):
+            seq1 = seq[0]
+            seq2 = None if len(seq) < 2 else seq[1]
+            out1 = out[0]
+            out2 = None if len(out) < 2 else out[1]
+            other = parsed.other if parsed.other else []
+            other1 = None if len(other) < 1 else other[0]
+            other2 = None if len(other) < 2 else other[1]
 
-        seq1 = seq[0]
-        seq2 = None if len(seq) < 2 else seq[1]
-        out1 = out[0]
-        out2 = None if len(out) < 2 else out[1]
-
-        return self.run(hs2_idx,
-                        kr2_idx,
-                        seq1,
-                        out1,
-                        seq2=seq2,
-                        out2=out2,
-                        threads=threads,
-                        mfilter=mfilter)
+            return self.run(hs2_idx,
+                            kr2_idx,
+                            seq1,
+                            out1,
+                            seq2=seq2,
+                            out2=out2,
+                            threads=threads,
+                            mfilter=mfilter,
+                            stream=stream,
+                            shards=shards,
+                            ordered=ordered,
+                            resume=resume,
+                            other1=other1,
+                            other2=other2,
+                            speed=speed)
@@ -1,3 +1,50 @@
+import asyncio
+import contextlib
+import gzip
+import inspect
+import itertools
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import hocort.execute as exe
+import hocort.budget as budget
+import hocort.catalog as catalog
+import hocort.distributed as distributed
+import hocort.indexes as indexes
+import hocort.results as results
+from hocort.parse.fastq import FastQ
+
+# Size (in bytes) of the chunks copied from one FIFO to another by relay().
+RELAY_CHUNK_SIZE = 1048576
+
+# Number of bytes relay() buffers in memory before it stops reading, so a fast upstream tool
+# is slowed down to the pace of the downstream tool instead of filling the memory.
+# Bounded in bytes rather than chunks, as a read of a FIFO returns as little as the upstream tool wrote at once.
+RELAY_BUFFER_SIZE = 16777216
+
+# Number of reads copied at a time between stdin or stdout and the FIFOs of a pipeline, see standard_streams().
+STREAM_BLOCK_READS = 16384
+
+# Number of blocks of reads buffered in memory per mate between stdin or stdout and the FIFOs of a pipeline,
+# beyond which reading stdin or the output FIFOs waits until the blocks are written, see feed() and collect().
+STREAM_QUEUE_BLOCKS = 4
+
+# Suffix of the journal directory of a resumable run, which is placed next to its first output file.
+JOURNAL_SUFFIX = '.journal'
+
+# Name of the file recording the progress of a resumable run, in its journal directory.
+JOURNAL_FILE = 'journal.json'
+
+# Speed tiers of the pipelines, see speed_options(). 'balanced' keeps the defaults of the tools.
+SPEEDS = ['fast', 'balanced', 'sensitive']
+
+
 def debug_log_args(logger, function_name, locals_vars):
     """
     Logs the arguments of a function.
@@ -21,3 +68,932 @@ def debug_log_args(logger, function_name, locals_vars):
         if var != 'self':
             string += f'\n{var}: {locals_vars[var]}'
     logger.debug(string + '\n')
+
+def speed_options(options, speed):
+    """
+    Returns the options of a tool for a speed tier.
+
+    Parameters
+    ----------
+    options : dict
+        Options of the tool for the speed tiers which differ from its defaults, keyed by tier.
+    speed : string
+        Speed tier, one of SPEEDS.
+
+    Returns
+    -------
+    options : list
+        Options of the tool, empty if the tier keeps its defaults.
+
+    Raises
+    ------
+    ValueError
+        If the speed tier is not one of SPEEDS.
+
+    """
+    if speed not in SPEEDS:
+        raise ValueError(f'Invalid speed: {speed}, choose from {SPEEDS}')
+    return list(options.get(speed, []))
+
+def check_returncodes(logger, name, returncodes, start_time):
+    """
+    Checks the returncodes of a finished pipeline, and logs its run time
+    together with the resource usage of every stage.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the pipeline.
+    name : string
+        Pipeline name.
+    returncodes : hocort.execute.ExecutionResult
+        List of returncodes from the executed subprocesses.
+    start_time : float
+        Time (as returned by time.time()) when the pipeline was started.
+
+    Returns
+    -------
+    returncode : int
+        0 if all subprocesses succeeded, 1 otherwise.
+
+    """
+    logger.debug(returncodes)
+    for stage in returncodes.stages:
+        logger.info(f'Stage {stage}')
+    if returncodes.failed:
+        logger.error(f'Pipeline {name} failed, stage {returncodes.failed.name} exited with returncode {returncodes.failed.returncode}')
+        return 1
+    for returncode in returncodes:
+        if returncode != 0: return 1
+
+    end_time = time.time()
+    logger.info(f'Pipeline {name} run time: {end_time - start_time} seconds')
+    return 0
+
+def resolve_index(tool, commands, args, kwargs, stack):
+    """
+    Resolves the index of a single-stage pipeline to its staged or cached copy, see hocort.indexes.resolve().
+    Called once per run, before the commands are built, so that the copy is checked only once for all shards.
+
+    Parameters
+    ----------
+    tool : string
+        Name of the tool, a key of hocort.indexes.INDEX_FILES.
+    commands : function
+        The commands() function of the pipeline.
+    args : list
+        Positional arguments of commands().
+    kwargs : dict
+        Keyword arguments of commands().
+    stack : contextlib.ExitStack
+        Stack which holds the copy in use until it is closed, so that it is not evicted during the run.
+
+    Returns
+    -------
+    arguments : dict
+        Arguments of commands() by name, with the resolved index.
+
+    """
+    arguments = dict(inspect.signature(commands).bind(*args, **kwargs).arguments)
+    if arguments.get('idx'):
+        arguments['idx'] = indexes.resolve(catalog.lookup(arguments['idx'], tool), tool, stack=stack)
+    return arguments
+
+def execute_pipeline(logger, name, cmds, pipe=True, cache=None):
+    """
+    Executes the commands of a pipeline, unless its result is cached.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the pipeline.
+    name : string
+        Pipeline name.
+    cmds : list
+        List of commands to be executed.
+    pipe : bool
+        Whether to pipe output from cmd1 to cmd2 etc.
+    cache : dict
+        Entry of the result cache, see hocort.results.entry(). If the result is cached, its outputs are reused,
+        otherwise they are cached after a successful run. None to always run the commands.
+
+    Returns
+    -------
+    returncode : int
+        0 if all subprocesses succeeded, 1 otherwise.
+
+    """
+    if results.restore(cache):
+        return 0
+    logger.info(f'Running pipeline: {name}')
+    start_time = time.time()
+
+    returncodes = exe.execute(cmds, pipe=pipe)
+
+    returncode = check_returncodes(logger, name, returncodes, start_time)
+    if returncode == 0:
+        results.store(cache)
+    return returncode
+
+async def execute_pipeline_async(logger, name, cmds, pipe=True, cache=None):
+    """
+    Executes the commands of a pipeline asynchronously, unless its result is cached.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the pipeline.
+    name : string
+        Pipeline name.
+    cmds : list
+        List of commands to be executed.
+    pipe : bool
+        Whether to pipe output from cmd1 to cmd2 etc.
+    cache : dict
+        Entry of the result cache, see hocort.results.entry(). If the result is cached, its outputs are reused,
+        otherwise they are cached after a successful run. None to always run the commands.
+
+    Returns
+    -------
+    returncode : int
+        0 if all subprocesses succeeded, 1 otherwise.
+
+    """
+    loop = asyncio.get_event_loop()
+    if await loop.run_in_executor(None, results.restore, cache):
+        return 0
+    logger.info(f'Running pipeline: {name}')
+    start_time = time.time()
+
+    returncodes = await exe.execute_async(cmds, pipe=pipe)
+
+    returncode = check_returncodes(logger, name, returncodes, start_time)
+    if returncode == 0:
+        await loop.run_in_executor(None, results.store, cache)
+    return returncode
+
+def relay(src, dst):
+    """
+    Starts daemon threads which copy everything from the FIFO src to the FIFO dst.
+    Up to RELAY_BUFFER_SIZE bytes are buffered in memory, beyond which writing to src blocks until dst is read.
+    The buffer prevents deadlocks when a tool writes batches of mate 1 before mate 2 (as long as a batch
+    fits into it), while the next tool reads both mates in lockstep.
+
+    Parameters
+    ----------
+    src : string
+        Path of the FIFO to read from.
+    dst : string
+        Path of the FIFO to write to.
+
+    Returns
+    -------
+    threads : list
+        The started reader and writer threads.
+
+    """
+    chunks = queue.Queue()
+    # number of bytes in chunks, guarded by the condition
+    buffered = [0]
+    space = threading.Condition()
+    def read():
+        try:
+            with open(src, 'rb', buffering=0) as f:
+                for chunk in iter(lambda: f.read(RELAY_CHUNK_SIZE), b''):
+                    with space:
+                        space.wait_for(lambda: buffered[0] < RELAY_BUFFER_SIZE)
+                        buffered[0] += len(chunk)
+                    chunks.put(chunk)
+        finally:
+            chunks.put(None)
+    def write():
+        broken = False
+        with open(dst, 'wb', buffering=0) as f:
+            for chunk in iter(chunks.get, None):
+                with space:
+                    buffered[0] -= len(chunk)
+                    space.notify()
+                if broken: continue
+                try:
+                    f.write(chunk)
+                except BrokenPipeError:
+                    # keep draining the queue so the reader is never blocked
+                    broken = True
+    threads = [threading.Thread(target=read, daemon=True),
+               threading.Thread(target=write, daemon=True)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def unblock(src, dst):
+    """
+    Briefly opens the other end of the FIFOs src and dst, so that relay() threads which are blocked
+    opening them (because a stage exited without ever opening its FIFO) can run to completion.
+
+    Parameters
+    ----------
+    src : string
+        Path of the FIFO read by relay().
+    dst : string
+        Path of the FIFO written by relay().
+
+    Returns
+    -------
+    None
+
+    """
+    for path, flags in [(src, os.O_WRONLY | os.O_NONBLOCK), (dst, os.O_RDONLY | os.O_NONBLOCK)]:
+        try:
+            os.close(os.open(path, flags))
+        except OSError:
+            # nobody is waiting on this end
+            pass
+
+async def run_streaming(logger, stages, links):
+    """
+    Runs pipeline stages concurrently, where each stage reads the output of the previous one through FIFOs.
+    If any stage fails, the other ones are cancelled.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the calling pipeline.
+    stages : list
+        Coroutines of the stages, each returns a returncode.
+    links : list
+        List of (src, dst) tuples. src is the path a stage writes to, dst the path the next stage reads from.
+        The FIFOs are created by this function and must not exist. The data is copied from src to dst by relay().
+
+    Returns
+    -------
+    returncode : int
+        0 if all stages succeeded, 1 otherwise.
+
+    """
+    relays = []
+    try:
+        for src, dst in links:
+            os.mkfifo(src)
+            os.mkfifo(dst)
+            relays.append((src, dst, relay(src, dst)))
+        return await run_concurrently(logger, stages)
+    finally:
+        for stage in stages:
+            # never started if creating the FIFOs failed
+            stage.close()
+        for src, dst, threads in relays:
+            while any(thread.is_alive() for thread in threads):
+                unblock(src, dst)
+                for thread in threads:
+                    thread.join(0.1)
+
+def feed(src, fifos):
+    """
+    Starts daemon threads which write the reads of src to the FIFOs. With two FIFOs, src holds interleaved pairs,
+    and the mates are written to one FIFO each. Gzip compressed input is decompressed.
+    Up to STREAM_QUEUE_BLOCKS blocks of reads are buffered per mate, beyond which src is no longer read until
+    the tool catches up. The block of a mate which has room is always passed on before waiting for the other mate,
+    so a tool which reads the mates at somewhat different paces never blocks.
+
+    Parameters
+    ----------
+    src : file object
+        Binary file the reads are read from, e.g. stdin.
+    fifos : list
+        Paths of the FIFOs, one per mate.
+
+    Returns
+    -------
+    threads : list
+        The started writer threads. The reader thread is not included, as it may block on src indefinitely.
+
+    """
+    blocks = [queue.Queue(maxsize=STREAM_QUEUE_BLOCKS) for fifo in fifos]
+    def put(mate_blocks):
+        # waits for full queues only after the other mates got their blocks
+        pending = []
+        for mate_queue, block in zip(blocks, mate_blocks):
+            try:
+                mate_queue.put_nowait(block)
+            except queue.Full:
+                pending.append((mate_queue, block))
+        for mate_queue, block in pending:
+            mate_queue.put(block)
+    def read():
+        try:
+            f = gzip.GzipFile(fileobj=src) if src.peek(2)[:2] == b'\x1f\x8b' else src
+            lines = 4 * len(fifos)
+            for block in iter(lambda: list(itertools.islice(f, STREAM_BLOCK_READS * lines)), []):
+                put([[line for i in range(mate * 4, len(block), lines) for line in block[i:i + 4]] for mate in range(len(fifos))])
+        finally:
+            put([None] * len(fifos))
+    def write(fifo, mate_blocks):
+        broken = False
+        try:
+            f = open(fifo, 'wb')
+        except OSError:
+            # the FIFO was removed after the pipeline exited without opening it
+            f, broken = None, True
+        for block in iter(mate_blocks.get, None):
+            if broken: continue
+            try:
+                f.writelines(block)
+            except BrokenPipeError:
+                # keep draining the queue so the reader is never blocked
+                broken = True
+        if f:
+            try:
+                f.close()
+            except BrokenPipeError:
+                pass
+    threading.Thread(target=read, daemon=True).start()
+    threads = [threading.Thread(target=write, args=(fifo, mate_blocks), daemon=True) for fifo, mate_blocks in zip(fifos, blocks)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def collect(fifos, dst):
+    """
+    Starts daemon threads which write the reads of the FIFOs to dst. With two FIFOs, the mates are interleaved.
+    Every FIFO is read by a thread of its own, which buffers up to STREAM_QUEUE_BLOCKS blocks of reads,
+    beyond which the tool blocks on the FIFO until dst catches up.
+
+    Parameters
+    ----------
+    fifos : list
+        Paths of the FIFOs, one per mate.
+    dst : file object
+        Binary file the reads are written to, e.g. stdout.
+
+    Returns
+    -------
+    threads : list
+        The started reader and writer threads.
+
+    """
+    blocks = [queue.Queue(maxsize=STREAM_QUEUE_BLOCKS) for fifo in fifos]
+    def read(fifo, mate_blocks):
+        try:
+            with open(fifo, 'rb') as f:
+                for block in iter(lambda: list(itertools.islice(f, STREAM_BLOCK_READS * 4)), []):
+                    mate_blocks.put(block)
+        finally:
+            mate_blocks.put(None)
+    def write():
+        broken = False
+        for block in itertools.zip_longest(*[iter(mate_blocks.get, None) for mate_blocks in blocks], fillvalue=[]):
+            if broken: continue
+            try:
+                dst.writelines(line for i in range(0, max(map(len, block)), 4) for mate in block for line in mate[i:i + 4])
+            except BrokenPipeError:
+                # keep draining the queues so the readers are never blocked
+                broken = True
+        try:
+            dst.flush()
+        except BrokenPipeError:
+            pass
+    threads = [threading.Thread(target=read, args=(fifo, mate_blocks), daemon=True) for fifo, mate_blocks in zip(fifos, blocks)]
+    threads.append(threading.Thread(target=write, daemon=True))
+    for thread in threads:
+        thread.start()
+    return threads
+
+@contextlib.contextmanager
+def standard_streams(seq, out, stdin=None, stdout=None):
+    """
+    Lets a pipeline read its input from stdin and write its output to stdout, where '-' is given as a path.
+    The pipeline reads and writes FIFOs instead, which feed() and collect() connect to stdin and stdout,
+    so every tool can be used, whether or not it reads stdin itself.
+
+    Parameters
+    ----------
+    seq : list
+        Input paths, as given with -i. '-' reads the reads from stdin, '- -' reads interleaved pairs from stdin.
+        Gzip compressed input is recognized by its content.
+    out : list
+        Output paths, as given with -o. '-' writes the reads to stdout, uncompressed,
+        with the mates interleaved if the input is paired.
+    stdin : file object
+        Binary file read instead of stdin.
+    stdout : file object
+        Binary file written instead of stdout.
+
+    Yields
+    ------
+    seq, out : list
+        The paths to pass to the pipeline, with FIFOs in place of '-'. The output FIFOs are named
+        <dir>/stdout_1.fastq and <dir>/stdout_2.fastq.
+
+    Raises
+    ------
+    ValueError
+        If only some of the outputs are '-'.
+
+    """
+    if '-' in out and any(path != '-' for path in out):
+        raise ValueError(f'Output to stdout must be given as "-" for every mate, got: {" ".join(out)}')
+    if '-' not in seq + out:
+        yield seq, out
+        return
+    with tempfile.TemporaryDirectory() as fifo_dir:
+        inputs = [f'{fifo_dir}/stdin_{mate}.fastq' for mate in range(1, seq.count('-') + 1)]
+        outputs = [f'{fifo_dir}/stdout_{mate}.fastq' for mate in range(1, len(seq) + 1)] if '-' in out else []
+        for fifo in inputs + outputs:
+            os.mkfifo(fifo)
+        writers = feed(stdin or sys.stdin.buffer, inputs) if inputs else []
+        readers = collect(outputs, stdout or sys.stdout.buffer) if outputs else []
+        fed = iter(inputs)
+        try:
+            yield [next(fed) if path == '-' else path for path in seq], outputs or out
+        finally:
+            # releases the threads blocked opening FIFOs which the pipeline never opened
+            while any(thread.is_alive() for thread in readers):
+                for fifo in outputs:
+                    unblock(fifo, fifo)
+                for thread in readers:
+                    thread.join(0.1)
+            for fifo in inputs:
+                unblock(fifo, fifo)
+            for thread in writers:
+                thread.join(0.1)
+
+async def run_concurrently(logger, coroutines):
+    """
+    Runs coroutines concurrently. As soon as one of them fails, the other ones are cancelled.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the calling pipeline.
+    coroutines : list
+        Coroutines which return a returncode.
+
+    Returns
+    -------
+    returncode : int
+        0 if all coroutines returned 0, 1 otherwise.
+
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(task.result() != 0 for task in done):
+                logger.error('Concurrently running stage failed, cancelling the other stages')
+                return 1
+        return 0
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+class Journal():
+    """
+    Records the progress of a resumable run in a directory, which also holds the shards and intermediate files of the run.
+    If the run is interrupted, running it again with the same arguments skips the steps it already completed.
+
+    """
+    def __init__(self, dir, description):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        dir : string
+            Path of the journal directory.
+        description : dict
+            Describes the run (input files, arguments etc.). The journal is only resumed by a run with the same description.
+
+        Returns
+        -------
+        None
+
+        """
+        self.dir = dir
+        self.description = json.loads(json.dumps(description, sort_keys=True, default=str))
+        self.done = set()
+
+    def open(self, logger):
+        """
+        Resumes the journal, or starts a new one if it does not exist or belongs to a different run.
+
+        Parameters
+        ----------
+        logger : logging.Logger
+            Logger instance of the calling pipeline.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If the directory exists, but is not a journal.
+
+        """
+        path = os.path.join(self.dir, JOURNAL_FILE)
+        if os.path.isdir(self.dir) and os.listdir(self.dir) and not os.path.isfile(path):
+            raise ValueError(f'Journal directory {self.dir} exists, but holds no journal')
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if state.get('description') == self.description:
+            self.done = set(state.get('done', []))
+            logger.info(f'Resuming from journal {self.dir}, completed steps: {", ".join(sorted(self.done)) or "none"}')
+            return
+        if state:
+            logger.warning(f'Journal {self.dir} belongs to a run with different arguments or input, starting over')
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+        self.done = set()
+        self.write()
+
+    def write(self):
+        """
+        Writes the journal file atomically, so an interruption leaves either the old or the new journal.
+
+        Returns
+        -------
+        None
+
+        """
+        path = os.path.join(self.dir, JOURNAL_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'description': self.description, 'done': sorted(self.done)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def is_done(self, step):
+        """
+        Checks whether a step of the run was completed.
+
+        Parameters
+        ----------
+        step : string
+            Name of the step.
+
+        Returns
+        -------
+        done : bool
+            True if the step was completed.
+
+        """
+        return step in self.done
+
+    def record(self, step):
+        """
+        Records that a step of the run was completed. Its outputs must be complete.
+
+        Parameters
+        ----------
+        step : string
+            Name of the step.
+
+        Returns
+        -------
+        None
+
+        """
+        self.done.add(step)
+        self.write()
+
+    def remove(self):
+        """
+        Removes the journal directory after the run has completed.
+
+        Returns
+        -------
+        None
+
+        """
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def create_journal(out1, description):
+    """
+    Creates the journal of a resumable run, in the directory <out1>.journal.
+
+    Parameters
+    ----------
+    out1 : string
+        Path where the first output FastQ file will be written.
+    description : dict
+        Describes the run, see Journal. The sizes and modification times of the input files
+        given as seq1 and seq2 are added to it.
+
+    Returns
+    -------
+    journal : Journal
+        The journal, not yet opened.
+
+    Raises
+    ------
+    ValueError
+        If an input or the output is not a regular file, e.g. stdin or stdout (see standard_streams()).
+
+    """
+    if os.path.exists(out1) and not results.is_regular(out1):
+        raise ValueError(f'A resumable run needs an output file, not: {out1}')
+    inputs = {}
+    for arg in ['seq1', 'seq2']:
+        path = description.get(arg)
+        if path:
+            if not results.is_regular(path):
+                raise ValueError(f'A resumable run needs input files, not: {path}')
+            stat = os.stat(path)
+            inputs[arg] = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+    return Journal(out1 + JOURNAL_SUFFIX, dict(description, inputs=inputs))
+
+async def run_sharded(logger, run_shard, seq1, out1, seq2=None, out2=None, shards=2, ordered=False, dir=None, journal=None, other1=None, other2=None):
+    """
+    Splits the input reads into shards, runs a pipeline on every shard concurrently and concatenates
+    the outputs of the shards in order.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the calling pipeline.
+    run_shard : function
+        Called as run_shard(seq1, out1, seq2, out2) for every shard, or as run_shard(seq1, out1, seq2, out2, other1, other2)
+        if other1 is given, returns a coroutine which runs the pipeline on the shard and returns a returncode.
+    seq1 : string
+        Path where the first input FastQ file is located.
+    out1 : string
+        Path where the first output FastQ file will be written.
+    seq2 : string
+        Path where the second input FastQ file is located.
+    out2 : string
+        Path where the second output FastQ file will be written.
+    shards : int
+        Number of shards.
+    ordered : bool
+        Whether to split the reads into contiguous shards, so the output keeps the input order
+        as far as the pipeline itself does. Requires an extra pass over the input to count the reads.
+    dir : string
+        Path where the shards are written.
+    journal : Journal
+        Journal of a resumable run. The shards are written to its directory instead, and only the shards
+        which were not completed by an earlier run are run. The journal is removed once the outputs are written.
+    other1 : string
+        Path where the first output FastQ file of the other reads will be written, see SAM.sam_to_fastq().
+    other2 : string
+        Path where the second output FastQ file of the other reads will be written.
+
+    Returns
+    -------
+    returncode : int
+        0 if all shards succeeded, 1 otherwise.
+
+    Raises
+    ------
+    ValueError
+        If the journal directory holds no journal.
+        If ordered, but the input is not a regular file which can be read twice, e.g. stdin (see standard_streams()).
+
+    """
+    if ordered and not results.is_regular(seq1):
+        raise ValueError(f'Ordered sharding needs input files, which are read twice, not: {seq1}')
+    if journal:
+        journal.open(logger)
+        returncode = await run_shards(logger, run_shard, seq1, out1, seq2, out2, shards, ordered, journal.dir, journal=journal, other1=other1, other2=other2)
+        if returncode == 0:
+            journal.remove()
+        return returncode
+    with tempfile.TemporaryDirectory(dir=dir) as shard_dir:
+        return await run_shards(logger, run_shard, seq1, out1, seq2, out2, shards, ordered, shard_dir, other1=other1, other2=other2)
+
+async def run_shards(logger, run_shard, seq1, out1, seq2, out2, shards, ordered, shard_dir, journal=None, other1=None, other2=None):
+    """
+    Splits the input, runs the shards and concatenates their outputs in shard_dir, see run_sharded().
+
+    Returns
+    -------
+    returncode : int
+        0 if all shards succeeded, 1 otherwise.
+
+    """
+    loop = asyncio.get_event_loop()
+    inputs = [[f'{shard_dir}/in{i}_{mate}.fastq' for i in range(shards)] for mate in [1, 2]]
+    outputs = [[f'{shard_dir}/{name}{i}_{mate}.fastq' + ('.gz' if out.endswith('.gz') else '') for i in range(shards)] if out else [out] * shards
+               for name, mate, out in [('out', 1, out1), ('out', 2, out2), ('other', 1, other1), ('other', 2, other2)]]
+    if journal and journal.is_done('split'):
+        logger.info(f'Input was already split into {shards} shards')
+    else:
+        logger.info(f'Splitting the input into {shards} shards')
+        reads = await loop.run_in_executor(None, FastQ.count, seq1) if ordered else None
+        await asyncio.gather(*[loop.run_in_executor(None, FastQ.split, seq, inputs[mate], ordered, reads)
+                               for mate, seq in enumerate([seq1, seq2]) if seq])
+        if journal:
+            journal.record('split')
+
+    async def run(i):
+        others = [outputs[2][i], outputs[3][i]] if other1 else []
+        returncode = await run_shard(inputs[0][i], outputs[0][i], inputs[1][i] if seq2 else seq2, outputs[1][i], *others)
+        if returncode == 0 and journal:
+            journal.record(f'shard{i}')
+        return returncode
+    remaining = [i for i in range(shards) if not (journal and journal.is_done(f'shard{i}'))]
+    if len(remaining) < shards:
+        logger.info(f'Skipping {shards - len(remaining)} completed shards, running {len(remaining)}')
+    returncode = await run_concurrently(logger, [run(i) for i in remaining])
+    if returncode != 0:
+        return 1
+
+    for shard_outputs, out in zip(outputs, [out1, out2, other1, other2]):
+        if out:
+            await loop.run_in_executor(None, FastQ.concatenate, shard_outputs, out)
+    return 0
+
+async def execute_sharded_async(logger, pipeline, args, kwargs, shards, ordered=False, pipe=True, workers=None, cache=None, resume=False, tool=None):
+    """
+    Runs a single-stage pipeline (one with a commands() function) sharded, see run_sharded().
+    The threads of the pipeline are divided between the shards, unless the shards are sent to workers,
+    which run them one at a time with their own threads.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the pipeline.
+    pipeline : object
+        The pipeline.
+    args : list
+        Positional arguments of pipeline.commands().
+    kwargs : dict
+        Keyword arguments of pipeline.commands().
+    shards : int
+        Number of shards, 0 to choose it from the number of threads.
+    ordered : bool
+        Whether to keep the input order of the reads, see run_sharded().
+    pipe : bool
+        Whether to pipe the commands of a shard into each other.
+    workers : list
+        Addresses of "hocort worker" processes which run the shards, see hocort.distributed.
+        Each worker runs one shard at a time. Defaults to one shard per worker.
+    cache : dict
+        Entry of the result cache, see execute_pipeline().
+    resume : bool
+        Whether to keep a journal of the completed shards next to the output, see Journal, and resume from it.
+        Without shards or workers, the number of shards is chosen from the number of threads.
+    tool : string
+        Name of the tool, whose index is resolved once for all shards which run locally, see resolve_index().
+        None to pass the index on unchanged.
+
+    Returns
+    -------
+    returncode : int
+        0 if all shards succeeded, 1 otherwise.
+
+    Raises
+    ------
+    ValueError
+        If pipeline.commands() raises ValueError.
+        If the pipeline can not be run by workers.
+        If the journal directory holds no journal.
+
+    """
+    name = pipeline.__class__.__name__
+    # fails early on invalid arguments
+    pipeline.commands(*args, **kwargs)
+    bound = inspect.signature(pipeline.commands).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = bound.arguments
+    loop = asyncio.get_event_loop()
+    if await loop.run_in_executor(None, results.restore, cache):
+        return 0
+    if resume and shards == 1 and not workers:
+        shards = 0
+    if workers:
+        shards = shards if shards > 1 else len(workers)
+        run_journal = run_journal_for(pipeline, arguments, shards, ordered) if resume else None
+        returncode = await execute_remote_async(logger, pipeline, arguments, shards, workers, ordered=ordered, journal=run_journal)
+        if returncode == 0:
+            await loop.run_in_executor(None, results.store, cache)
+        return returncode
+    shards = shards if shards > 0 else budget.shards(arguments['threads'])
+    threads = max(arguments['threads'] // shards, 1)
+    run_journal = run_journal_for(pipeline, arguments, shards, ordered) if resume else None
+
+    logger.info(f'Running pipeline: {name} in {shards} shards with {threads} threads each')
+    start_time = time.time()
+    with contextlib.ExitStack() as stack:
+        # the journal keeps the index as given, the shards run on its staged or cached copy
+        shard_arguments = await loop.run_in_executor(None, resolve_index, tool, pipeline.commands, [], arguments, stack) if tool else arguments
+        async def run_shard(seq1, out1, seq2, out2, other1=None, other2=None):
+            others = dict(other1=other1, other2=other2) if other1 else {}
+            cmds = pipeline.commands(**dict(shard_arguments, seq1=seq1, out1=out1, seq2=seq2, out2=out2, threads=threads, **others))
+            return await execute_pipeline_async(logger, name, cmds, pipe=pipe)
+        returncode = await run_sharded(logger,
+                                       run_shard,
+                                       arguments['seq1'],
+                                       arguments['out1'],
+                                       seq2=arguments['seq2'],
+                                       out2=arguments['out2'],
+                                       shards=shards,
+                                       ordered=ordered,
+                                       journal=run_journal,
+                                       other1=arguments.get('other1'),
+                                       other2=arguments.get('other2'))
+    end_time = time.time()
+    logger.info(f'Pipeline {name} run time: {end_time - start_time} seconds')
+    if returncode == 0:
+        await loop.run_in_executor(None, results.store, cache)
+    return returncode
+
+def run_journal_for(pipeline, arguments, shards, ordered):
+    """
+    Creates the journal of a resumable sharded run of a single-stage pipeline.
+
+    Parameters
+    ----------
+    pipeline : object
+        The pipeline.
+    arguments : dict
+        All arguments of pipeline.commands(), by name.
+    shards : int
+        Number of shards.
+    ordered : bool
+        Whether the input order of the reads is kept.
+
+    Returns
+    -------
+    journal : Journal
+        The journal, see create_journal().
+
+    """
+    description = {arg: value for arg, value in arguments.items() if arg not in results.IGNORED_ARGUMENTS}
+    return create_journal(arguments['out1'], dict(description, pipeline=pipeline.__class__.__name__, idx=arguments['idx'], shards=shards, ordered=ordered))
+
+async def execute_remote_async(logger, pipeline, arguments, shards, workers, ordered=False, journal=None):
+    """
+    Runs a single-stage pipeline sharded on workers, see execute_sharded_async().
+    Shards wait for a free worker, so there may be more shards than workers.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger instance of the pipeline.
+    pipeline : object
+        The pipeline.
+    arguments : dict
+        All arguments of pipeline.commands(), by name.
+    shards : int
+        Number of shards.
+    workers : list
+        Addresses of the workers.
+    ordered : bool
+        Whether to keep the input order of the reads, see run_sharded().
+    journal : Journal
+        Journal of a resumable run, see run_sharded().
+
+    Returns
+    -------
+    returncode : int
+        0 if all shards succeeded, 1 otherwise.
+
+    Raises
+    ------
+    ValueError
+        If the pipeline can not be run by workers, or with these arguments, see hocort.distributed.remote_arguments().
+
+    """
+    name = distributed.pipeline_name(pipeline)
+    remote_arguments = distributed.remote_arguments(name, pipeline, arguments)
+    free = asyncio.Queue()
+    for address in workers:
+        free.put_nowait(address)
+
+    logger.info(f'Running pipeline: {name} in {shards} shards on {len(workers)} workers')
+    start_time = time.time()
+    async def run_shard(seq1, out1, seq2, out2, other1=None, other2=None):
+        address = await free.get()
+        try:
+            inputs = {arg: path for arg, path in [('seq1', seq1), ('seq2', seq2)] if path}
+            outputs = {arg: path for arg, path in [('out1', out1), ('out2', out2), ('other1', other1), ('other2', other2)] if path}
+            return await distributed.run_remote(address, name, remote_arguments, inputs, outputs)
+        except (OSError, asyncio.IncompleteReadError, distributed.ProtocolError) as e:
+            logger.error(f'Worker {address} failed: {e}')
+            return 1
+        finally:
+            free.put_nowait(address)
+    returncode = await run_sharded(logger,
+                                   run_shard,
+                                   arguments['seq1'],
+                                   arguments['out1'],
+                                   seq2=arguments['seq2'],
+                                   out2=arguments['out2'],
+                                   shards=shards,
+                                   ordered=ordered,
+                                   journal=journal,
+                                   other1=arguments.get('other1'),
+                                   other2=arguments.get('other2'))
+    end_time = time.time()
+    logger.info(f'Pipeline {name} run time: {end_time - start_time} seconds')
+    return returncode
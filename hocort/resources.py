@@ -0,0 +1,216 @@
+"""
+Detects the CPUs and memory available to this process.
+Respects CPU affinity and the CPU and memory limits of cgroup v1 and v2, as used by containers,
+which os.cpu_count() and the physical memory of the machine do not.
+
+"""
+import logging
+import math
+import os
+
+logger = logging.getLogger(__file__)
+
+# Mount point of the cgroup filesystem.
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# Lists the cgroups of this process, one line per hierarchy: "<id>:<controllers>:<path>".
+PROC_CGROUP = '/proc/self/cgroup'
+
+# Share of a cgroup memory limit given to a Java heap, the rest is left to the JVM itself.
+JAVA_HEAP_FRACTION = 0.85
+
+# cgroup v1 reports an unlimited memory.limit_in_bytes as a number close to the maximum 64-bit integer.
+UNLIMITED_MEMORY = 2 ** 60
+
+
+def read_file(path):
+    """
+    Reads a small text file.
+
+    Parameters
+    ----------
+    path : string
+        Path of the file.
+
+    Returns
+    -------
+    content : string
+        Content of the file without surrounding whitespace, None if the file could not be read.
+
+    """
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (OSError, ValueError):
+        return None
+
+def cgroup_dirs(controller, root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """
+    Finds the cgroup directories of this process for a controller.
+    The limits of every ancestor of a cgroup apply to it as well, so the ancestors are included.
+
+    Parameters
+    ----------
+    controller : string
+        cgroup v1 controller, e.g. 'cpu' or 'memory'. cgroup v2 has a single hierarchy for all controllers.
+    root : string
+        Mount point of the cgroup filesystem.
+    proc_cgroup : string
+        Path of the file which lists the cgroups of this process.
+
+    Returns
+    -------
+    dirs : list
+        Existing cgroup directories, innermost first.
+
+    """
+    dirs = []
+    for line in (read_file(proc_cgroup) or '').splitlines():
+        try:
+            hierarchy, controllers, path = line.split(':', 2)
+        except ValueError:
+            continue
+        if not controllers:
+            base = root
+        elif controller in controllers.split(','):
+            base = f'{root}/{controllers}'
+        else:
+            continue
+        path = path.rstrip('/')
+        while True:
+            dirs.append(base + path)
+            if not path:
+                break
+            path = path.rsplit('/', 1)[0]
+    return [d for d in dict.fromkeys(dirs) if os.path.isdir(d)]
+
+def cgroup_cpu_limit(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """
+    Reads the CPU quota of the cgroups of this process.
+
+    Parameters
+    ----------
+    root : string
+        Mount point of the cgroup filesystem.
+    proc_cgroup : string
+        Path of the file which lists the cgroups of this process.
+
+    Returns
+    -------
+    cpus : float
+        Number of CPUs the quota allows, None if there is no quota.
+
+    """
+    limits = []
+    for d in cgroup_dirs('cpu', root=root, proc_cgroup=proc_cgroup):
+        cpu_max = read_file(f'{d}/cpu.max')
+        if cpu_max:
+            quota, period = (cpu_max.split() + ['100000'])[:2]
+            if quota != 'max' and int(period) > 0:
+                limits.append(int(quota) / int(period))
+        quota = read_file(f'{d}/cpu.cfs_quota_us')
+        period = read_file(f'{d}/cpu.cfs_period_us')
+        if quota and period and int(quota) > 0 and int(period) > 0:
+            limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+def cgroup_memory_limit(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """
+    Reads the memory limit of the cgroups of this process.
+
+    Parameters
+    ----------
+    root : string
+        Mount point of the cgroup filesystem.
+    proc_cgroup : string
+        Path of the file which lists the cgroups of this process.
+
+    Returns
+    -------
+    memory : int
+        Memory limit in bytes, None if there is no limit.
+
+    """
+    limits = []
+    for d in cgroup_dirs('memory', root=root, proc_cgroup=proc_cgroup):
+        for name in ['memory.max', 'memory.limit_in_bytes']:
+            limit = read_file(f'{d}/{name}')
+            if limit and limit.isdigit() and int(limit) < UNLIMITED_MEMORY:
+                limits.append(int(limit))
+    return min(limits) if limits else None
+
+def affinity_cpus():
+    """
+    Counts the CPUs this process may run on.
+
+    Returns
+    -------
+    cpus : int
+        Number of CPUs in the CPU affinity mask of this process.
+
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+def physical_memory():
+    """
+    Reads the physical memory of the machine.
+
+    Returns
+    -------
+    memory : int
+        Physical memory in bytes, None if it could not be determined.
+
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def available_cpus():
+    """
+    Counts the CPUs available to this process, the default number of threads of the tools.
+
+    Returns
+    -------
+    cpus : int
+        The smaller of the CPU affinity and the cgroup CPU quota (rounded up), at least 1.
+
+    """
+    cpus = affinity_cpus()
+    limit = cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, math.ceil(limit))
+    return max(cpus, 1)
+
+def available_memory():
+    """
+    Determines the memory available to this process.
+
+    Returns
+    -------
+    memory : int
+        The smaller of the physical memory and the cgroup memory limit in bytes, None if neither is known.
+
+    """
+    limits = [m for m in [physical_memory(), cgroup_memory_limit()] if m]
+    return min(limits) if limits else None
+
+def java_heap():
+    """
+    Determines the maximum Java heap size for the cgroup memory limit of this process.
+    Java tools such as BBMap size their heap from the memory of the machine, which ignores cgroup limits.
+
+    Returns
+    -------
+    heap : int
+        Maximum heap size in bytes, None if there is no cgroup memory limit below the physical memory.
+
+    """
+    limit = cgroup_memory_limit()
+    physical = physical_memory()
+    if not limit or (physical and limit >= physical):
+        return None
+    return int(limit * JAVA_HEAP_FRACTION)
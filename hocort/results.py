@@ -0,0 +1,317 @@
+"""
+Caches the outputs of pipeline runs, so that repeated or overlapping runs reuse them instead of running the tools again,
+e.g. the Kraken2 stage shared by Kraken2Bowtie2 and Kraken2HISAT2, or the stages before a failed one when a run is repeated.
+
+A result is keyed on the contents of the input files (their SHA-256 checksums, which are recorded in the cache directory
+and only computed again when the size, modification time or inode of a file change), the index (its files, sizes and modification times),
+the versions of the tools and of HoCoRT, and the arguments which affect the output. The cache is enabled by setting
+a cache directory, and the least recently used results are evicted when its size exceeds its limit.
+Runs whose inputs or outputs are not regular files (e.g. FIFOs between streamed cascade stages) are never cached.
+
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+
+import hocort.indexes as indexes
+from hocort.version import __version__
+
+logger = logging.getLogger(__file__)
+
+# Directory where results are cached, None to disable the cache.
+# Can be set with the environment variable HOCORT_RESULT_CACHE_DIR.
+CACHE_DIR = os.environ.get('HOCORT_RESULT_CACHE_DIR') or None
+
+# Maximum size (GiB) of the cache, None if unlimited. Can be set with the environment variable HOCORT_RESULT_CACHE_SIZE.
+CACHE_SIZE = float(os.environ['HOCORT_RESULT_CACHE_SIZE']) if os.environ.get('HOCORT_RESULT_CACHE_SIZE') else None
+
+# Pipelines whose results are cached: the tool their index belongs to (a key of indexes.INDEX_FILES),
+# and the executables whose versions affect the result.
+PIPELINES = {
+    'bowtie2': ('bowtie2', ['bowtie2', 'samtools']),
+    'hisat2': ('hisat2', ['hisat2', 'samtools']),
+    'bwamem2': ('bwamem2', ['bwa-mem2', 'samtools']),
+    'minimap2': ('minimap2', ['minimap2', 'samtools']),
+    'bbmap': ('bbmap', ['bbmap.sh', 'samtools']),
+    'kraken2': ('kraken2', ['kraken2'])
+}
+
+# Arguments of the pipelines which name input files, and output files.
+INPUT_ARGUMENTS = ['seq1', 'seq2']
+OUTPUT_ARGUMENTS = ['out1', 'out2', 'out', 'other1', 'other2', 'other', 'kraken_output', 'report']
+
+# Arguments of the pipelines which do not affect the result.
+IGNORED_ARGUMENTS = ['idx', 'threads', 'pin', 'mmap']
+
+# Subdirectory of the cache directory where the checksums of the input files are recorded, see fingerprint().
+FINGERPRINT_DIR = 'fingerprints'
+
+# Tool versions and file fingerprints, computed once per process.
+versions = {}
+fingerprints = {}
+
+
+def tool_version(tool):
+    """
+    Determines the version of a tool from the first line printed by "<tool> --version".
+
+    Parameters
+    ----------
+    tool : string
+        Name of the executable.
+
+    Returns
+    -------
+    version : string
+        The version, None if the tool could not be run.
+
+    """
+    if tool not in versions:
+        try:
+            proc = subprocess.run([tool, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, timeout=60)
+            lines = proc.stdout.decode(errors='replace').strip().splitlines()
+            versions[tool] = lines[0] if lines else ''
+        except (OSError, subprocess.SubprocessError):
+            versions[tool] = None
+    return versions[tool]
+
+def is_regular(path):
+    """
+    Checks whether a path is a regular file.
+
+    Parameters
+    ----------
+    path : string
+        Path of the file.
+
+    Returns
+    -------
+    regular : bool
+        True if the path is a regular file.
+
+    """
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+def fingerprint(path, dir=None):
+    """
+    Computes the SHA-256 checksum of an input file, unless the file has not changed since it was last computed.
+    The checksum is recorded in the cache directory, so that later runs only read the file again
+    if its size, modification time or inode differ from the record, like catalog.is_current() does for FASTA files.
+
+    Parameters
+    ----------
+    path : string
+        Path of the file.
+    dir : string
+        Cache directory where the checksum is recorded, not recorded if None.
+
+    Returns
+    -------
+    fingerprint : string
+        Hexadecimal SHA-256 digest.
+
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    if key not in fingerprints:
+        record_path = os.path.join(dir, FINGERPRINT_DIR, hashlib.sha256(key[0].encode()).hexdigest()[:32] + '.json') if dir else None
+        record = None
+        if record_path and os.path.exists(record_path):
+            try:
+                with open(record_path) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if record and tuple(record.get('file', [])) == key:
+            fingerprints[key] = record['sha256']
+        else:
+            fingerprints[key] = indexes.checksum(path)
+            if record_path:
+                try:
+                    os.makedirs(os.path.dirname(record_path), exist_ok=True)
+                    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(record_path), delete=False) as f:
+                        json.dump({'file': list(key), 'sha256': fingerprints[key]}, f)
+                    os.replace(f.name, record_path)
+                except OSError as e:
+                    logger.warning(f'Could not record the checksum of {path}: {e}')
+    return fingerprints[key]
+
+def output_files(arguments):
+    """
+    Lists the output files of a pipeline run.
+
+    Parameters
+    ----------
+    arguments : dict
+        All arguments of the commands() function of the pipeline, by name.
+
+    Returns
+    -------
+    outputs : dict
+        Paths of the output files, by role (the argument naming them, with the mate for Kraken2 outputs containing #).
+
+    """
+    outputs = {}
+    for arg in OUTPUT_ARGUMENTS:
+        path = arguments.get(arg)
+        if not path:
+            continue
+        if arg in ['out', 'other'] and '#' in path and arguments.get('seq2'):
+            outputs[f'{arg}_1'] = path.replace('#', '_1')
+            outputs[f'{arg}_2'] = path.replace('#', '_2')
+        else:
+            outputs[arg] = path
+    return outputs
+
+def entry(name, commands, args, kwargs, dir=None):
+    """
+    Determines the cache entry of a pipeline run.
+
+    Parameters
+    ----------
+    name : string
+        Name of the pipeline, a key of PIPELINES.
+    commands : function
+        The commands() function of the pipeline.
+    args : list
+        Positional arguments of commands().
+    kwargs : dict
+        Keyword arguments of commands().
+    dir : string
+        Cache directory, defaults to CACHE_DIR.
+
+    Returns
+    -------
+    entry : dict
+        Key of the result, path of its directory in the cache and the output files of the run.
+        None if the cache is disabled, or the run can not be cached.
+
+    """
+    dir = dir if dir else CACHE_DIR
+    if not dir or name not in PIPELINES:
+        return None
+    tool, executables = PIPELINES[name]
+    try:
+        bound = inspect.signature(commands).bind(*args, **kwargs)
+    except TypeError:
+        return None
+    bound.apply_defaults()
+    arguments = bound.arguments
+    inputs = [arguments.get(arg) for arg in INPUT_ARGUMENTS]
+    outputs = output_files(arguments)
+    if not all(is_regular(path) for path in inputs if path):
+        logger.debug(f'Not caching the result of {name}, its inputs are not regular files')
+        return None
+    if not all(is_regular(path) or not os.path.exists(path) for path in outputs.values()):
+        logger.debug(f'Not caching the result of {name}, its outputs are not regular files')
+        return None
+    tool_versions = {executable: tool_version(executable) for executable in executables}
+    if None in tool_versions.values():
+        return None
+    files = indexes.index_files(arguments['idx'], tool)
+    if not files:
+        return None
+
+    description = {
+        'hocort': __version__,
+        'pipeline': name,
+        'versions': tool_versions,
+        'index': indexes.describe(files, os.path.dirname(os.path.normpath(os.path.abspath(arguments['idx'])))),
+        'inputs': [fingerprint(path, dir) if path else None for path in inputs],
+        # the outputs are compressed depending on their extension
+        'outputs': {role: path.endswith('.gz') for role, path in outputs.items()},
+        'arguments': {arg: value for arg, value in arguments.items()
+                      if arg not in INPUT_ARGUMENTS + OUTPUT_ARGUMENTS + IGNORED_ARGUMENTS}
+    }
+    key = hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+    return {'name': name, 'key': key, 'dir': os.path.join(dir, key[:32]), 'outputs': outputs}
+
+def restore(entry):
+    """
+    Copies the cached outputs of a run to its output files.
+
+    Parameters
+    ----------
+    entry : dict
+        The cache entry, as returned by entry().
+
+    Returns
+    -------
+    restored : bool
+        True if the result was cached and its outputs were copied.
+
+    """
+    if not entry or not os.path.isdir(entry['dir']):
+        return False
+    try:
+        with indexes.locked(entry['dir'] + '.lock'):
+            with open(os.path.join(entry['dir'], indexes.MANIFEST)) as f:
+                manifest = json.load(f)
+            if manifest.get('key') != entry['key'] or sorted(manifest.get('outputs', [])) != sorted(entry['outputs']):
+                return False
+            for role, path in entry['outputs'].items():
+                shutil.copyfile(os.path.join(entry['dir'], role), path)
+            os.utime(os.path.join(entry['dir'], indexes.MANIFEST))
+    except (OSError, ValueError) as e:
+        logger.warning(f'Could not reuse the cached result of {entry["name"]}: {e}')
+        return False
+    logger.info(f'Reused the cached result of {entry["name"]}: {entry["key"]}')
+    return True
+
+def store(entry, capacity=None):
+    """
+    Copies the outputs of a successful run into the cache. Failures are logged, as the run itself succeeded.
+
+    Parameters
+    ----------
+    entry : dict
+        The cache entry, as returned by entry().
+    capacity : float
+        Maximum size (GiB) of the cache, defaults to CACHE_SIZE. The least recently used results are evicted to make room.
+
+    Returns
+    -------
+    stored : bool
+        True if the outputs were stored.
+
+    """
+    if not entry:
+        return False
+    capacity = capacity if capacity is not None else CACHE_SIZE
+    dir = os.path.dirname(entry['dir'])
+    try:
+        os.makedirs(dir, exist_ok=True)
+        with indexes.locked(entry['dir'] + '.lock'):
+            if os.path.isdir(entry['dir']):
+                shutil.rmtree(entry['dir'])
+            size = sum(os.path.getsize(path) for path in entry['outputs'].values())
+            if capacity is not None:
+                with indexes.locked(os.path.join(dir, '.evict.lock')):
+                    if not indexes.evict(dir, size, int(capacity * 2**30), keep=entry['dir']):
+                        logger.info(f'Not caching the result of {entry["name"]}, it does not fit into {dir}')
+                        return False
+            tmp_dir = tempfile.mkdtemp(dir=dir, prefix=os.path.basename(entry['dir']) + '.')
+            try:
+                for role, path in entry['outputs'].items():
+                    shutil.copyfile(path, os.path.join(tmp_dir, role))
+                manifest = {'pipeline': entry['name'], 'key': entry['key'], 'size': size, 'outputs': list(entry['outputs'])}
+                with open(os.path.join(tmp_dir, indexes.MANIFEST), 'w') as f:
+                    json.dump(manifest, f)
+                os.rename(tmp_dir, entry['dir'])
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+    except OSError as e:
+        logger.warning(f'Could not cache the result of {entry["name"]}: {e}')
+        return False
+    logger.info(f'Cached the result of {entry["name"]}: {entry["key"]}')
+    return True
@@ -0,0 +1,176 @@
+import asyncio
+import csv
+import os
+import sys
+
+import pytest
+
+import hocort.batch as batch
+
+
+def test_read_sheet_tsv(tmp_path):
+    sheet = tmp_path / 'samples.tsv'
+    sheet.write_text('# comment\n'
+                     'sample\tfastq_1\tfastq_2\tthreads\n'
+                     'S1\t/data/S1_1.fastq\t/data/S1_2.fastq\t4\n'
+                     '\n'
+                     'S2\t/data/S2.fastq\t\t\n')
+    samples = batch.read_sheet(str(sheet))
+    assert samples == [
+        {'sample': 'S1', 'fastq_1': '/data/S1_1.fastq', 'fastq_2': '/data/S1_2.fastq', 'threads': 4, 'memory': None},
+        {'sample': 'S2', 'fastq_1': '/data/S2.fastq', 'fastq_2': None, 'threads': None, 'memory': None}
+    ]
+
+def test_read_sheet_csv(tmp_path):
+    sheet = tmp_path / 'samples.csv'
+    sheet.write_text('sample, fastq_1, memory\nS1, /data/S1.fastq, 2.5\n')
+    samples = batch.read_sheet(str(sheet))
+    assert samples[0]['fastq_1'] == '/data/S1.fastq'
+    assert samples[0]['memory'] == 2.5
+
+@pytest.mark.parametrize('content', [
+    'sample\tfastq\nS1\t/data/S1.fastq\n',
+    'sample\tfastq_1\nS1\t/data/S1.fastq\nS1\t/data/S1b.fastq\n',
+    'sample\tfastq_1\nS1\t/data/S1;rm.fastq\n',
+    'sample\tfastq_1\n../S1\t/data/S1.fastq\n',
+    'sample\tfastq_1\nS1\t\n'
+])
+def test_read_sheet_invalid(tmp_path, content):
+    sheet = tmp_path / 'samples.tsv'
+    sheet.write_text(content)
+    with pytest.raises(ValueError):
+        batch.read_sheet(str(sheet))
+
+def test_output_arguments():
+    assert batch.output_arguments('bowtie2', 'out/S1', True) == ['out/S1_1.fastq', 'out/S1_2.fastq']
+    assert batch.output_arguments('bowtie2', 'out/S1', False) == ['out/S1.fastq']
+    assert batch.output_arguments('kraken2', 'out/S1', True) == ['out/S1#.fastq']
+    assert batch.output_arguments('biobloom', 'out/S1', True) == ['out/S1']
+
+def test_command_mmap():
+    cmd = batch.Batch().command('bowtie2', ['S1_1.fastq', 'S1_2.fastq'], ['out/S1_1.fastq', 'out/S1_2.fastq'], 'out/S1.log', 8, ['-x', 'idx'])
+    assert cmd[:5] == [sys.executable, '-m', 'hocort', 'map', 'bowtie2']
+    assert cmd[5:] == ['-l', 'out/S1.log',
+                       '-i', 'S1_1.fastq', 'S1_2.fastq',
+                       '-o', 'out/S1_1.fastq', 'out/S1_2.fastq',
+                       '-t', '8', '--mmap', 'true', '-x', 'idx']
+    cmd = batch.Batch().command('bowtie2', ['S1.fastq'], ['out/S1.fastq'], 'out/S1.log', 8, ['--mmap', 'false'])
+    assert cmd.count('--mmap') == 1
+    cmd = batch.Batch().command('bwamem2', ['S1.fastq'], ['out/S1.fastq'], 'out/S1.log', 8, [])
+    assert '--mmap' not in cmd
+
+def test_write_results(tmp_path):
+    path = tmp_path / 'results.tsv'
+    batch.write_results(str(path), [{'sample': 'S1', 'returncode': 0, 'input_reads': 10, 'output_reads': 8},
+                                    {'sample': 'S2', 'returncode': 1}])
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    assert list(rows[0]) == batch.RESULT_COLUMNS
+    assert rows[0]['output_reads'] == '8'
+    assert rows[1]['returncode'] == '1'
+    assert rows[1]['input_reads'] == ''
+
+def run_jobs(scheduler, jobs):
+    running = {'threads': 0, 'memory': 0, 'jobs': 0}
+    peak = dict(running)
+    order = []
+    async def job(name, threads, memory):
+        running['threads'] += threads
+        running['memory'] += memory
+        running['jobs'] += 1
+        for key in peak:
+            peak[key] = max(peak[key], running[key])
+        order.append(name)
+        await asyncio.sleep(0.05)
+        running['threads'] -= threads
+        running['memory'] -= memory
+        running['jobs'] -= 1
+    async def main():
+        await asyncio.gather(*[scheduler.run(lambda job_args=job_args: job(*job_args), job_args[1], job_args[2]) for job_args in jobs])
+    asyncio.run(main())
+    return peak, order
+
+def test_scheduler_jobs():
+    peak, order = run_jobs(batch.Scheduler(2, 100), [(i, 1, 0) for i in range(6)])
+    assert peak['jobs'] == 2
+    assert order == list(range(6))
+
+def test_scheduler_threads_memory():
+    peak, order = run_jobs(batch.Scheduler(10, 8, memory=10), [(i, 4, 3) for i in range(6)])
+    assert peak['threads'] == 8
+    peak, order = run_jobs(batch.Scheduler(10, 100, memory=10), [(i, 4, 4) for i in range(6)])
+    assert peak['memory'] == 8
+
+def test_scheduler_oversized_job():
+    peak, order = run_jobs(batch.Scheduler(4, 8, memory=10), [(0, 16, 1), (1, 2, 20), (2, 1, 1)])
+    assert order == [0, 1, 2]
+
+def test_run_async_failed_sample(tmp_path):
+    # the index does not exist, so the sample fails and no reads are counted
+    fastq = tmp_path / 'S1.fastq'
+    fastq.write_text('@r1\nACGT\n+\nIIII\n')
+    samples = [{'sample': 'S1', 'fastq_1': str(fastq), 'fastq_2': None, 'threads': None, 'memory': None}]
+    results = asyncio.run(batch.Batch().run_async('bowtie2',
+                                                  samples,
+                                                  str(tmp_path / 'out'),
+                                                  arguments=['-x', str(tmp_path / 'missing')],
+                                                  jobs=2,
+                                                  threads=2))
+    assert len(results) == 1
+    assert results[0]['sample'] == 'S1'
+    assert results[0]['returncode'] != 0
+    assert results[0]['threads'] == 1
+    assert 'input_reads' not in results[0]
+    assert (tmp_path / 'out' / 'S1').is_dir()
+
+class CopyBatch(batch.Batch):
+    """
+    Runs a "pipeline" which copies the reads, dropping those of the first mate named read1.
+
+    """
+    def command(self, pipeline, inputs, outputs, log, threads, arguments):
+        script = '; '.join(f'awk \'NR % 4 == 1 {{ keep = ($0 !~ /\\|read1\\/1$/) }} keep\' {i} > {o}' for i, o in zip(inputs, outputs))
+        return ['sh', '-c', script]
+
+def write_sample(tmp_path, name, reads, paired):
+    paths = []
+    for mate in [1, 2] if paired else [1]:
+        path = tmp_path / f'{name}_{mate}.fastq'
+        path.write_text(''.join(f'@read{i}/{mate}\nACGT\n+\nIIII\n' for i in range(reads)))
+        paths.append(str(path))
+    return {'sample': name, 'fastq_1': paths[0], 'fastq_2': paths[1] if paired else None, 'threads': None, 'memory': None}
+
+def test_run_multiplexed(tmp_path):
+    samples = [write_sample(tmp_path, f'S{i}', 2000 * i, i % 2 == 0) for i in range(5)]
+    output = tmp_path / 'out'
+    results = asyncio.run(CopyBatch().run_async('bowtie2', samples, str(output), jobs=2, threads=2, multiplex=True))
+    assert [result['sample'] for result in results] == [f'S{i}' for i in range(5)]
+    for i, result in enumerate(results):
+        assert result['returncode'] == 0
+        assert result['input_reads'] == 2000 * i
+        if i % 2 == 0:
+            assert result['log'] == str(output / 'multiplexed_paired.log')
+            assert result['output_reads'] == max(2000 * i - 1, 0)
+            assert (output / f'S{i}' / f'S{i}_2.fastq').read_text() == (tmp_path / f'S{i}_2.fastq').read_text()
+            lines = (output / f'S{i}' / f'S{i}_1.fastq').read_text().splitlines()
+            assert '@read1/1' not in lines[0::4]
+        else:
+            assert result['output_reads'] == 2000 * i - 1
+            assert (output / f'S{i}' / f'S{i}.fastq').exists()
+    assert not [f for f in os.listdir(output) if f.startswith('tmp')]
+
+def test_run_multiplexed_failure(tmp_path):
+    # the pipeline fails without opening the FIFOs, which must not hang the batch
+    samples = [write_sample(tmp_path, f'S{i}', 100, True) for i in range(3)]
+    results = asyncio.run(batch.Batch().run_async('bowtie2',
+                                                  samples,
+                                                  str(tmp_path / 'out'),
+                                                  arguments=['-x', str(tmp_path / 'missing')],
+                                                  multiplex=True))
+    assert all(result['returncode'] != 0 for result in results)
+    assert (tmp_path / 'out' / 'S0').is_dir()
+
+def test_run_multiplexed_invalid_pipeline(tmp_path):
+    samples = [write_sample(tmp_path, 'S0', 10, False)]
+    with pytest.raises(ValueError):
+        asyncio.run(batch.Batch().run_async('kraken2', samples, str(tmp_path / 'out'), multiplex=True))
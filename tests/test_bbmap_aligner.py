@@ -61,3 +61,8 @@ def test_seq2_no_path():
 def test_sam_1():
     cmd = BBMap().align(idx, seq1, output)
     helper(cmd, 0)
+
+def test_decision_only():
+    cmd = BBMap().align(idx, seq1, output, seq2=seq2, decision_only=True)
+    assert all(option in cmd[0] for option in ['ambiguous=first', 'secondary=f'])
+    helper(cmd, 0)
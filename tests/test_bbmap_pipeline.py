@@ -66,3 +66,16 @@ def test_pipeline_seq2_no_out2():
 def test_pipeline_noseq2_out2():
     returncode = BBMap().run(idx, seq1, out1, out2=out2)
     assert returncode == 0
+
+def test_commands_native():
+    cmds = BBMap().commands(idx, seq1, out1, seq2=seq2, out2=out2, native=True, other1=out1 + '.gz', other2=out2 + '.gz')
+    assert len(cmds) == 1
+    assert [arg for arg in cmds[0] if arg.startswith(('out', 'outu', 'outm'))] == \
+        [f'outu={out1}', f'outu2={out2}', f'outm={out1}.gz', f'outm2={out2}.gz']
+    # output paths which BBMap can not recognize as FastQ are converted with samtools
+    cmds = BBMap().commands(idx, seq1, f'{temp_dir.name}/out.txt', native=True)
+    assert cmds[1][:2] == ['samtools', 'fastq']
+
+def test_pipeline_native_2():
+    returncode = BBMap().run(idx, seq1, out1, seq2=seq2, out2=out2, native=True)
+    assert returncode == 0
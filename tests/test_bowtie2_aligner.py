@@ -72,3 +72,8 @@ def test_end_to_end_sam_2():
     options = ['--end-to-end']
     cmd = Bowtie2().align(idx, seq1, output, seq2=seq2, options=options)
     helper(cmd, 0)
+
+def test_decision_only():
+    cmd = Bowtie2().align(idx, seq1, output, seq2=seq2, decision_only=True)
+    assert all(option in cmd[0] for option in ['-k', '1'])
+    helper(cmd, 0)
@@ -1,9 +1,12 @@
+import asyncio
 import tempfile
 import os
+import sys
 
 import pytest
 
 from hocort.pipelines.bowtie2 import Bowtie2
+import hocort.execute as exe
 
 temp_dir = tempfile.TemporaryDirectory()
 path = os.path.dirname(__file__)
@@ -90,6 +93,19 @@ def test_pipeline_2():
     returncode = Bowtie2().run(idx, seq1, out1, seq2=seq2, out2=out2)
     assert returncode == 0
 
+def test_pipeline_pin():
+    returncode = Bowtie2().run(idx, seq1, out1, seq2=seq2, out2=out2, threads=4, pin=True)
+    assert returncode == 0
+
+def test_pipeline_shards():
+    returncode = Bowtie2().run(idx, seq1, out1, seq2=seq2, out2=out2, threads=4, shards=2, ordered=True)
+    assert returncode == 0
+
+def test_commands_threads():
+    cmds = Bowtie2().commands(idx, seq1, out1, threads=10)
+    assert cmds[0][cmds[0].index('-p') + 1] == '9'
+    assert cmds[1][cmds[1].index('--threads') + 1] == '1'
+
 def test_pipeline_seq2_no_out2():
     with pytest.raises(ValueError):
         returncode = Bowtie2().run(idx, seq1, out1, seq2=seq2)
@@ -97,3 +113,53 @@ def test_pipeline_seq2_no_out2():
 def test_pipeline_noseq2_out2():
     returncode = Bowtie2().run(idx, seq1, out1, out2=out2)
     assert returncode == 0
+
+def test_pipeline_async_1():
+    returncode = asyncio.run(Bowtie2().run_async(idx, seq1, out1))
+    assert returncode == 0
+
+def test_pipeline_async_2():
+    returncode = asyncio.run(Bowtie2().run_async(idx, seq1, out1, seq2=seq2, out2=out2))
+    assert returncode == 0
+
+def test_pipeline_async_seq2_no_out2():
+    with pytest.raises(ValueError):
+        returncode = asyncio.run(Bowtie2().run_async(idx, seq1, out1, seq2=seq2))
+
+def test_commands_native():
+    cmds = Bowtie2().commands(idx, seq1, out1, seq2=seq2, out2=out2, mfilter=False, threads=4, native=True, other1=out1 + '.other', other2=out2 + '.other')
+    assert len(cmds) == 1
+    assert cmds[0][cmds[0].index('-p') + 1] == '4'
+    assert cmds[0][cmds[0].index('--al-conc') + 1] == f'{temp_dir.name}/out%.fastq'
+    assert cmds[0][cmds[0].index('--un-conc') + 1] == f'{temp_dir.name}/out%.fastq.other'
+    # output paths which Bowtie2 can not write are converted with samtools
+    cmds = Bowtie2().commands(idx, seq1, out1, seq2=seq2, out2=f'{temp_dir.name}/mates.fastq', native=True)
+    assert cmds[1][:2] == ['samtools', 'fastq']
+
+def test_pipeline_native_2():
+    returncode = Bowtie2().run(idx, seq1, out1, seq2=seq2, out2=out2, native=True)
+    assert returncode == 0
+
+def test_commands_speed():
+    cmds = Bowtie2().commands(idx, seq1, out1, speed='sensitive')
+    assert '--very-sensitive' in cmds[0]
+    cmds = Bowtie2().commands(idx, seq1, out1, preset='local', speed='fast')
+    assert '--very-fast-local' in cmds[0]
+    with pytest.raises(ValueError):
+        cmds = Bowtie2().commands(idx, seq1, out1, speed='fastest')
+
+def test_interface_streams(monkeypatch, capsysbinary):
+    # interleaved pairs are read from stdin, and written to stdout
+    with open(seq1) as f1, open(seq2) as f2:
+        lines1, lines2 = f1.readlines(), f2.readlines()
+    reads = ''.join(line for i in range(0, len(lines1), 4) for line in lines1[i:i + 4] + lines2[i:i + 4])
+    stdin = f'{temp_dir.name}/interleaved.fastq'
+    with open(stdin, 'w') as f:
+        f.write(reads)
+    def run(self, idx, seq1, out1, seq2=None, out2=None, **kwargs):
+        returncodes = exe.execute([['sh', '-c', f'cat {seq1} > {out1} & cat {seq2} > {out2}; wait']])
+        return returncodes[0]
+    monkeypatch.setattr(Bowtie2, 'run', run)
+    monkeypatch.setattr(sys, 'stdin', open(stdin))
+    assert Bowtie2().interface(['-x', idx, '-i', '-', '-', '-o', '-']) == 0
+    assert capsysbinary.readouterr().out.decode() == reads
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+import hocort.budget as budget
+import hocort.execute as exe
+
+
+def test_split_weighted():
+    counts = budget.split(64, ['bowtie2', 'samtools'])
+    assert counts == [58, 6]
+
+def test_split_equal():
+    counts = budget.split(8, ['kraken2', 'bowtie2'])
+    assert counts == [4, 4]
+
+def test_split_sum():
+    for threads in range(2, 130):
+        counts = budget.split(threads, ['minimap2', 'samtools'])
+        assert sum(counts) == threads
+
+def test_split_minimum():
+    counts = budget.split(4, ['bowtie2', 'samtools'])
+    assert counts == [3, 1]
+
+def test_split_fewer_threads_than_tools():
+    counts = budget.split(1, ['bowtie2', 'samtools'])
+    assert counts == [1, 1]
+
+def test_split_unknown_tool():
+    counts = budget.split(4, ['unknown', 'samtools'])
+    assert counts == [2, 2]
+
+def test_split_custom_weights():
+    counts = budget.split(8, ['a', 'b'], weights={'a': 3, 'b': 1})
+    assert counts == [6, 2]
+
+def test_split_no_tools():
+    counts = budget.split(4, [])
+    assert counts == []
+
+def test_pin_disjoint():
+    cmds = budget.pin([['bowtie2'], ['samtools']], [3, 1], cpus={0, 1, 2, 3})
+    assert [cmd.cpus for cmd in cmds] == [{0, 1, 2}, {3}]
+    assert cmds[0] == ['bowtie2']
+
+def test_pin_wrap_around():
+    cmds = budget.pin([['bowtie2'], ['samtools']], [2, 1], cpus={0, 1})
+    assert [cmd.cpus for cmd in cmds] == [{0, 1}, {0}]
+
+def test_pin_keeps_stdout():
+    cmds = budget.pin([['echo'], exe.Command(['gzip'], stdout='out.gz')], [1, 1], cpus={0})
+    assert cmds[1].stdout == 'out.gz'
+
+def test_execute_pinned(tmp_path):
+    cpu = min(os.sched_getaffinity(0))
+    output = tmp_path / 'out'
+    cmds = [exe.Command(['grep', 'Cpus_allowed_list', '/proc/self/status'], stdout=str(output), cpus={cpu})]
+    returncodes = exe.execute(cmds)
+    assert returncodes == [0]
+    assert output.read_text().split()[-1] == str(cpu)
+
+def test_execute_async_pinned(tmp_path):
+    cpu = min(os.sched_getaffinity(0))
+    output = tmp_path / 'out'
+    cmds = [exe.Command(['grep', 'Cpus_allowed_list', '/proc/self/status'], stdout=str(output), cpus={cpu})]
+    returncodes = asyncio.run(exe.execute_async(cmds))
+    assert returncodes == [0]
+    assert output.read_text().split()[-1] == str(cpu)
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import hocort.build as build
+import hocort.catalog as catalog
+import hocort.results as results
+
+
+@pytest.fixture(autouse=True)
+def catalog_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'CATALOG_DIR', str(tmp_path / 'catalog'))
+    monkeypatch.setitem(results.versions, 'sh', 'sh 1.0')
+
+def make_fasta(tmp_path):
+    fasta = tmp_path / 'genome.fasta.gz'
+    fasta.write_bytes(b'>chr1\nACGT\n' * 100)
+    return str(fasta)
+
+def fake_commands(build_, fasta):
+    # writes the files of a Bowtie2 or BWA-MEM2 index, or fails for HISAT2
+    index = build_['path']
+    if build_['tool'] == 'hisat2':
+        return [['sh', '-c', 'exit 2']], {}
+    names = ['1.bt2', '2.bt2'] if build_['tool'] == 'bowtie2' else ['0123', 'amb', 'ann', 'bwt.2bit.64', 'pac']
+    script = '; '.join(f'echo {build_["threads"]} > {index}.{name}' for name in names)
+    return [['sh', '-c', script]], {}
+
+def test_plan(tmp_path):
+    fasta = make_fasta(tmp_path)
+    builds = build.plan(['bowtie2', 'bwamem2', 'minimap2', 'kraken2', 'biobloom'], fasta, str(tmp_path), 9, memory=0.5, taxonomy='cache')
+    by_tool = {b['tool']: b for b in builds}
+    assert by_tool['kraken2']['taxonomy'] == 'cache' and by_tool['bowtie2']['taxonomy'] is None
+    assert by_tool['bowtie2']['index'] == str(tmp_path / 'bowtie2' / 'genome')
+    assert by_tool['minimap2']['index'] == str(tmp_path / 'minimap2' / 'genome.mmi')
+    assert by_tool['kraken2']['path'] == str(tmp_path / 'kraken2')
+    assert by_tool['biobloom']['index'] == str(tmp_path / 'biobloom' / 'reference.bf')
+    # bwa-mem2 builds its index with one thread, the others share the rest
+    assert by_tool['bwamem2']['threads'] == 1
+    assert by_tool['bowtie2']['threads'] == 2
+    # the largest build is started first
+    assert builds[0]['tool'] == 'bwamem2'
+    assert by_tool['bwamem2']['memory'] == pytest.approx(28 * os.path.getsize(fasta) / 2**30)
+    with pytest.raises(ValueError):
+        build.plan(['bowtie3'], fasta, str(tmp_path), 4)
+
+def test_bbmap_heap(tmp_path, monkeypatch):
+    # the heap of BBMap is the memory reserved for its build, at most the heap allowed by the cgroup limit
+    fasta = make_fasta(tmp_path)
+    bbmap = build.plan(['bbmap'], fasta, str(tmp_path), 4, memory=64)[0]
+    bbmap['memory'] = 3
+    monkeypatch.setattr(build.resources, 'java_heap', lambda: None)
+    assert build.commands(bbmap, fasta)[0][0][-1] == '-Xmx3072m'
+    monkeypatch.setattr(build.resources, 'java_heap', lambda: 2 * 2**30)
+    assert build.commands(bbmap, fasta)[0][0][-1] == '-Xmx2048m'
+
+def test_build_all(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(build, 'commands', fake_commands)
+    fasta = make_fasta(tmp_path)
+    out = tmp_path / 'indexes'
+    out.mkdir()
+    args = ['-i', fasta, '-o', str(out), '--threads', '5', '--tools', 'bowtie2', 'bwamem2']
+    assert build.BuildAll().interface(args + ['--name', 'human']) == 0
+    report = capsys.readouterr().out.splitlines()
+    assert report[0].split('\t') == build.REPORT_COLUMNS
+    assert [row.split('\t')[:3] for row in report[1:]] == [
+        ['bowtie2', str(out / 'bowtie2' / 'genome'), 'built'],
+        ['bwamem2', str(out / 'bwamem2' / 'genome'), 'built']
+    ]
+    assert (out / 'bowtie2' / 'genome.1.bt2').read_text() == '4\n'
+    assert (out / 'bwamem2' / 'genome.amb').read_text() == '1\n'
+    assert catalog.lookup('human', 'bwamem2') == str(out / 'bwamem2' / 'genome')
+    record = catalog.read_record(catalog.record_path(str(out / 'bowtie2' / 'genome')))
+    assert record['build_time'] >= 0
+    # the builds are skipped, and the other failing build fails the command
+    assert build.BuildAll().interface(args + ['hisat2']) == 1
+    report = capsys.readouterr().out.splitlines()
+    assert [row.split('\t')[2] for row in report[1:]] == ['up to date', 'failed (2)', 'up to date']
@@ -60,3 +60,8 @@ def test_1():
 def test_2():
     cmd = BWA_MEM2().align(idx, seq1, output, seq2=seq2)
     helper(cmd, 0)
+
+def test_decision_only():
+    cmd = BWA_MEM2().align(idx, seq1, output, seq2=seq2, decision_only=True)
+    assert all(option in cmd[0] for option in ['-h', '0'])
+    helper(cmd, 0)
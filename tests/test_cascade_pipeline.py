@@ -0,0 +1,135 @@
+import tempfile
+import os
+
+import pytest
+
+from hocort.pipelines.cascade import Cascade
+from hocort.pipelines.cascade import Stage
+from hocort.pipelines.cascade import CLASSIFIERS
+
+temp_dir = tempfile.TemporaryDirectory()
+path = os.path.dirname(__file__)
+
+bt2_idx = f'{path}/test_data/bowtie2/genome'
+mn2_idx = f'{path}/test_data/minimap2/genome.mmi'
+kr2_idx = f'{path}/test_data/kraken2'
+bb_idx = f'{path}/test_data/biobloom/reference.bf'
+seq1 = f'{path}/test_data/sequences/sequences1.fastq'
+out1 = f'{temp_dir.name}/out1.fastq'
+seq2 = f'{path}/test_data/sequences/sequences2.fastq'
+out2 = f'{temp_dir.name}/out2.fastq'
+no_path = ''
+
+def stages():
+    return [Stage('biobloom', bb_idx), Stage('kraken2', kr2_idx), Stage('bowtie2', bt2_idx), Stage('minimap2', mn2_idx)]
+
+def test_stage_invalid():
+    with pytest.raises(ValueError):
+        stage = Stage('samtools', bt2_idx)
+
+def test_pipeline_no_stages():
+    with pytest.raises(ValueError):
+        returncode = Cascade().run([], seq1, out1)
+
+def test_pipeline_last_stage_classifier():
+    with pytest.raises(ValueError):
+        returncode = Cascade().run([Stage('bowtie2', bt2_idx), Stage('kraken2', kr2_idx)], seq1, out1)
+
+def test_pipeline_seq2_no_out2():
+    with pytest.raises(ValueError):
+        returncode = Cascade().run(stages(), seq1, out1, seq2=seq2)
+
+def test_plan_stream_paired():
+    steps = Cascade().plan(stages(), seq1, out1, seq2, out2, 'run', True, 20, True)
+    # biobloom cannot be streamed, the other stages run concurrently
+    assert [[stage.pipeline for stage, args in calls] for calls, links in steps] == [['biobloom'], ['kraken2', 'bowtie2', 'minimap2']]
+    (bb_calls, bb_links), (calls, links) = steps
+    assert bb_links == []
+    assert bb_calls[0][1] == [seq1, seq2, 'run/stage0_noMatch_1.fq', 'run/stage0_noMatch_2.fq', 'run/stage0', True, 20]
+    assert calls[0][1][:2] == ['run/stage0_noMatch_1.fq', 'run/stage0_noMatch_2.fq']
+    assert links == [('run/stage1_1.fastq', 'run/stage1_next_1.fastq'),
+                     ('run/stage1_2.fastq', 'run/stage1_next_2.fastq'),
+                     ('run/stage2_1.fastq', 'run/stage2_next_1.fastq'),
+                     ('run/stage2_2.fastq', 'run/stage2_next_2.fastq')]
+    assert calls[1][1][:4] == ['run/stage1_next_1.fastq', 'run/stage1_next_2.fastq', 'run/stage2_1.fastq', 'run/stage2_2.fastq']
+    assert calls[2][1][:4] == ['run/stage2_next_1.fastq', 'run/stage2_next_2.fastq', out1, out2]
+    assert sum(args[-1] for stage, args in calls) == 20
+
+def test_plan_no_stream_single():
+    steps = Cascade().plan(stages()[1:], seq1, out1, None, None, 'run', False, 8, False)
+    assert [len(calls) for calls, links in steps] == [1, 1, 1]
+    assert all(links == [] for calls, links in steps)
+    assert steps[1][0][0][1] == ['run/stage0_1.fastq', None, 'run/stage1_1.fastq', None, 'run/stage1', False, 8]
+
+def test_stage_arguments_kraken2():
+    args, kwargs = Stage('kraken2', kr2_idx, options='--quick').arguments(seq1, seq2, None, None, 'run/stage0', True, 4)
+    assert args == [kr2_idx, seq1, 'run/stage0#.fastq']
+    assert kwargs == {'seq2': seq2, 'threads': 4, 'options': '--quick', 'mfilter': True}
+
+def test_stage_arguments_aligner():
+    args, kwargs = Stage('minimap2', mn2_idx, preset='nanopore').arguments(seq1, None, out1, None, 'run/stage1', False, 4)
+    assert args == [mn2_idx, seq1, out1]
+    assert kwargs == {'preset': 'nanopore', 'seq2': None, 'threads': 4, 'options': '', 'out2': None, 'mfilter': False}
+
+def test_pipeline_other2_no_seq2():
+    with pytest.raises(ValueError):
+        returncode = Cascade().run(stages(), seq1, out1, other1=out1, other2=out2)
+
+def test_plan_other():
+    steps = Cascade().plan(stages()[1:], seq1, out1, seq2, out2, 'run', True, 8, False, other=True)
+    assert steps[0][0][0][1] == [seq1, seq2, 'run/stage0_1.fastq', 'run/stage0_2.fastq', 'run/stage0', True, 8, True]
+    args, kwargs = steps[0][0][0][0].arguments(*steps[0][0][0][1])
+    assert kwargs['other'] == 'run/stage0_other#.fastq'
+    args, kwargs = steps[1][0][0][0].arguments(*steps[1][0][0][1])
+    assert (kwargs['other1'], kwargs['other2']) == ('run/stage1_other_1.fastq', 'run/stage1_other_2.fastq')
+
+def test_stage_others():
+    # BioBloom writes both categories, the other reads are the ones not passed on
+    assert Stage('biobloom', bb_idx).others('run/stage0', True, True) == ['run/stage0_reference_1.fq', 'run/stage0_reference_2.fq']
+    assert Stage('bowtie2', bt2_idx).others('run/stage1', False, True) == ['run/stage1_other_1.fastq']
+
+def test_pipeline_1():
+    returncode = Cascade().run(stages(), seq1, out1)
+    assert returncode == 0
+
+def test_pipeline_2():
+    returncode = Cascade().run(stages(), seq1, out1, seq2=seq2, out2=out2)
+    assert returncode == 0
+
+def test_pipeline_no_stream_2():
+    returncode = Cascade().run(stages(), seq1, out1, seq2=seq2, out2=out2, stream=False)
+    assert returncode == 0
+
+def test_pipeline_shards_2():
+    returncode = Cascade().run(stages(), seq1, out1, seq2=seq2, out2=out2, threads=4, shards=2)
+    assert returncode == 0
+
+def fake_stage_run(calls, failing):
+    # copies the reads instead of running the tool, the stages in failing fail
+    async def run_async(self, seq1, seq2, out1, out2, prefix, mfilter, threads):
+        calls.append(self.pipeline)
+        if self.pipeline in failing:
+            return 1
+        out = self.outputs(prefix, False, mfilter)[0] if self.pipeline in CLASSIFIERS else out1
+        with open(seq1) as src, open(out, 'w') as dst:
+            dst.write(src.read())
+        return 0
+    return run_async
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_pipeline_resume(tmp_path, monkeypatch, shards):
+    calls = []
+    failing = {'bowtie2'}
+    monkeypatch.setattr(Stage, 'run_async', fake_stage_run(calls, failing))
+    out = str(tmp_path / 'out.fastq')
+    run = lambda: Cascade().run([Stage('kraken2', kr2_idx), Stage('bowtie2', bt2_idx)], seq1, out, stream=False, shards=shards, resume=True)
+    assert run() == 1
+    assert os.path.isdir(out + '.journal')
+    kraken2_runs = calls.count('kraken2')
+    failing.clear()
+    assert run() == 0
+    # the completed Kraken2 stages are not run again
+    assert calls.count('kraken2') == kraken2_runs
+    assert calls.count('bowtie2') == kraken2_runs * 2
+    assert sorted(open(out).read().splitlines()) == sorted(open(seq1).read().splitlines())
+    assert not os.path.exists(out + '.journal')
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+import pytest
+
+import hocort.catalog as catalog
+import hocort.results as results
+from hocort.aligners.bowtie2 import Bowtie2
+
+
+@pytest.fixture(autouse=True)
+def catalog_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'CATALOG_DIR', str(tmp_path / 'catalog'))
+    monkeypatch.setitem(results.versions, 'sh', 'sh 1.0')
+
+def build_cmds(index, log):
+    # writes the files of a Bowtie2 index, and counts the builds
+    script = f'echo built >> {log}; for s in 1 2 rev.1 rev.2; do echo $RANDOM > {index}.$s.bt2; done'
+    return [['sh', '-c', script]]
+
+def builds(log):
+    return len(log.read_text().splitlines()) if log.exists() else 0
+
+def test_build_skipped(tmp_path):
+    fasta = tmp_path / 'genome.fasta'
+    fasta.write_text('>chr1\nACGT\n')
+    index, log = str(tmp_path / 'genome'), tmp_path / 'log'
+    build = lambda parameters={}, force=False: catalog.build('bowtie2', index, str(fasta), build_cmds(index, log), parameters, force=force)
+    assert build() == 0
+    record = catalog.read_record(index + catalog.RECORD_SUFFIX)
+    assert record['fasta_checksum'] == catalog.indexes.checksum(str(fasta))
+    assert record['version'] == 'sh 1.0'
+    assert record['build_time'] >= 0
+    assert sorted(record['files']) == ['genome.1.bt2', 'genome.2.bt2', 'genome.rev.1.bt2', 'genome.rev.2.bt2']
+    assert build() == 0
+    assert builds(log) == 1
+    # touching the FASTA file does not change its checksum
+    os.utime(fasta, (time.time() + 10, time.time() + 10))
+    assert build() == 0
+    assert builds(log) == 1
+    assert build(force=True) == 0
+    assert builds(log) == 2
+    assert build(parameters={'preset': 'nanopore'}) == 0
+    assert builds(log) == 3
+    fasta.write_text('>chr1\nACGTT\n')
+    assert build(parameters={'preset': 'nanopore'}) == 0
+    assert builds(log) == 4
+    os.remove(index + '.2.bt2')
+    assert build(parameters={'preset': 'nanopore'}) == 0
+    assert builds(log) == 5
+    results.versions['sh'] = 'sh 2.0'
+    assert build(parameters={'preset': 'nanopore'}) == 0
+    assert builds(log) == 6
+
+def test_build_failure(tmp_path):
+    fasta = tmp_path / 'genome.fasta'
+    fasta.write_text('>chr1\nACGT\n')
+    index = str(tmp_path / 'genome')
+    assert catalog.build('bowtie2', index, str(fasta), [['sh', '-c', 'exit 3']], {}) == 3
+    assert catalog.read_record(index + catalog.RECORD_SUFFIX) is None
+
+def test_lookup(tmp_path):
+    fasta = tmp_path / 'genome.fasta'
+    fasta.write_text('>chr1\nACGT\n')
+    index = str(tmp_path / 'genome')
+    assert catalog.build('bowtie2', index, str(fasta), build_cmds(index, tmp_path / 'log'), {}, name='human') == 0
+    assert catalog.lookup('human', 'bowtie2') == index
+    assert catalog.lookup('human', 'kraken2') == 'human'
+    assert catalog.lookup(index, 'bowtie2') == index
+    assert Bowtie2().align('human', 'in.fastq')[0][4] == index
+    with pytest.raises(ValueError):
+        catalog.register('../human', 'bowtie2', index)
+
+def test_catalog_interface(tmp_path, capsys):
+    fasta = tmp_path / 'genome.fasta'
+    fasta.write_text('>chr1\nACGT\n')
+    index = str(tmp_path / 'genome')
+    catalog.build('bowtie2', index, str(fasta), build_cmds(index, tmp_path / 'log'), {}, name='human')
+    assert catalog.Catalog().interface([]) == 0
+    assert f'bowtie2\thuman\t{index}\tbuilt' in capsys.readouterr().out
+    assert catalog.Catalog().interface(['bowtie2', '-x', 'human']) == 0
+    assert json.loads(capsys.readouterr().out)['fasta'] == str(fasta)
+    assert catalog.Catalog().interface(['-x', str(tmp_path / 'missing')]) == 1
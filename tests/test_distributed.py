@@ -0,0 +1,153 @@
+import asyncio
+import logging
+
+import pytest
+
+import hocort.pipelines
+import hocort.distributed as distributed
+from hocort.pipelines.utils import execute_pipeline_async
+from hocort.pipelines.utils import execute_sharded_async
+
+logger = logging.getLogger(__file__)
+
+
+class Copy():
+    """
+    Pipeline which copies the reads, replacing their sequence with idx.
+
+    """
+    def commands(self, idx, seq1, out1, seq2=None, out2=None, threads=1):
+        cmds = [['sh', '-c', f'sed -e "s/ACGT/{idx}/" {seq1} > {out1}']]
+        if seq2:
+            cmds.append(['sh', '-c', f'sed -e "s/ACGT/{idx}/" {seq2} > {out2}'])
+        return cmds
+
+    async def run_async(self, *args, shards=1, ordered=False, workers=None, **kwargs):
+        if shards != 1 or workers:
+            return await execute_sharded_async(logger, self, args, kwargs, shards, ordered=ordered, pipe=False, workers=workers)
+        return await execute_pipeline_async(logger, 'Copy', self.commands(*args, **kwargs), pipe=False)
+
+@pytest.fixture
+def copy_pipeline(monkeypatch):
+    monkeypatch.setattr(hocort.pipelines, 'copy', Copy, raising=False)
+    monkeypatch.setitem(distributed.REMOTE_ARGUMENTS, 'copy', [])
+
+def write_fastq(path, reads, mate=1):
+    with open(path, 'w') as f:
+        for i in range(reads):
+            f.write(f'@read{i}/{mate}\nACGT\n+\nIIII\n')
+
+async def with_workers(addresses, coroutine, token=None, indexes=['x', 'ACGT', 'TTTT']):
+    servers = [asyncio.ensure_future(distributed.Worker(threads=1, token=token, indexes=indexes).serve(address)) for address in addresses]
+    try:
+        await asyncio.sleep(0.2)
+        return await coroutine
+    finally:
+        for server in servers:
+            server.cancel()
+        await asyncio.gather(*servers, return_exceptions=True)
+
+def test_parse_address():
+    assert distributed.parse_address('localhost:9000') == ('tcp', 'localhost', 9000)
+    assert distributed.parse_address('[::1]:9000') == ('tcp', '::1', 9000)
+    assert distributed.parse_address('unix:/tmp/hocort.sock') == ('unix', '/tmp/hocort.sock')
+    with pytest.raises(ValueError):
+        distributed.parse_address('localhost')
+
+def test_pipeline_name():
+    assert distributed.pipeline_name(hocort.pipelines.bowtie2()) == 'bowtie2'
+    assert distributed.pipeline_class('bowtie2') is hocort.pipelines.bowtie2
+    with pytest.raises(ValueError):
+        distributed.pipeline_class('__builtins__')
+
+def test_workers_tcp_paired(tmp_path, copy_pipeline):
+    write_fastq(tmp_path / 'in_1.fastq', 50000, mate=1)
+    write_fastq(tmp_path / 'in_2.fastq', 50000, mate=2)
+    addresses = ['127.0.0.1:28461', '127.0.0.1:28462']
+    pipeline = hocort.pipelines.copy()
+    returncode = asyncio.run(with_workers(addresses, pipeline.run_async('TTTT',
+                                                                       str(tmp_path / 'in_1.fastq'),
+                                                                       str(tmp_path / 'out_1.fastq'),
+                                                                       seq2=str(tmp_path / 'in_2.fastq'),
+                                                                       out2=str(tmp_path / 'out_2.fastq'),
+                                                                       shards=4,
+                                                                       ordered=True,
+                                                                       workers=addresses)))
+    assert returncode == 0
+    for mate in [1, 2]:
+        lines = (tmp_path / f'out_{mate}.fastq').read_text().splitlines()
+        assert lines[0::4] == [f'@read{i}/{mate}' for i in range(50000)]
+        assert set(lines[1::4]) == {'TTTT'}
+
+def test_workers_unix(tmp_path, copy_pipeline):
+    write_fastq(tmp_path / 'in.fastq', 1000)
+    addresses = [f'unix:{tmp_path}/worker{i}.sock' for i in range(3)]
+    pipeline = hocort.pipelines.copy()
+    returncode = asyncio.run(with_workers(addresses, pipeline.run_async('ACGT',
+                                                                       str(tmp_path / 'in.fastq'),
+                                                                       str(tmp_path / 'out.fastq'),
+                                                                       workers=addresses)))
+    assert returncode == 0
+    assert sorted((tmp_path / 'out.fastq').read_text().splitlines()) == sorted((tmp_path / 'in.fastq').read_text().splitlines())
+
+def test_worker_rejects_token(tmp_path, copy_pipeline):
+    write_fastq(tmp_path / 'in.fastq', 10)
+    addresses = [f'unix:{tmp_path}/worker.sock']
+    coroutine = distributed.run_remote(addresses[0],
+                                       'copy',
+                                       {'idx': 'x'},
+                                       {'seq1': str(tmp_path / 'in.fastq')},
+                                       {'out1': str(tmp_path / 'out.fastq')},
+                                       token='wrong')
+    returncode = asyncio.run(with_workers(addresses, coroutine, token='secret'))
+    assert returncode == 1
+    assert not (tmp_path / 'out.fastq').exists()
+
+def test_worker_rejects_arguments(tmp_path, copy_pipeline):
+    write_fastq(tmp_path / 'in.fastq', 10)
+    addresses = [f'unix:{tmp_path}/worker.sock']
+    for pipeline, arguments in [('copy', {'idx': 'x; rm -rf /'}),
+                                ('copy', {'idx': 'x', 'threads': 64}),
+                                ('copy', {'idx': '/etc/passwd'}),
+                                ('copy', {'idx': 'x', 'options': '--un /tmp/reads.fastq'}),
+                                ('bowtie2', {'idx': 'x', 'report': '/tmp/report'}),
+                                ('bowtie2', {'idx': 'x', 'preset': ['local']}),
+                                ('biobloom', {'idx': 'x'}),
+                                ('nonexistent', {'idx': 'x'})]:
+        coroutine = distributed.run_remote(addresses[0],
+                                           pipeline,
+                                           arguments,
+                                           {'seq1': str(tmp_path / 'in.fastq')},
+                                           {'out1': str(tmp_path / 'out.fastq')})
+        assert asyncio.run(with_workers(addresses, coroutine)) == 1
+
+def test_workers_unreachable(tmp_path, copy_pipeline):
+    write_fastq(tmp_path / 'in.fastq', 10)
+    pipeline = hocort.pipelines.copy()
+    returncode = asyncio.run(pipeline.run_async('x',
+                                                str(tmp_path / 'in.fastq'),
+                                                str(tmp_path / 'out.fastq'),
+                                                workers=[f'unix:{tmp_path}/missing.sock']))
+    assert returncode == 1
+
+def test_worker_check_request():
+    worker = distributed.Worker(indexes=['x'])
+    for request in [[], 'bowtie2', None]:
+        with pytest.raises(ValueError):
+            worker.check(request)
+    request = {'pipeline': 'bowtie2', 'arguments': {'idx': 'x', 'speed': 'fast'}, 'inputs': ['seq1'], 'outputs': {'out1': 'out.fastq'}}
+    assert worker.check(request) is hocort.pipelines.bowtie2
+
+def test_worker_requires_token(tmp_path):
+    with pytest.raises(ValueError):
+        asyncio.run(distributed.Worker(token='').serve('0.0.0.0:28463'))
+    assert distributed.is_local('127.0.0.1:9000') and distributed.is_local('localhost:9000') and distributed.is_local('[::1]:9000')
+    assert distributed.is_local(f'unix:{tmp_path}/worker.sock')
+    assert not distributed.is_local('node1:9000')
+
+def test_remote_arguments():
+    pipeline = hocort.pipelines.bowtie2()
+    arguments = {'idx': 'x', 'seq1': 'in.fastq', 'out1': 'out.fastq', 'options': '', 'speed': 'fast', 'threads': 8}
+    assert distributed.remote_arguments('bowtie2', pipeline, arguments) == {'idx': 'x', 'speed': 'fast'}
+    with pytest.raises(ValueError):
+        distributed.remote_arguments('bowtie2', pipeline, dict(arguments, options='--un /tmp/reads.fastq'))
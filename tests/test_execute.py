@@ -0,0 +1,192 @@
+import asyncio
+import gzip
+import os
+import time
+
+import pytest
+
+import hocort.execute as exe
+
+# writes more than a pipe buffer (64 KiB) to stderr before writing to stdout
+chatty_stderr = ['sh', '-c', 'head -c 1000000 /dev/zero | tr "\\0" "x" | fold -w 100 >&2; echo done']
+
+
+def test_not_list():
+    with pytest.raises(TypeError):
+        returncodes = exe.execute('echo')
+
+def test_single():
+    returncodes = exe.execute([['echo', 'hello']])
+    assert returncodes == [0]
+
+def test_sequential():
+    returncodes = exe.execute([['true'], ['false']])
+    assert returncodes == [0, 1]
+
+def test_pipe():
+    returncodes = exe.execute([['echo', 'hello'], ['grep', 'hello']], pipe=True)
+    assert returncodes == [0, 0]
+
+def test_pipe_no_match():
+    returncodes = exe.execute([['echo', 'hello'], ['grep', 'world']], pipe=True)
+    assert returncodes == [0, 1]
+
+def test_merge_stdout_stderr():
+    returncodes = exe.execute([chatty_stderr], merge_stdout_stderr=True)
+    assert returncodes == [0]
+
+def test_chatty_stderr():
+    returncodes = exe.execute([chatty_stderr])
+    assert returncodes == [0]
+
+def test_chatty_stderr_pipe():
+    chatty_filter = ['sh', '-c', 'cat; head -c 1000000 /dev/zero | tr "\\0" "x" | fold -w 100 >&2']
+    returncodes = exe.execute([chatty_stderr, chatty_filter, ['cat']], pipe=True)
+    assert returncodes == [0, 0, 0]
+
+def test_long_line():
+    cmd = ['sh', '-c', 'head -c 1000000 /dev/zero | tr "\\0" "x"']
+    returncodes = exe.execute([cmd])
+    assert returncodes == [0]
+
+def test_async_not_list():
+    with pytest.raises(TypeError):
+        returncodes = asyncio.run(exe.execute_async('echo'))
+
+def test_async_single():
+    returncodes = asyncio.run(exe.execute_async([['echo', 'hello']]))
+    assert returncodes == [0]
+
+def test_async_sequential():
+    returncodes = asyncio.run(exe.execute_async([['true'], ['false']]))
+    assert returncodes == [0, 1]
+
+def test_async_pipe():
+    returncodes = asyncio.run(exe.execute_async([['echo', 'hello'], ['grep', 'hello']], pipe=True))
+    assert returncodes == [0, 0]
+
+def test_async_pipe_no_match():
+    returncodes = asyncio.run(exe.execute_async([['echo', 'hello'], ['grep', 'world']], pipe=True))
+    assert returncodes == [0, 1]
+
+def test_async_chatty_stderr():
+    returncodes = asyncio.run(exe.execute_async([chatty_stderr]))
+    assert returncodes == [0]
+
+def test_async_long_line():
+    cmd = ['sh', '-c', 'head -c 1000000 /dev/zero | tr "\\0" "x"']
+    returncodes = asyncio.run(exe.execute_async([cmd]))
+    assert returncodes == [0]
+
+def test_async_concurrent():
+    async def run_all():
+        jobs = [exe.execute_async([['sleep', '0.5'], ['true']], pipe=True) for i in range(20)]
+        return await asyncio.gather(*jobs)
+    start_time = time.time()
+    results = asyncio.run(run_all())
+    assert time.time() - start_time < 5
+    assert results == [[0, 0]] * 20
+
+def test_async_cancel():
+    async def run_cancelled():
+        job = asyncio.ensure_future(exe.execute_async([['sleep', '30']]))
+        await asyncio.sleep(0.2)
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+    start_time = time.time()
+    asyncio.run(run_cancelled())
+    assert time.time() - start_time < 5
+
+def test_stages():
+    returncodes = exe.execute([['sh', '-c', 'head -c 100000 /dev/zero'], ['wc', '-c']], pipe=True)
+    assert returncodes == [0, 0]
+    assert [stage.name for stage in returncodes.stages] == ['sh', 'wc']
+    for stage in returncodes.stages:
+        assert stage.wall_time >= 0
+        assert stage.user_time >= 0
+        assert stage.system_time >= 0
+        assert stage.max_rss > 0
+    assert returncodes.stages[0].write_chars >= 100000
+    assert returncodes.stages[1].read_chars >= 100000
+
+def test_stages_signal():
+    returncodes = exe.execute([['sh', '-c', 'kill -9 $$']])
+    assert returncodes == [-9]
+    assert returncodes.stages[0].returncode == -9
+
+def test_async_stages():
+    returncodes = asyncio.run(exe.execute_async([['echo', 'hello'], ['cat']], pipe=True))
+    assert returncodes == [0, 0]
+    assert [stage.name for stage in returncodes.stages] == ['echo', 'cat']
+    assert returncodes.stages[0].wall_time >= 0
+
+def test_fail_fast_downstream():
+    start_time = time.time()
+    returncodes = exe.execute([['sh', '-c', 'sleep 30; true'], ['sh', '-c', 'exit 3']], pipe=True)
+    assert time.time() - start_time < 5
+    assert returncodes[1] == 3
+    assert returncodes[0] != 0
+    assert returncodes.failed is returncodes.stages[1]
+
+def test_fail_fast_upstream():
+    start_time = time.time()
+    returncodes = exe.execute([['sh', '-c', 'exit 2'], ['sleep', '30']], pipe=True)
+    assert time.time() - start_time < 5
+    assert returncodes[0] == 2
+    assert returncodes.failed.name == 'sh'
+
+def test_fail_fast_disabled():
+    returncodes = exe.execute([['sh', '-c', 'exit 2'], ['sleep', '1']], pipe=True, fail_fast=False)
+    assert returncodes == [2, 0]
+    assert returncodes.failed is returncodes.stages[0]
+
+def test_no_failure():
+    returncodes = exe.execute([['echo', 'hello'], ['cat']], pipe=True)
+    assert returncodes.failed is None
+
+def test_async_fail_fast():
+    start_time = time.time()
+    returncodes = asyncio.run(exe.execute_async([['sh', '-c', 'sleep 30; true'], ['sh', '-c', 'exit 3']], pipe=True))
+    assert time.time() - start_time < 5
+    assert returncodes[1] == 3
+    assert returncodes.failed is returncodes.stages[1]
+
+def test_redirect_stdout(tmp_path):
+    output = tmp_path / 'out.gz'
+    cmds = [['echo', 'hello'], exe.Command(['gzip', '-c'], stdout=str(output))]
+    returncodes = exe.execute(cmds, pipe=True)
+    assert returncodes == [0, 0]
+    assert gzip.decompress(output.read_bytes()) == b'hello\n'
+
+def test_redirect_stdout_not_last(tmp_path):
+    cmds = [exe.Command(['echo', 'hello'], stdout=str(tmp_path / 'out')), ['cat']]
+    with pytest.raises(ValueError):
+        returncodes = exe.execute(cmds, pipe=True)
+
+def test_async_redirect_stdout(tmp_path):
+    output = tmp_path / 'out'
+    cmds = [['echo', 'hello'], exe.Command(['cat'], stdout=str(output))]
+    returncodes = asyncio.run(exe.execute_async(cmds, pipe=True))
+    assert returncodes == [0, 0]
+    assert output.read_bytes() == b'hello\n'
+
+def test_redirect_stdout_failure(tmp_path):
+    returncodes = exe.execute([exe.Command(['sh', '-c', 'exit 3'], stdout=str(tmp_path / 'out'))])
+    assert returncodes == [3]
+    assert returncodes.failed.name == 'sh'
+
+def test_fifo(tmp_path):
+    fifo = str(tmp_path / 'other.fifo')
+    cmds = [exe.Command(['sh', '-c', f'echo other > {fifo}; echo hello'], fifos=[fifo]), ['cat', fifo]]
+    returncodes = exe.execute(cmds, pipe=True)
+    assert returncodes == [0, 0]
+    assert not os.path.exists(fifo)
+
+def test_async_fifo_removed_on_failure(tmp_path):
+    fifo = str(tmp_path / 'other.fifo')
+    cmds = [exe.Command(['sh', '-c', f'exec 3> {fifo}; exit 2'], fifos=[fifo]), ['cat', fifo]]
+    returncodes = asyncio.run(exe.execute_async(cmds, pipe=True))
+    assert returncodes[0] == 2
+    assert returncodes.failed.name == 'sh'
+    assert not os.path.exists(fifo)
@@ -0,0 +1,106 @@
+import gzip
+
+import pytest
+
+import hocort.parse.fastq as fastq
+from hocort.parse.fastq import FastQ
+
+
+def write_reads(path, n, mate=1):
+    records = ''.join(f'@read{i}/{mate}\nACGT\n+\nIIII\n' for i in range(n))
+    if str(path).endswith('.gz'):
+        path.write_bytes(gzip.compress(records.encode()))
+    else:
+        path.write_text(records)
+    return records
+
+def read_names(path):
+    return [line.split('/')[0] for i, line in enumerate(open(path)) if i % 4 == 0]
+
+def test_count(tmp_path):
+    write_reads(tmp_path / 'in.fastq', 10)
+    assert FastQ.count(str(tmp_path / 'in.fastq')) == 10
+
+def test_count_gz(tmp_path):
+    write_reads(tmp_path / 'in.fastq.gz', 10)
+    assert FastQ.count(str(tmp_path / 'in.fastq.gz')) == 10
+
+def test_split_ordered(tmp_path):
+    records = write_reads(tmp_path / 'in.fastq', 10)
+    shards = [str(tmp_path / f'shard{i}.fastq') for i in range(3)]
+    FastQ.split(str(tmp_path / 'in.fastq'), shards, ordered=True)
+    assert [FastQ.count(shard) for shard in shards] == [4, 3, 3]
+    FastQ.concatenate(shards, str(tmp_path / 'out.fastq'))
+    assert (tmp_path / 'out.fastq').read_text() == records
+
+def test_split_round_robin(tmp_path, monkeypatch):
+    monkeypatch.setattr(fastq, 'BLOCK_READS', 2)
+    write_reads(tmp_path / 'in.fastq.gz', 10)
+    shards = [str(tmp_path / f'shard{i}.fastq') for i in range(2)]
+    FastQ.split(str(tmp_path / 'in.fastq.gz'), shards)
+    assert read_names(shards[0]) == ['@read0', '@read1', '@read4', '@read5', '@read8', '@read9']
+    assert read_names(shards[1]) == ['@read2', '@read3', '@read6', '@read7']
+
+def test_split_pairs_consistent(tmp_path, monkeypatch):
+    monkeypatch.setattr(fastq, 'BLOCK_READS', 3)
+    write_reads(tmp_path / 'in_1.fastq', 20, mate=1)
+    write_reads(tmp_path / 'in_2.fastq', 20, mate=2)
+    for ordered in [True, False]:
+        for mate in [1, 2]:
+            FastQ.split(str(tmp_path / f'in_{mate}.fastq'), [str(tmp_path / f'shard{i}_{mate}.fastq') for i in range(3)], ordered=ordered)
+        for i in range(3):
+            assert read_names(tmp_path / f'shard{i}_1.fastq') == read_names(tmp_path / f'shard{i}_2.fastq')
+
+def test_split_more_shards_than_reads(tmp_path):
+    write_reads(tmp_path / 'in.fastq', 2)
+    shards = [str(tmp_path / f'shard{i}.fastq') for i in range(4)]
+    FastQ.split(str(tmp_path / 'in.fastq'), shards, ordered=True)
+    assert [FastQ.count(shard) for shard in shards] == [1, 1, 0, 0]
+
+def test_concatenate_gz(tmp_path):
+    (tmp_path / 'a.gz').write_bytes(gzip.compress(b'hello\n'))
+    (tmp_path / 'b.gz').write_bytes(gzip.compress(b'world\n'))
+    FastQ.concatenate([str(tmp_path / 'a.gz'), str(tmp_path / 'b.gz')], str(tmp_path / 'out.gz'))
+    assert gzip.decompress((tmp_path / 'out.gz').read_bytes()) == b'hello\nworld\n'
+
+def test_multiplex_demultiplex(tmp_path, monkeypatch):
+    monkeypatch.setattr(fastq, 'MAX_OPEN_FILES', 2)
+    inputs = []
+    for i, n in enumerate([3, 0, 5]):
+        path = tmp_path / (f'S{i}.fastq' + ('.gz' if i == 2 else ''))
+        write_reads(path, n)
+        inputs.append((f'S{i}', str(path)))
+    reads = FastQ.multiplex(inputs, str(tmp_path / 'mux.fastq'))
+    assert reads == {'S0': 3, 'S1': 0, 'S2': 5}
+    names = read_names(tmp_path / 'mux.fastq')
+    assert names[:4] == ['@S0|read0', '@S0|read1', '@S0|read2', '@S2|read0']
+
+    # interleave the samples, as the aligner does not keep them together
+    lines = (tmp_path / 'mux.fastq').read_text().splitlines(keepends=True)
+    records = [lines[i:i + 4] for i in range(0, len(lines), 4)]
+    shuffled = [records[i] for i in [3, 0, 4, 1, 5, 2, 6, 7]]
+    (tmp_path / 'aligned.fastq').write_text(''.join(''.join(record) for record in shuffled))
+
+    outputs = {'S0': str(tmp_path / 'out0.fastq'), 'S1': str(tmp_path / 'out1.fastq'), 'S2': str(tmp_path / 'out2.fastq.gz')}
+    reads = FastQ.demultiplex(str(tmp_path / 'aligned.fastq'), outputs)
+    assert reads == {'S0': 3, 'S1': 0, 'S2': 5}
+    assert (tmp_path / 'out0.fastq').read_text() == (tmp_path / 'S0.fastq').read_text()
+    assert (tmp_path / 'out1.fastq').read_text() == ''
+    assert gzip.decompress((tmp_path / 'out2.fastq.gz').read_bytes()) == gzip.decompress((tmp_path / 'S2.fastq.gz').read_bytes())
+
+def test_demultiplex_unknown_sample(tmp_path):
+    (tmp_path / 'in.fastq').write_text('@S9|read0\nACGT\n+\nIIII\n')
+    with pytest.raises(ValueError):
+        FastQ.demultiplex(str(tmp_path / 'in.fastq'), {'S0': str(tmp_path / 'out.fastq')})
+
+def test_concatenate_compress(tmp_path):
+    (tmp_path / 'a.gz').write_bytes(gzip.compress(b'hello\n'))
+    (tmp_path / 'b').write_bytes(b'world\n')
+    FastQ.concatenate([str(tmp_path / 'a.gz'), str(tmp_path / 'b')], str(tmp_path / 'out.gz'))
+    assert gzip.decompress((tmp_path / 'out.gz').read_bytes()) == b'hello\nworld\n'
+
+def test_mate_pattern():
+    assert FastQ.mate_pattern('reads_1.fastq.gz', 'reads_2.fastq.gz') == 'reads_%.fastq.gz'
+    assert FastQ.mate_pattern('run1/reads_1.fq', 'run1/reads_2.fq') == 'run1/reads_%.fq'
+    assert FastQ.mate_pattern('reads_1.fastq', 'reads_R2.fastq') is None
+    assert FastQ.mate_pattern('reads_2.fastq', 'reads_1.fastq') is None
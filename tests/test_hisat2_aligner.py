@@ -56,3 +56,8 @@ def test_1():
 def test_2():
     cmd = HISAT2().align(idx, seq1, output, seq2=seq2)
     helper(cmd, 0)
+
+def test_decision_only():
+    cmd = HISAT2().align(idx, seq1, output, seq2=seq2, decision_only=True)
+    assert all(option in cmd[0] for option in ['-k', '1'])
+    helper(cmd, 0)
@@ -84,3 +84,13 @@ def test_pipeline_seq2_no_out2():
 def test_pipeline_noseq2_out2():
     returncode = HISAT2().run(idx, seq1, out1, out2=out2)
     assert returncode == 0
+
+def test_commands_native():
+    cmds = HISAT2().commands(idx, seq1, out1 + '.gz', native=True)
+    assert len(cmds) == 1
+    assert cmds[0][cmds[0].index('--un-gz') + 1] == out1 + '.gz'
+    assert cmds[0][cmds[0].index('-S') + 1] == os.devnull
+
+def test_pipeline_native_2():
+    returncode = HISAT2().run(idx, seq1, out1, seq2=seq2, out2=out2, native=True)
+    assert returncode == 0
@@ -0,0 +1,198 @@
+import contextlib
+import os
+
+import pytest
+
+import hocort.indexes as indexes
+from hocort.aligners.bowtie2 import Bowtie2
+from hocort.pipelines.bowtie2 import Bowtie2 as Bowtie2Pipeline
+from hocort.pipelines.kraken2 import Kraken2 as Kraken2Pipeline
+from hocort.pipelines.utils import resolve_index
+
+
+def make_bowtie2_index(tmp_path):
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    for name in ['1.bt2', '2.bt2', 'rev.1.bt2', 'rev.2.bt2']:
+        (index_dir / f'genome.{name}').write_bytes(os.urandom(10000))
+    (index_dir / 'genome.fasta').write_text('>chr1\nACGT\n')
+    return str(index_dir / 'genome')
+
+def make_kraken2_index(tmp_path):
+    db = tmp_path / 'db'
+    (db / 'library').mkdir(parents=True)
+    for name in ['hash.k2d', 'opts.k2d', 'taxo.k2d']:
+        (db / name).write_bytes(os.urandom(1000))
+    (db / 'library' / 'library.fna').write_text('>chr1\nACGT\n')
+    return str(db)
+
+def test_index_files(tmp_path):
+    index = make_bowtie2_index(tmp_path)
+    files = indexes.index_files(index, 'bowtie2')
+    assert [os.path.basename(f) for f in files] == ['genome.1.bt2', 'genome.2.bt2', 'genome.rev.1.bt2', 'genome.rev.2.bt2']
+    db = make_kraken2_index(tmp_path)
+    assert [os.path.basename(f) for f in indexes.index_files(db + '/', 'kraken2')] == ['hash.k2d', 'opts.k2d', 'taxo.k2d']
+    with pytest.raises(ValueError):
+        indexes.index_files(index, 'unknown')
+
+def test_stage_resolve(tmp_path):
+    index = make_bowtie2_index(tmp_path)
+    staging = str(tmp_path / 'shm')
+    assert indexes.resolve(index, 'bowtie2', dir=staging) == index
+
+    staged = indexes.stage(index, 'bowtie2', dir=staging)
+    assert staged != index
+    assert os.path.basename(staged) == 'genome'
+    assert [os.path.basename(f) for f in indexes.index_files(staged, 'bowtie2')] == ['genome.1.bt2', 'genome.2.bt2', 'genome.rev.1.bt2', 'genome.rev.2.bt2']
+    assert not os.path.exists(staged + '.fasta')
+    assert open(staged + '.1.bt2', 'rb').read() == open(index + '.1.bt2', 'rb').read()
+    assert indexes.resolve(index, 'bowtie2', dir=staging) == staged
+    # staging again is a no-op
+    assert indexes.stage(index, 'bowtie2', dir=staging) == staged
+
+    # a changed index is not resolved to the stale copy, until it is staged again
+    with open(index + '.1.bt2', 'ab') as f:
+        f.write(b'changed')
+    assert indexes.resolve(index, 'bowtie2', dir=staging) == index
+    assert indexes.stage(index, 'bowtie2', dir=staging) == staged
+    assert open(staged + '.1.bt2', 'rb').read() == open(index + '.1.bt2', 'rb').read()
+
+    assert indexes.unstage(index, 'bowtie2', dir=staging)
+    assert indexes.resolve(index, 'bowtie2', dir=staging) == index
+    assert not indexes.unstage(index, 'bowtie2', dir=staging)
+
+def test_stage_directory_index(tmp_path):
+    db = make_kraken2_index(tmp_path)
+    staging = str(tmp_path / 'shm')
+    staged = indexes.stage(db, 'kraken2', dir=staging)
+    assert sorted(os.listdir(staged)) == ['hash.k2d', 'opts.k2d', 'taxo.k2d']
+    assert indexes.resolve(db, 'kraken2', dir=staging) == staged
+
+def test_stage_missing_index(tmp_path):
+    with pytest.raises(ValueError):
+        indexes.stage(str(tmp_path / 'missing'), 'bowtie2', dir=str(tmp_path / 'shm'))
+
+def test_pipelines_use_staged_index(tmp_path, monkeypatch):
+    staging = str(tmp_path / 'shm')
+    monkeypatch.setattr(indexes, 'STAGING_DIR', staging)
+    index = make_bowtie2_index(tmp_path)
+    db = make_kraken2_index(tmp_path)
+    staged = indexes.stage(index, 'bowtie2')
+    # the aligners take the index as given, the pipelines resolve it once per run
+    assert Bowtie2().align(index, 'in.fastq')[0][4] == index
+    def execute_pipeline(logger, name, cmds, pipe=True, cache=None):
+        # the copy is held until the run is finished
+        assert not indexes.evict(staging, 1, 0)
+        assert os.path.isdir(os.path.dirname(staged))
+        calls.append(cmds[0])
+        return 0
+    calls = []
+    # hocort.pipelines exports the pipeline classes under the names of their modules
+    monkeypatch.setitem(Bowtie2Pipeline.run.__globals__, 'execute_pipeline', execute_pipeline)
+    assert Bowtie2Pipeline().run(index, 'in.fastq', 'out.fastq') == 0
+    assert calls[0][calls[0].index('-x') + 1] == staged
+    staged = indexes.stage(db, 'kraken2')
+    with contextlib.ExitStack() as stack:
+        arguments = resolve_index('kraken2', Kraken2Pipeline().commands, [db, 'in.fastq', 'out.fastq'], {}, stack)
+    assert arguments['idx'] == staged
+    # staged copies resolve to themselves
+    assert indexes.resolve(staged, 'kraken2') == staged
+
+def test_warm_resident(tmp_path):
+    index = make_bowtie2_index(tmp_path)
+    files = indexes.index_files(index, 'bowtie2')
+    indexes.warm(files)
+    resident, size = indexes.resident(files)
+    assert size == 40000
+    assert resident == size
+
+def test_resident_empty_file(tmp_path):
+    (tmp_path / 'empty').write_bytes(b'')
+    assert indexes.resident([str(tmp_path / 'empty')]) == (0, 0)
+
+def test_warm_interface(tmp_path):
+    index = make_bowtie2_index(tmp_path)
+    staging = str(tmp_path / 'shm')
+    assert indexes.Warm().interface(['bowtie2', '-x', index, '--dir', staging]) == 0
+    assert indexes.resolve(index, 'bowtie2', dir=staging) != index
+    assert indexes.Warm().interface(['bowtie2', '-x', index, '--dir', staging, '--unstage', 'true']) == 0
+    assert indexes.resolve(index, 'bowtie2', dir=staging) == index
+    assert indexes.Warm().interface(['bowtie2', '-x', index, '--stage', 'false']) == 0
+    assert indexes.Warm().interface(['bowtie2', '-x', str(tmp_path / 'missing'), '--stage', 'false']) == 1
+
+def test_cache_verified(tmp_path):
+    index = make_bowtie2_index(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    cached = indexes.cache(index, 'bowtie2', dir=cache_dir)
+    stage_dir, manifest, last_used = indexes.copies(cache_dir)[0]
+    assert manifest['size'] == 40000
+    assert manifest['checksums']['genome.1.bt2'] == indexes.checksum(index + '.1.bt2')
+    assert indexes.checksum(cached + '.1.bt2') == indexes.checksum(index + '.1.bt2')
+
+def test_copy_verified_mismatch(tmp_path, monkeypatch):
+    (tmp_path / 'src').write_bytes(b'data')
+    monkeypatch.setattr(indexes, 'checksum', lambda path: 'corrupt')
+    with pytest.raises(OSError):
+        indexes.copy_verified(str(tmp_path / 'src'), str(tmp_path / 'dst'))
+
+def test_cache_lru_eviction(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    genomes = []
+    for i in range(3):
+        (tmp_path / f'g{i}').mkdir()
+        genomes.append(make_bowtie2_index(tmp_path / f'g{i}'))
+    # room for two indexes of 40000 bytes
+    capacity = 100000 / 2**30
+    indexes.cache(genomes[0], 'bowtie2', dir=cache_dir, capacity=capacity)
+    indexes.cache(genomes[1], 'bowtie2', dir=cache_dir, capacity=capacity)
+    # using the first index makes the second one the least recently used
+    stage_dir, manifest, last_used = indexes.copies(cache_dir)[0]
+    os.utime(os.path.join(stage_dir, indexes.MANIFEST), (last_used - 10, last_used - 10))
+    indexes.cache(genomes[0], 'bowtie2', dir=cache_dir, capacity=capacity)
+    indexes.cache(genomes[2], 'bowtie2', dir=cache_dir, capacity=capacity)
+    cached = [manifest['index'] for stage_dir, manifest, last_used in indexes.copies(cache_dir)]
+    assert sorted(cached) == sorted([genomes[0], genomes[2]])
+
+def test_evict_skips_copies_in_use(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    index = make_bowtie2_index(tmp_path)
+    with contextlib.ExitStack() as stack:
+        cached = indexes.cache(index, 'bowtie2', dir=cache_dir)
+        indexes.hold(os.path.dirname(cached), stack)
+        assert not indexes.evict(cache_dir, 0, 0)
+        assert indexes.is_current(index, 'bowtie2', os.path.dirname(cached))
+    assert indexes.evict(cache_dir, 0, 0)
+    assert not indexes.copies(cache_dir)
+
+def test_cache_too_small(tmp_path):
+    index = make_bowtie2_index(tmp_path)
+    with pytest.raises(ValueError):
+        indexes.cache(index, 'bowtie2', dir=str(tmp_path / 'cache'), capacity=1000 / 2**30)
+
+def test_resolve_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexes, 'STAGING_DIR', str(tmp_path / 'shm'))
+    monkeypatch.setattr(indexes, 'CACHE_DIR', str(tmp_path / 'cache'))
+    index = make_bowtie2_index(tmp_path)
+    with contextlib.ExitStack() as stack:
+        cached = indexes.resolve(index, 'bowtie2', stack=stack)
+        assert cached.startswith(str(tmp_path / 'cache'))
+        # the resolved copy is held until the stack is closed
+        assert not indexes.evict(str(tmp_path / 'cache'), 0, 0)
+    # a staged copy in shared memory takes precedence
+    staged = indexes.stage(index, 'bowtie2')
+    assert indexes.resolve(index, 'bowtie2') == staged
+    # indexes which do not exist, or do not fit, are used directly
+    assert indexes.resolve(str(tmp_path / 'missing'), 'bowtie2') == str(tmp_path / 'missing')
+    indexes.unstage(index, 'bowtie2')
+    indexes.unstage(index, 'bowtie2', dir=str(tmp_path / 'cache'))
+    monkeypatch.setattr(indexes, 'CACHE_SIZE', 1000 / 2**30)
+    assert indexes.resolve(index, 'bowtie2') == index
+
+def test_cache_interface(tmp_path, capsys):
+    index = make_bowtie2_index(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    assert indexes.Cache().interface(['bowtie2', '-x', index, '--dir', cache_dir]) == 0
+    assert indexes.Cache().interface(['--list', 'true', '--dir', cache_dir]) == 0
+    assert index in capsys.readouterr().out
+    assert indexes.Cache().interface(['--clear', 'true', '--dir', cache_dir]) == 0
+    assert indexes.copies(cache_dir) == []
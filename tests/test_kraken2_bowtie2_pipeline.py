@@ -1,3 +1,4 @@
+import asyncio
 import tempfile
 import os
 
@@ -53,6 +54,14 @@ def test_pipeline_2():
     returncode = Kraken2Bowtie2().run(bt2_idx, kr2_idx, seq1, out1, seq2=seq2, out2=out2)
     assert returncode == 0
 
+def test_pipeline_stream_1():
+    returncode = Kraken2Bowtie2().run(bt2_idx, kr2_idx, seq1, out1, stream=True)
+    assert returncode == 0
+
+def test_pipeline_stream_2():
+    returncode = Kraken2Bowtie2().run(bt2_idx, kr2_idx, seq1, out1, seq2=seq2, out2=out2, stream=True)
+    assert returncode == 0
+
 def test_pipeline_seq2_no_out2():
     with pytest.raises(ValueError):
         returncode = Kraken2Bowtie2().run(bt2_idx, kr2_idx, seq1, out1, seq2=seq2)
@@ -76,3 +85,11 @@ def test_pipeline_mfilter_true_2():
 def test_pipeline_mfilter_false_2():
     returncode = Kraken2Bowtie2().run(bt2_idx, kr2_idx, seq1, out1, seq2=seq2, out2=out2, mfilter=False)
     assert returncode == 0
+
+def test_pipeline_async_1():
+    returncode = asyncio.run(Kraken2Bowtie2().run_async(bt2_idx, kr2_idx, seq1, out1))
+    assert returncode == 0
+
+def test_pipeline_async_2():
+    returncode = asyncio.run(Kraken2Bowtie2().run_async(bt2_idx, kr2_idx, seq1, out1, seq2=seq2, out2=out2))
+    assert returncode == 0
@@ -3,6 +3,7 @@ import os
 
 import pytest
 
+import hocort.execute as exe
 from hocort.aligners.kraken2 import Kraken2
 
 from helper import helper
@@ -78,3 +79,38 @@ def test_1():
 def test_2():
     cmd = Kraken2().classify(idx, seq1, class_out, unclass_out, seq2=seq2)
     helper(cmd, 0)
+
+def test_report():
+    report = f'{temp_dir.name}/report.txt'
+    cmd = Kraken2().classify(idx, seq1, class_out, unclass_out, report=report)
+    helper(cmd, 0)
+
+def make_taxonomy(dir):
+    taxonomy = dir / 'taxonomy'
+    taxonomy.mkdir(parents=True)
+    for name in ['nodes.dmp', 'names.dmp', 'nucl_gb.accession2taxid', 'prelim_map.txt']:
+        (taxonomy / name).write_text(name)
+    return str(dir)
+
+def test_build_idx_cached_taxonomy(tmp_path):
+    # the files of the cached taxonomy are linked into the database, without downloading it
+    cache = make_taxonomy(tmp_path / 'cache')
+    db = str(tmp_path / 'db')
+    cmds = Kraken2().build_index(db, fasta, taxonomy=cache)
+    assert not any('--download-taxonomy' in cmd for cmd in cmds)
+    assert cmds[0][:4] == ['kraken2-build', '--threads', '1', '--add-to-library']
+    for cmd in cmds[1:3]:
+        assert exe.execute([cmd])[0] == 0
+    assert sorted(os.listdir(os.path.join(db, 'taxonomy'))) == ['names.dmp', 'nodes.dmp', 'nucl_gb.accession2taxid']
+    assert os.path.islink(os.path.join(db, 'taxonomy', 'nodes.dmp'))
+    # a bare taxonomy directory is used as is
+    assert Kraken2().taxonomy_files(os.path.join(cache, 'taxonomy')) == Kraken2().taxonomy_files(cache)
+    assert sorted(Kraken2().taxonomy_parameters(cache)['taxonomy']) == ['names.dmp', 'nodes.dmp', 'nucl_gb.accession2taxid']
+    assert Kraken2().taxonomy_parameters(None) == {}
+
+def test_build_idx_missing_taxonomy(tmp_path):
+    with pytest.raises(ValueError):
+        Kraken2().build_index(str(tmp_path / 'db'), fasta, taxonomy=str(tmp_path))
+
+def test_download_taxonomy_cached(tmp_path):
+    assert Kraken2().download_taxonomy(make_taxonomy(tmp_path / 'cache')) == 0
@@ -53,6 +53,14 @@ def test_pipeline_2():
     returncode = Kraken2HISAT2().run(hs2_idx, kr2_idx, seq1, out1, seq2=seq2, out2=out2)
     assert returncode == 0
 
+def test_pipeline_stream_1():
+    returncode = Kraken2HISAT2().run(hs2_idx, kr2_idx, seq1, out1, stream=True)
+    assert returncode == 0
+
+def test_pipeline_stream_2():
+    returncode = Kraken2HISAT2().run(hs2_idx, kr2_idx, seq1, out1, seq2=seq2, out2=out2, stream=True)
+    assert returncode == 0
+
 def test_pipeline_seq2_no_out2():
     with pytest.raises(ValueError):
         returncode = Kraken2HISAT2().run(hs2_idx, kr2_idx, seq1, out1, seq2=seq2)
@@ -1,5 +1,6 @@
 import tempfile
 import os
+import stat
 
 import pytest
 
@@ -67,3 +68,49 @@ def test_pipeline_mfilter_true_2():
 def test_pipeline_mfilter_false_2():
     returncode = Kraken2().run(idx, seq1, out, seq2=seq2, mfilter=False)
     assert returncode == 0
+
+def test_pipeline_kraken_output():
+    kraken_output = f'{temp_dir.name}/kraken_output.txt'
+    returncode = Kraken2().run(idx, seq1, out, kraken_output=kraken_output)
+    assert returncode == 0
+    assert os.path.getsize(kraken_output) > 0
+
+def test_pipeline_kraken_output_gz():
+    kraken_output = f'{temp_dir.name}/kraken_output.txt.gz'
+    returncode = Kraken2().run(idx, seq1, out, seq2=seq2, kraken_output=kraken_output)
+    assert returncode == 0
+    assert os.path.getsize(kraken_output) > 0
+
+def test_pipeline_report():
+    report = f'{temp_dir.name}/report.txt'
+    returncode = Kraken2().run(idx, seq1, out, report=report)
+    assert returncode == 0
+    assert os.path.getsize(report) > 0
+
+def test_pipeline_other_commands():
+    other = f'{temp_dir.name}/other#.fastq'
+    cmd = Kraken2().commands(idx, seq1, out, seq2=seq2, mfilter=True, other=other)[0]
+    assert cmd[cmd.index('--unclassified-out') + 1] == out
+    assert cmd[cmd.index('--classified-out') + 1] == other
+    cmd = Kraken2().commands(idx, seq1, out, seq2=seq2, mfilter=False, other=other)[0]
+    assert cmd[cmd.index('--unclassified-out') + 1] == other
+    assert cmd[cmd.index('--classified-out') + 1] == out
+
+def test_commands_speed():
+    cmd = Kraken2().commands(idx, seq1, out, speed='fast')[0]
+    assert '--quick' in cmd
+    cmd = Kraken2().commands(idx, seq1, out)[0]
+    assert '--quick' not in cmd
+
+def test_interface_streams(monkeypatch):
+    runs = []
+    def run(self, *args, **kwargs):
+        # the paths Kraken2 writes to, once # is replaced with the mate number, are the output FIFOs
+        mates = [args[2].replace('#', f'_{mate}') for mate in [1, 2]]
+        runs.append((args, kwargs, [stat.S_ISFIFO(os.stat(path).st_mode) for path in mates]))
+        return 0
+    monkeypatch.setattr(Kraken2, 'run', run)
+    assert Kraken2().interface(['-x', idx, '-i', seq1, seq2, '-o', '-']) == 0
+    args, kwargs, fifos = runs[0]
+    assert args[1] == seq1 and kwargs['seq2'] == seq2
+    assert fifos == [True, True]
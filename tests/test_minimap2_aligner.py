@@ -52,3 +52,8 @@ def test_1():
 def test_2():
     cmd = Minimap2().align(idx, seq1, output, seq2=seq2)
     helper(cmd, 0)
+
+def test_decision_only():
+    cmd = Minimap2().align(idx, seq1, output, seq2=seq2, decision_only=True)
+    assert all(option in cmd[0] for option in ['--secondary=no'])
+    helper(cmd, 0)
@@ -0,0 +1,244 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+import hocort.execute as exe
+from hocort.pipelines.utils import run_streaming
+from hocort.pipelines.utils import relay
+from hocort.pipelines.utils import RELAY_CHUNK_SIZE
+from hocort.pipelines.utils import RELAY_BUFFER_SIZE
+from hocort.pipelines.utils import run_sharded
+from hocort.pipelines.utils import create_journal
+from hocort.pipelines.utils import speed_options
+from hocort.pipelines.utils import standard_streams
+from hocort.pipelines.utils import feed
+import hocort.pipelines.utils as utils
+from hocort.pipelines.utils import Journal
+from hocort.pipelines.utils import JOURNAL_FILE
+from hocort.pipelines.utils import JOURNAL_SUFFIX
+
+logger = logging.getLogger(__file__)
+
+
+async def stage(cmd):
+    returncodes = await exe.execute_async([cmd])
+    return returncodes[0]
+
+def test_run_streaming_single(tmp_path):
+    src, dst = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    out = tmp_path / 'out'
+    producer = stage(['sh', '-c', f'echo hello > {src}'])
+    consumer = stage(['sh', '-c', f'sleep 0.5; cat {dst} > {out}'])
+    returncode = asyncio.run(run_streaming(logger, [producer, consumer], [(src, dst)]))
+    assert returncode == 0
+    assert out.read_text() == 'hello\n'
+
+def test_run_streaming_relay(tmp_path):
+    # the producer writes all of mate 1 before mate 2, the consumer reads them in lockstep
+    links = [(str(tmp_path / f'out_{i}'), str(tmp_path / f'in_{i}')) for i in (1, 2)]
+    out = tmp_path / 'out'
+    producer = stage(['sh', '-c', f'seq 200000 > {links[0][0]}; seq 200000 > {links[1][0]}'])
+    consumer = stage(['sh', '-c', f'paste {links[0][1]} {links[1][1]} | wc -l > {out}'])
+    returncode = asyncio.run(run_streaming(logger, [producer, consumer], links))
+    assert returncode == 0
+    assert out.read_text().strip() == '200000'
+
+def test_run_streaming_producer_fails(tmp_path):
+    src, dst = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    producer = stage(['sh', '-c', 'exit 1'])
+    consumer = stage(['cat', dst])
+    start_time = time.time()
+    returncode = asyncio.run(run_streaming(logger, [producer, consumer], [(src, dst)]))
+    assert returncode == 1
+    assert time.time() - start_time < 5
+
+def test_run_streaming_consumer_fails(tmp_path):
+    src, dst = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    producer = stage(['sh', '-c', f'sleep 30 > {src}'])
+    consumer = stage(['sh', '-c', 'exit 1'])
+    start_time = time.time()
+    returncode = asyncio.run(run_streaming(logger, [producer, consumer], [(src, dst)]))
+    assert returncode == 1
+    assert time.time() - start_time < 5
+
+def test_relay_backpressure(tmp_path):
+    src, dst = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    os.mkfifo(src)
+    os.mkfifo(dst)
+    threads = relay(src, dst)
+    chunks = 2 * RELAY_BUFFER_SIZE // RELAY_CHUNK_SIZE
+    def produce():
+        with open(src, 'wb') as f:
+            for i in range(chunks):
+                f.write(b'x' * RELAY_CHUNK_SIZE)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    with open(dst, 'rb') as f:
+        # the producer blocks while nothing is read, instead of being buffered entirely
+        producer.join(1)
+        assert producer.is_alive()
+        assert sum(len(chunk) for chunk in iter(lambda: f.read(RELAY_CHUNK_SIZE), b'')) == chunks * RELAY_CHUNK_SIZE
+    producer.join()
+    for thread in threads:
+        thread.join()
+
+def test_run_streaming_chain(tmp_path):
+    links = [(str(tmp_path / f'src_{i}'), str(tmp_path / f'dst_{i}')) for i in (1, 2)]
+    out = tmp_path / 'out'
+    stages = [stage(['sh', '-c', f'seq 1000 > {links[0][0]}']),
+              stage(['sh', '-c', f'grep 7 {links[0][1]} > {links[1][0]}']),
+              stage(['sh', '-c', f'wc -l < {links[1][1]} > {out}'])]
+    returncode = asyncio.run(run_streaming(logger, stages, links))
+    assert returncode == 0
+    assert out.read_text().strip() == '271'
+
+def test_run_sharded(tmp_path):
+    reads = ''.join(f'@read{i}\nACGT\n+\nIIII\n' for i in range(100))
+    (tmp_path / 'in_1.fastq').write_text(reads)
+    (tmp_path / 'in_2.fastq').write_text(reads)
+    out1, out2 = tmp_path / 'out_1.fastq', tmp_path / 'out_2.fastq'
+    def run_shard(seq1, out1, seq2, out2):
+        return stage(['sh', '-c', f'cp {seq1} {out1} && cp {seq2} {out2}'])
+    returncode = asyncio.run(run_sharded(logger, run_shard, str(tmp_path / 'in_1.fastq'), str(out1),
+                                         seq2=str(tmp_path / 'in_2.fastq'), out2=str(out2), shards=3, ordered=True))
+    assert returncode == 0
+    assert out1.read_text() == reads
+    assert out2.read_text() == reads
+
+def test_run_sharded_other(tmp_path):
+    reads = ''.join(f'@read{i}\nACGT\n+\nIIII\n' for i in range(100))
+    (tmp_path / 'in.fastq').write_text(reads)
+    out1, other1 = tmp_path / 'out.fastq', tmp_path / 'other.fastq'
+    def run_shard(seq1, out1, seq2, out2, other1, other2):
+        assert other2 is None
+        return stage(['sh', '-c', f'cp {seq1} {out1} && cp {seq1} {other1}'])
+    returncode = asyncio.run(run_sharded(logger, run_shard, str(tmp_path / 'in.fastq'), str(out1), shards=3, ordered=True, other1=str(other1)))
+    assert returncode == 0
+    assert out1.read_text() == reads
+    assert other1.read_text() == reads
+
+def test_run_sharded_failure(tmp_path):
+    (tmp_path / 'in.fastq').write_text('@read\nACGT\n+\nIIII\n' * 10)
+    def run_shard(seq1, out1, seq2, out2):
+        return stage(['sh', '-c', f'grep -q read {seq1}'])
+    returncode = asyncio.run(run_sharded(logger, run_shard, str(tmp_path / 'in.fastq'), str(tmp_path / 'out.fastq'), shards=20))
+    assert returncode == 1
+
+def write_reads(path, reads=100):
+    path.write_text(''.join(f'@read{i}\nACGT\n+\nIIII\n' for i in range(reads)))
+
+def test_run_sharded_resume(tmp_path):
+    write_reads(tmp_path / 'in.fastq')
+    out = tmp_path / 'out.fastq'
+    runs = []
+    def run_shard(seq1, out1, seq2, out2):
+        runs.append(os.path.basename(seq1))
+        # the third shard fails until the flag file exists
+        return stage(['sh', '-c', f'case {seq1} in *in2_*) test -e {tmp_path}/flag;; esac && cp {seq1} {out1}'])
+    def run():
+        journal = create_journal(str(out), {'seq1': str(tmp_path / 'in.fastq'), 'shards': 4})
+        return asyncio.run(run_sharded(logger, run_shard, str(tmp_path / 'in.fastq'), str(out), shards=4, ordered=True, journal=journal))
+    assert run() == 1
+    with open(str(out) + JOURNAL_SUFFIX + '/' + JOURNAL_FILE) as f:
+        done = json.load(f)['done']
+    assert 'split' in done and 'shard2' not in done
+    runs.clear()
+    (tmp_path / 'flag').write_text('')
+    assert run() == 0
+    # only the failed shard, and shards cancelled by the failure, run again
+    assert sorted(runs) == [f'in{i}_1.fastq' for i in range(4) if f'shard{i}' not in done]
+    assert out.read_text() == (tmp_path / 'in.fastq').read_text()
+    assert not os.path.exists(str(out) + JOURNAL_SUFFIX)
+
+def test_journal_changed_input(tmp_path):
+    write_reads(tmp_path / 'in.fastq')
+    out = str(tmp_path / 'out.fastq')
+    journal = create_journal(out, {'seq1': str(tmp_path / 'in.fastq')})
+    journal.open(logger)
+    journal.record('split')
+    journal = create_journal(out, {'seq1': str(tmp_path / 'in.fastq')})
+    journal.open(logger)
+    assert journal.is_done('split')
+    write_reads(tmp_path / 'in.fastq', reads=101)
+    journal = create_journal(out, {'seq1': str(tmp_path / 'in.fastq')})
+    journal.open(logger)
+    assert not journal.is_done('split')
+
+def test_journal_not_a_journal(tmp_path):
+    (tmp_path / 'out.fastq.journal').mkdir()
+    (tmp_path / 'out.fastq.journal' / 'data').write_text('keep')
+    with pytest.raises(ValueError):
+        Journal(str(tmp_path / 'out.fastq.journal'), {}).open(logger)
+    assert (tmp_path / 'out.fastq.journal' / 'data').exists()
+
+def test_speed_options():
+    options = {'fast': ['--quick']}
+    assert speed_options(options, 'fast') == ['--quick']
+    assert speed_options(options, 'balanced') == []
+    with pytest.raises(ValueError):
+        speed_options(options, 'fastest')
+
+def test_standard_streams_paired(tmp_path):
+    reads = [f'@read{i}/{mate}\nACGT\n+\nIIII\n' for i in range(50000) for mate in (1, 2)]
+    stdin = tmp_path / 'stdin.fastq.gz'
+    stdin.write_bytes(gzip.compress(''.join(reads).encode()))
+    stdout = tmp_path / 'stdout.fastq'
+    with open(stdin, 'rb') as i, open(stdout, 'wb') as o:
+        with standard_streams(['-', '-'], ['-'], stdin=i, stdout=o) as (seq, out):
+            assert [os.path.basename(path) for path in out] == ['stdout_1.fastq', 'stdout_2.fastq']
+            # mate 2 is read and written entirely before mate 1, which fits into the buffers
+            returncode = asyncio.run(stage(['sh', '-c', f'cat {seq[1]} > {out[1]} && cat {seq[0]} > {out[0]}']))
+            assert returncode == 0
+    assert stdout.read_text() == ''.join(reads)
+
+def test_feed_backpressure(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'STREAM_BLOCK_READS', 100)
+    stdin = tmp_path / 'stdin.fastq'
+    write_reads(stdin, reads=100 * 20 * utils.STREAM_QUEUE_BLOCKS)
+    fifo = str(tmp_path / 'fifo')
+    os.mkfifo(fifo)
+    with open(stdin, 'rb') as src:
+        threads = feed(src, [fifo])
+        time.sleep(0.5)
+        # stdin is only read as far as the buffers reach while the FIFO is not read
+        assert src.tell() < os.path.getsize(stdin) / 2
+        with open(fifo, 'rb') as f:
+            assert f.read() == stdin.read_bytes()
+        for thread in threads:
+            thread.join()
+
+def test_standard_streams_unused(tmp_path):
+    stdin = tmp_path / 'stdin.fastq'
+    write_reads(stdin)
+    stdout = tmp_path / 'stdout.fastq'
+    start_time = time.time()
+    with open(stdin, 'rb') as i, open(stdout, 'wb') as o:
+        with standard_streams(['-'], ['-'], stdin=i, stdout=o) as (seq, out):
+            # the pipeline fails without opening the FIFOs
+            assert asyncio.run(stage(['sh', '-c', 'exit 1'])) == 1
+    assert stdout.read_text() == ''
+    assert time.time() - start_time < 5
+    assert not os.path.exists(os.path.dirname(seq[0]))
+
+def test_standard_streams_files(tmp_path):
+    with standard_streams(['in.fastq'], ['out.fastq']) as (seq, out):
+        assert (seq, out) == (['in.fastq'], ['out.fastq'])
+    with pytest.raises(ValueError):
+        with standard_streams(['in_1.fastq', 'in_2.fastq'], ['-', 'out_2.fastq']):
+            pass
+
+def test_run_sharded_stream(tmp_path):
+    fifo = str(tmp_path / 'in.fastq')
+    os.mkfifo(fifo)
+    def run_shard(seq1, out1, seq2, out2):
+        return stage(['cp', seq1, out1])
+    with pytest.raises(ValueError):
+        asyncio.run(run_sharded(logger, run_shard, fifo, str(tmp_path / 'out.fastq'), ordered=True))
+    with pytest.raises(ValueError):
+        create_journal(str(tmp_path / 'out.fastq'), {'seq1': fifo})
@@ -0,0 +1,73 @@
+import os
+
+import hocort.resources as resources
+
+
+def cgroup_v2(tmp_path, cpu_max=None, memory_max=None):
+    root = tmp_path / 'cgroup'
+    group = root / 'kubepods' / 'pod1'
+    group.mkdir(parents=True)
+    if cpu_max:
+        (group / 'cpu.max').write_text(cpu_max + '\n')
+    if memory_max:
+        (group / 'memory.max').write_text(memory_max + '\n')
+    proc_cgroup = tmp_path / 'proc_cgroup'
+    proc_cgroup.write_text('0::/kubepods/pod1\n')
+    return str(root), str(proc_cgroup)
+
+def cgroup_v1(tmp_path, quota, period, memory):
+    root = tmp_path / 'cgroup'
+    cpu = root / 'cpu,cpuacct' / 'docker' / 'abc'
+    mem = root / 'memory' / 'docker' / 'abc'
+    cpu.mkdir(parents=True)
+    mem.mkdir(parents=True)
+    (cpu / 'cpu.cfs_quota_us').write_text(f'{quota}\n')
+    (cpu / 'cpu.cfs_period_us').write_text(f'{period}\n')
+    (mem / 'memory.limit_in_bytes').write_text(f'{memory}\n')
+    proc_cgroup = tmp_path / 'proc_cgroup'
+    proc_cgroup.write_text('12:memory:/docker/abc\n4:cpu,cpuacct:/docker/abc\n1:name=systemd:/docker/abc\n')
+    return str(root), str(proc_cgroup)
+
+def test_v2_cpu_limit(tmp_path):
+    root, proc_cgroup = cgroup_v2(tmp_path, cpu_max='1600000 100000')
+    assert resources.cgroup_cpu_limit(root=root, proc_cgroup=proc_cgroup) == 16
+
+def test_v2_cpu_no_limit(tmp_path):
+    root, proc_cgroup = cgroup_v2(tmp_path, cpu_max='max 100000')
+    assert resources.cgroup_cpu_limit(root=root, proc_cgroup=proc_cgroup) is None
+
+def test_v2_parent_limit(tmp_path):
+    root, proc_cgroup = cgroup_v2(tmp_path, cpu_max='max 100000')
+    (tmp_path / 'cgroup' / 'kubepods' / 'cpu.max').write_text('250000 100000\n')
+    assert resources.cgroup_cpu_limit(root=root, proc_cgroup=proc_cgroup) == 2.5
+
+def test_v2_memory_limit(tmp_path):
+    root, proc_cgroup = cgroup_v2(tmp_path, memory_max=str(8 * 2**30))
+    assert resources.cgroup_memory_limit(root=root, proc_cgroup=proc_cgroup) == 8 * 2**30
+
+def test_v2_memory_no_limit(tmp_path):
+    root, proc_cgroup = cgroup_v2(tmp_path, memory_max='max')
+    assert resources.cgroup_memory_limit(root=root, proc_cgroup=proc_cgroup) is None
+
+def test_v1_limits(tmp_path):
+    root, proc_cgroup = cgroup_v1(tmp_path, 400000, 100000, 2**30)
+    assert resources.cgroup_cpu_limit(root=root, proc_cgroup=proc_cgroup) == 4
+    assert resources.cgroup_memory_limit(root=root, proc_cgroup=proc_cgroup) == 2**30
+
+def test_v1_no_limits(tmp_path):
+    root, proc_cgroup = cgroup_v1(tmp_path, -1, 100000, 9223372036854771712)
+    assert resources.cgroup_cpu_limit(root=root, proc_cgroup=proc_cgroup) is None
+    assert resources.cgroup_memory_limit(root=root, proc_cgroup=proc_cgroup) is None
+
+def test_no_cgroup(tmp_path):
+    proc_cgroup = str(tmp_path / 'missing')
+    assert resources.cgroup_cpu_limit(root=str(tmp_path), proc_cgroup=proc_cgroup) is None
+    assert resources.cgroup_memory_limit(root=str(tmp_path), proc_cgroup=proc_cgroup) is None
+
+def test_available_cpus():
+    cpus = resources.available_cpus()
+    assert 1 <= cpus <= len(os.sched_getaffinity(0))
+
+def test_available_memory():
+    memory = resources.available_memory()
+    assert memory is None or memory > 0
@@ -0,0 +1,145 @@
+import asyncio
+import os
+
+import pytest
+
+import hocort.results as results
+from hocort.pipelines.bowtie2 import Bowtie2
+from hocort.pipelines.kraken2 import Kraken2
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'results')
+    monkeypatch.setattr(results, 'CACHE_DIR', cache_dir)
+    for tool in ['bowtie2', 'kraken2', 'samtools']:
+        monkeypatch.setitem(results.versions, tool, f'{tool} 1.0')
+    return cache_dir
+
+def make_fastq(path, reads=10):
+    path.write_text(''.join(f'@read{i}\nACGT\n+\nIIII\n' for i in range(reads)))
+    return str(path)
+
+def make_bowtie2_index(tmp_path):
+    for name in ['1.bt2', '2.bt2', 'rev.1.bt2', 'rev.2.bt2']:
+        (tmp_path / f'genome.{name}').write_bytes(os.urandom(100))
+    return str(tmp_path / 'genome')
+
+def make_kraken2_index(tmp_path):
+    db = tmp_path / 'db'
+    db.mkdir()
+    for name in ['hash.k2d', 'opts.k2d', 'taxo.k2d']:
+        (db / name).write_bytes(os.urandom(100))
+    return str(db)
+
+def test_entry_disabled(tmp_path):
+    seq1 = make_fastq(tmp_path / 'in.fastq')
+    assert results.entry('bowtie2', Bowtie2().commands, [make_bowtie2_index(tmp_path), seq1, 'out.fastq'], {}, dir=None) is None
+
+def test_entry_key(tmp_path, cache_dir):
+    idx = make_bowtie2_index(tmp_path)
+    seq1 = make_fastq(tmp_path / 'in.fastq')
+    key = lambda *args, **kwargs: results.entry('bowtie2', Bowtie2().commands, args, kwargs)['key']
+    first = key(idx, seq1, str(tmp_path / 'out.fastq'))
+    # the output paths, threads and memory-mapping do not affect the result
+    assert key(idx, seq1, str(tmp_path / 'other.fastq'), threads=8, mmap=True) == first
+    assert key(idx, seq1, str(tmp_path / 'out.fastq.gz')) != first
+    assert key(idx, seq1, str(tmp_path / 'out.fastq'), mfilter=False) != first
+    assert key(idx, seq1, str(tmp_path / 'out.fastq'), options='--very-fast') != first
+    make_fastq(tmp_path / 'in.fastq', reads=11)
+    assert key(idx, seq1, str(tmp_path / 'out.fastq')) != first
+    results.versions['bowtie2'] = 'bowtie2 2.0'
+    assert key(idx, seq1, str(tmp_path / 'out.fastq'), mfilter=True) != first
+
+def test_entry_not_cacheable(tmp_path, cache_dir, monkeypatch):
+    idx = make_bowtie2_index(tmp_path)
+    seq1 = make_fastq(tmp_path / 'in.fastq')
+    os.mkfifo(tmp_path / 'fifo')
+    assert results.entry('bowtie2', Bowtie2().commands, [idx, str(tmp_path / 'fifo'), 'out.fastq'], {}) is None
+    assert results.entry('bowtie2', Bowtie2().commands, [idx, seq1, str(tmp_path / 'fifo')], {}) is None
+    assert results.entry('bowtie2', Bowtie2().commands, [str(tmp_path / 'missing'), seq1, 'out.fastq'], {}) is None
+    assert results.entry('biobloom', Bowtie2().commands, [idx, seq1, 'out.fastq'], {}) is None
+    monkeypatch.setitem(results.versions, 'samtools', None)
+    assert results.entry('bowtie2', Bowtie2().commands, [idx, seq1, 'out.fastq'], {}) is None
+
+def test_output_files():
+    assert results.output_files({'out': 'o#.fastq', 'seq2': 'in2.fastq', 'report': 'r.txt', 'kraken_output': None}) == \
+        {'out_1': 'o_1.fastq', 'out_2': 'o_2.fastq', 'report': 'r.txt'}
+    assert results.output_files({'out1': 'o1.fastq', 'out2': None, 'seq2': None}) == {'out1': 'o1.fastq'}
+    assert results.output_files({'out': 'o#.fastq', 'other': 'x#.fastq', 'seq2': 'in2.fastq'}) == \
+        {'out_1': 'o_1.fastq', 'out_2': 'o_2.fastq', 'other_1': 'x_1.fastq', 'other_2': 'x_2.fastq'}
+    assert results.output_files({'out1': 'o1.fastq', 'other1': 'x1.fastq', 'other2': None}) == {'out1': 'o1.fastq', 'other1': 'x1.fastq'}
+
+def test_store_restore(tmp_path, cache_dir):
+    idx = make_bowtie2_index(tmp_path)
+    seq1 = make_fastq(tmp_path / 'in.fastq')
+    out1 = tmp_path / 'out.fastq'
+    entry = results.entry('bowtie2', Bowtie2().commands, [idx, seq1, str(out1)], {})
+    assert not results.restore(entry)
+    out1.write_text('result')
+    assert results.store(entry)
+    out1.unlink()
+    assert results.restore(entry)
+    assert out1.read_text() == 'result'
+
+def test_store_eviction(tmp_path, cache_dir):
+    idx = make_bowtie2_index(tmp_path)
+    entries = []
+    for i in range(3):
+        seq1 = make_fastq(tmp_path / f'in{i}.fastq', reads=i + 1)
+        out1 = tmp_path / f'out{i}.fastq'
+        out1.write_bytes(os.urandom(1000))
+        entries.append(results.entry('bowtie2', Bowtie2().commands, [idx, seq1, str(out1)], {}))
+        assert results.store(entries[-1], capacity=2500 / 2**30)
+    assert not os.path.isdir(entries[0]['dir'])
+    assert os.path.isdir(entries[1]['dir']) and os.path.isdir(entries[2]['dir'])
+    (tmp_path / 'big.fastq').write_bytes(os.urandom(3000))
+    big = results.entry('bowtie2', Bowtie2().commands, [idx, seq1, str(tmp_path / 'big.fastq')], {'mfilter': False})
+    assert not results.store(big, capacity=2500 / 2**30)
+
+def test_kraken2_reuses_result(tmp_path, cache_dir):
+    # kraken2 is not run, a cached result is reused instead
+    db = make_kraken2_index(tmp_path)
+    seq1 = make_fastq(tmp_path / 'in_1.fastq')
+    seq2 = make_fastq(tmp_path / 'in_2.fastq')
+    out = str(tmp_path / 'out#.fastq')
+    entry = results.entry('kraken2', Kraken2().commands, [db, seq1, out], {'seq2': seq2, 'report': str(tmp_path / 'report.txt')})
+    for role, path in entry['outputs'].items():
+        with open(path, 'w') as f:
+            f.write(role)
+    results.store(entry)
+    for path in entry['outputs'].values():
+        os.remove(path)
+    assert Kraken2().run(db, seq1, out, seq2=seq2, threads=4, report=str(tmp_path / 'report.txt')) == 0
+    assert (tmp_path / 'out_2.fastq').read_text() == 'out_2'
+    assert (tmp_path / 'report.txt').read_text() == 'report'
+
+def test_aligner_reuses_result(tmp_path, cache_dir):
+    idx = make_bowtie2_index(tmp_path)
+    seq1 = make_fastq(tmp_path / 'in_1.fastq')
+    seq2 = make_fastq(tmp_path / 'in_2.fastq')
+    out1, out2 = str(tmp_path / 'out_1.fastq'), str(tmp_path / 'out_2.fastq')
+    entry = results.entry('bowtie2', Bowtie2().commands, [idx, seq1, out1], {'seq2': seq2, 'out2': out2})
+    for path in [out1, out2]:
+        with open(path, 'w') as f:
+            f.write('result')
+    results.store(entry)
+    os.remove(out1)
+    assert asyncio.run(Bowtie2().run_async(idx, seq1, out1, seq2=seq2, out2=out2)) == 0
+    assert open(out1).read() == 'result'
+    os.remove(out2)
+    assert asyncio.run(Bowtie2().run_async(idx, seq1, out1, seq2=seq2, out2=out2, shards=2)) == 0
+    assert open(out2).read() == 'result'
+
+def test_fingerprint_recorded(tmp_path, cache_dir, monkeypatch):
+    seq1 = make_fastq(tmp_path / 'in.fastq')
+    checksum = results.fingerprint(seq1, cache_dir)
+    # a later process only reads the recorded checksum
+    monkeypatch.setattr(results, 'fingerprints', {})
+    checksums = []
+    monkeypatch.setattr(results.indexes, 'checksum', lambda path: checksums.append(path) or 'changed')
+    assert results.fingerprint(seq1, cache_dir) == checksum
+    assert checksums == []
+    monkeypatch.setattr(results, 'fingerprints', {})
+    make_fastq(tmp_path / 'in.fastq', reads=11)
+    assert results.fingerprint(seq1, cache_dir) == 'changed'
@@ -1,6 +1,7 @@
 import tempfile
 import os
 
+import hocort.execute as exe
 from hocort.parse.sam import SAM
 
 from helper import helper
@@ -11,6 +12,8 @@ path = os.path.dirname(__file__)
 seq1 = f'{path}/test_data/sequences/sequences1.fastq'
 out_1_fastq = f'{temp_dir.name}/out_1.fastq'
 out_2_fastq = f'{temp_dir.name}/out_2.fastq'
+other_1_fastq = f'{temp_dir.name}/other_1.fastq'
+other_2_fastq = f'{temp_dir.name}/other_2.fastq'
 out_sam = f'{temp_dir.name}/out.sam'
 ids = f'{path}/test_data/sequences/ids.list'
 sam_paired = f'{path}/test_data/sequences/paired.sam'
@@ -48,3 +51,41 @@ def test_sam_to_fastq_unpaired_mfilter_true():
 def test_sam_to_fastq_unpaired_mfilter_false():
     cmd = SAM.sam_to_fastq(input_path=sam_unpaired, out1=out_1_fastq, mfilter=False)
     helper(cmd, 0)
+
+def count_reads(*paths):
+    count = 0
+    for path in paths:
+        with open(path) as f:
+            count += sum(1 for line in f) // 4
+    return count
+
+def test_sam_to_fastq_other_paired():
+    # one pair with a single mapped mate, one unmapped pair and one mapped pair
+    sam = f'{temp_dir.name}/mixed.sam'
+    flags = {('test0', '65'): '73', ('test0', '129'): '133', ('test1', '65'): '77', ('test1', '129'): '141'}
+    with open(sam_paired) as f, open(sam, 'w') as out:
+        for line in f:
+            fields = line.split('\t')
+            if not line.startswith('@'):
+                fields[1] = flags.get((fields[0], fields[1]), fields[1])
+            out.write('\t'.join(fields))
+    for mfilter in [True, False]:
+        cmds = SAM.sam_to_fastq(input_path=sam, out1=out_1_fastq, out2=out_2_fastq, mfilter=mfilter,
+                                other1=other_1_fastq, other2=other_2_fastq)
+        # the rejects are converted without filtering them again
+        assert cmds[2][-5:] == ['-1', other_1_fastq, '-2', other_2_fastq, cmds[0].fifos[0]]
+        returncodes = exe.execute(cmds, pipe=True)
+        assert returncodes == [0, 0, 0]
+        assert count_reads(out_1_fastq, out_2_fastq) == 2
+        assert count_reads(other_1_fastq, other_2_fastq) == 4
+
+def test_sam_to_fastq_other_unpaired():
+    cmds = SAM.sam_to_fastq(input_path=sam_unpaired, out1=out_1_fastq, mfilter=False, other1=other_1_fastq)
+    assert cmds[0][-4:] == [cmds[0].fifos[0], '-F', '4', sam_unpaired]
+    assert cmds[1][-3:] == ['-0', out_1_fastq, '-']
+    assert cmds[2][-3:] == ['-0', other_1_fastq, cmds[0].fifos[0]]
+    returncodes = exe.execute(cmds, pipe=True)
+    assert returncodes == [0, 0, 0]
+    with open(sam_unpaired) as f:
+        records = sum(1 for line in f if not line.startswith('@'))
+    assert count_reads(out_1_fastq) + count_reads(other_1_fastq) == records